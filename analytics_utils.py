@@ -0,0 +1,319 @@
+"""
+    This module contains the analytics of a finished (or running) game, computed on dense NumPy arrays
+    of players x tasks instead of looping over the dictionaries of every player.
+    NumPy is needed (pip install numpy), Parquet export also needs PyArrow (pip install pyarrow).
+
+    Classes:
+        - ScoreMatrix: The players x tasks matrices of the game, with the rankings and the reports.
+
+    Usage (exports the matrix of a saved game):
+        python analytics_utils.py saved/game_save report.csv
+        python analytics_utils.py saved/game.sqlite report.parquet --storage sqlite
+"""
+import csv
+import io
+import logging
+import warnings
+from typing import Any, Dict, List, Union
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+EXPORT_FORMATS = ["csv", "parquet"]
+
+EXPORT_FIELDS = [
+    "user_id",
+    "rank",
+    "points",
+    "task_no",
+    "solved",
+    "standing",
+    "attempts",
+    "solve_time",
+    "solved_at",
+]
+
+
+class ScoreMatrix:
+    """
+    This class is used to store the game as players x tasks matrices.
+    Row i is the player user_ids[i], column j is the task task_nos[j].
+
+    Attributes:
+        - user_ids: The IDs of the players (rows).
+        - task_nos: The numbers of the tasks (columns).
+        - task_points: The points of every task.
+        - points: The points of every player.
+        - solved: Whether the player solved the task.
+        - standing: The standing of the player in the task (0 if not solved).
+        - attempts: The number of answers of the player to the task (wrong ones and the right one).
+        - solved_at: When the player solved the task (timestamp, NaN if not solved).
+        - solve_time: Seconds from the release of the task for the player to the solve (NaN if unknown).
+    """
+
+    def __init__(self, game: Any):
+        """
+        The constructor. Builds the matrices from the game in one pass over the players.
+
+        Parameters:
+            - game: The game.
+        """
+        if np is None:
+            raise ValueError("Analytics need NumPy installed (pip install numpy)")
+        with game.lock:
+            self.user_ids = list(game.players.keys())
+            self.task_nos = sorted(game.tasks.keys())
+            column = {task_no: j for j, task_no in enumerate(self.task_nos)}
+            tasks = [game.tasks[task_no] for task_no in self.task_nos]
+            self.task_points = np.array([int(task.points) for task in tasks], dtype=np.int64)
+            self.points = np.array(
+                [player.points for player in game.players.values()], dtype=np.int64
+            )
+
+            solved_rows, solved_cols, standings, solved_at = [], [], [], []
+            wrong_rows, wrong_cols, wrong = [], [], []
+            for i, player in enumerate(game.players.values()):
+                for task_no, standing in player.standings.items():
+                    if task_no in column:
+                        solved_rows.append(i)
+                        solved_cols.append(column[task_no])
+                        standings.append(standing)
+                        solved_at.append(player.solved_at.get(task_no, np.nan))
+                for task_no, count in player.wrong_answers.items():
+                    if task_no in column:
+                        wrong_rows.append(i)
+                        wrong_cols.append(column[task_no])
+                        wrong.append(count)
+
+        shape = (len(self.user_ids), len(self.task_nos))
+        self.solved = np.zeros(shape, dtype=bool)
+        self.standing = np.zeros(shape, dtype=np.int32)
+        self.attempts = np.zeros(shape, dtype=np.int32)
+        self.solved_at = np.full(shape, np.nan)
+        self.solved[solved_rows, solved_cols] = True
+        self.standing[solved_rows, solved_cols] = standings
+        self.solved_at[solved_rows, solved_cols] = solved_at
+        self.attempts[wrong_rows, wrong_cols] = wrong
+        self.attempts += self.solved
+
+        # A task is released at its time, or for the player when the needed task was solved
+        release = np.array(
+            [
+                task.date_and_time.timestamp() if task.date_and_time is not None else np.nan
+                for task in tasks
+            ]
+        )
+        release = np.broadcast_to(release, shape).copy()
+        for j, task in enumerate(tasks):
+            if task.needed_task in column:
+                release[:, j] = np.fmax(release[:, j], self.solved_at[:, column[task.needed_task]])
+        self.solve_time = self.solved_at - release
+        logging.info("[ANALYTICS] Matrix of " + str(shape[0]) + " x " + str(shape[1]) + " built.")
+
+    def order(self) -> "np.ndarray":
+        """
+        Returns the rows sorted by the ranking: more points first, ties broken by who got the points
+        first (the earlier last solve), then by the user ID.
+        """
+        last_solve = np.where(self.solved, self.solved_at, -np.inf).max(axis=1, initial=-np.inf)
+        last_solve = np.where(np.isfinite(last_solve), last_solve, np.inf)
+        names = np.array(self.user_ids, dtype=str)
+        return np.lexsort((names, last_solve, -self.points))
+
+    def ranks(self) -> "np.ndarray":
+        """
+        Returns the rank of every player (1 is the best, players with equal points and equal
+        last solve share the rank).
+        """
+        order = self.order()
+        last_solve = np.where(self.solved, self.solved_at, -np.inf).max(axis=1, initial=-np.inf)
+        points = self.points[order]
+        last_solve = last_solve[order]
+        new_rank = np.ones(len(order), dtype=bool)
+        new_rank[1:] = (points[1:] != points[:-1]) | (last_solve[1:] != last_solve[:-1])
+        positions = np.arange(1, len(order) + 1)
+        ranks = np.empty(len(order), dtype=np.int64)
+        ranks[order] = np.maximum.accumulate(np.where(new_rank, positions, 0))
+        return ranks
+
+    def task_difficulty(self) -> List[Dict[str, Any]]:
+        """
+        Returns the difficulty of every task: how many players tried and solved it, the share of the
+        players that tried and failed, the mean attempts of the solvers and the median solve time.
+        """
+        tried = (self.attempts > 0).sum(axis=0)
+        solvers = self.solved.sum(axis=0)
+        with warnings.catch_warnings(), np.errstate(invalid="ignore", divide="ignore"):
+            warnings.simplefilter("ignore", RuntimeWarning)
+            mean_attempts = (self.attempts * self.solved).sum(axis=0) / solvers
+            failure_rate = 1 - solvers / tried
+            median_solve_time = np.nanmedian(self.solve_time, axis=0)
+        return [
+            {
+                "task_no": task_no,
+                "points": int(self.task_points[j]),
+                "tried": int(tried[j]),
+                "solved": int(solvers[j]),
+                "failure_rate": _number(failure_rate[j]),
+                "mean_attempts": _number(mean_attempts[j]),
+                "median_solve_time": _number(median_solve_time[j]),
+            }
+            for j, task_no in enumerate(self.task_nos)
+        ]
+
+    def task_correlation(self) -> "np.ndarray":
+        """
+        Returns the correlation of solving every two tasks (tasks x tasks, phi coefficient,
+        NaN for tasks solved by everyone or no one).
+        """
+        with warnings.catch_warnings(), np.errstate(invalid="ignore", divide="ignore"):
+            warnings.simplefilter("ignore", RuntimeWarning)
+            return np.corrcoef(self.solved.T.astype(np.float64))
+
+    def cohorts(self, n: int = 4) -> List[Dict[str, Any]]:
+        """
+        Returns the summary of n cohorts of players of equal size, from the best to the worst by the ranking.
+
+        Parameters:
+            - n: The number of cohorts.
+        """
+        result = []
+        for k, rows in enumerate(np.array_split(self.order(), n)):
+            if len(rows) == 0:
+                continue
+            attempts = int(self.attempts[rows].sum())
+            solved = self.solved[rows]
+            result.append(
+                {
+                    "cohort": k + 1,
+                    "players": int(len(rows)),
+                    "mean_points": _number(self.points[rows].mean()),
+                    "mean_solved": _number(solved.sum(axis=1).mean()),
+                    "accuracy": _number(solved.sum() / attempts) if attempts > 0 else None,
+                    "solve_rate_by_task": {
+                        task_no: _number(rate)
+                        for task_no, rate in zip(self.task_nos, solved.mean(axis=0))
+                    },
+                }
+            )
+        return result
+
+    def report(self, top: int = 10, cohorts: int = 4) -> Dict[str, Any]:
+        """
+        Returns the whole report: the top of the ranking, the difficulty of the tasks, the cohorts
+        and the most correlated pairs of tasks.
+
+        Parameters:
+            - top: How many players of the ranking are returned.
+            - cohorts: The number of cohorts.
+        """
+        order = self.order()
+        ranks = self.ranks()
+        correlation = self.task_correlation()
+        pairs = []
+        if len(self.task_nos) > 1:
+            upper = np.triu_indices(len(self.task_nos), k=1)
+            values = np.nan_to_num(correlation[upper], nan=-np.inf)
+            for index in np.argsort(-values)[:top]:
+                if np.isfinite(values[index]):
+                    pairs.append(
+                        {
+                            "tasks": [self.task_nos[upper[0][index]], self.task_nos[upper[1][index]]],
+                            "correlation": _number(values[index]),
+                        }
+                    )
+        return {
+            "players": len(self.user_ids),
+            "tasks": len(self.task_nos),
+            "ranking": [
+                {
+                    "rank": int(ranks[i]),
+                    "user_id": self.user_ids[i],
+                    "points": int(self.points[i]),
+                    "solved": int(self.solved[i].sum()),
+                }
+                for i in order[:top]
+            ],
+            "task_difficulty": self.task_difficulty(),
+            "cohorts": self.cohorts(cohorts),
+            "correlated_tasks": pairs,
+        }
+
+    def export(self, export_format: str) -> Union[str, bytes]:
+        """
+        Exports the matrix in the long format: one row for every player and task the player answered.
+
+        Parameters:
+            - export_format: One of EXPORT_FORMATS.
+
+        Returns:
+            The text of the CSV or the bytes of the Parquet file.
+        """
+        rows, cols = np.nonzero(self.attempts)
+        ranks = self.ranks()
+        columns = {
+            "user_id": [self.user_ids[i] for i in rows],
+            "rank": ranks[rows],
+            "points": self.points[rows],
+            "task_no": np.array(self.task_nos, dtype=np.int64)[cols],
+            "solved": self.solved[rows, cols],
+            "standing": self.standing[rows, cols],
+            "attempts": self.attempts[rows, cols],
+            "solve_time": self.solve_time[rows, cols],
+            "solved_at": self.solved_at[rows, cols],
+        }
+        if export_format == "parquet":
+            if pyarrow is None:
+                raise ValueError("Parquet export needs PyArrow installed (pip install pyarrow)")
+            output = io.BytesIO()
+            pyarrow.parquet.write_table(pyarrow.table(columns), output)
+            return output.getvalue()
+        elif export_format == "csv":
+            output = io.StringIO()
+            writer = csv.writer(output)
+            writer.writerow(EXPORT_FIELDS)
+            values = [
+                columns[field].tolist() if field != "user_id" else columns[field]
+                for field in EXPORT_FIELDS
+            ]
+            for row in zip(*values):
+                writer.writerow(["" if value != value else value for value in row])
+            return output.getvalue()
+        raise ValueError("Unknown export format '" + export_format + "'")
+
+
+def _number(value: Any) -> Any:
+    # NumPy numbers as JSON ones (NaN as None)
+    value = float(value)
+    return None if value != value else round(value, 3)
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    import storage_utils
+
+    parser = argparse.ArgumentParser(description="Export the score matrix of a saved game.")
+    parser.add_argument("game")
+    parser.add_argument("file")
+    parser.add_argument("--storage", choices=storage_utils.STORAGE_KINDS, default="pickle")
+    args = parser.parse_args()
+
+    matrix = ScoreMatrix(storage_utils.create_storage(args.storage, args.game).load())
+    export_format = "parquet" if args.file.endswith(".parquet") else "csv"
+    if export_format == "parquet":
+        with open(args.file, "wb") as f:
+            f.write(matrix.export(export_format))
+    else:
+        with open(args.file, "w", encoding="utf-8", newline="") as f:
+            f.write(matrix.export(export_format))
+    print(json.dumps(matrix.report(), indent=4))
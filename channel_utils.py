@@ -0,0 +1,141 @@
+"""
+    This module contains the resolver of the channels given by the admins in the commands
+    (#name, name, <#C123|name> or the ID) to their IDs, from a map of the channels of the workspace
+    read once with conversations_list and kept up to date by the channel events.
+
+    Classes:
+        - ChannelResolver: Maps the names of the channels to their IDs.
+"""
+import logging
+import re
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from slack_sdk.web.client import WebClient
+
+# <#C123|name> or <#C123> (a channel mentioned in a message)
+CHANNEL_MENTION = re.compile(r"^<#([A-Z0-9]+)(?:\|([^>]*))?>$")
+# The ID of a channel, a private channel, a DM or a user (the DM with the user)
+RAW_ID = re.compile(r"^[CGDU][A-Z0-9]+$")
+
+
+class ChannelResolver:
+    """
+    This class is used to resolve the channels given in the admin commands to their IDs without calling the API.
+    IDs are passed through as they are (also the ones of DMs, users and channels missing from the map).
+    A name missing from the map reloads it (at most once per RELOAD_SECONDS), in case an event was missed.
+
+    Attributes:
+        - client: The slack client.
+        - ids: Maps the name of the channel to its ID.
+        - names: Maps the ID of the channel to its name.
+        - loaded_at: When the map was read (None if not yet).
+    """
+
+    # The minimal number of seconds between two reloads of the map
+    RELOAD_SECONDS = 60
+
+    def __init__(self, client: WebClient):
+        """
+        The constructor.
+
+        Parameters:
+            - client: The slack client.
+        """
+        self.client = client
+        self.ids = {}
+        self.names = {}
+        self.loaded_at = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Reads the channels in the background, so the first command does not wait for it.
+        """
+        threading.Thread(target=self._load, name="channels", daemon=True).start()
+
+    def load(self):
+        """
+        Reads all public and private channels of the bot, 1000 per call.
+        """
+        ids = {}
+        cursor = None
+        while True:
+            payload = self.client.conversations_list(
+                types="public_channel,private_channel",
+                exclude_archived=True,
+                limit=1000,
+                cursor=cursor,
+            )
+            for channel in payload["channels"]:
+                ids[channel["name"]] = channel["id"]
+            cursor = payload.get("response_metadata", {}).get("next_cursor")
+            if not cursor:
+                break
+        with self._lock:
+            self.ids = ids
+            self.names = {channel_id: name for name, channel_id in ids.items()}
+            self.loaded_at = time.monotonic()
+        logging.info("[CHANNELS] Loaded " + str(len(ids)) + " channels.")
+
+    def resolve(self, text: str) -> str:
+        """
+        Returns the ID of the channel given as #name, name, <#C123|name> or the ID.
+
+        Parameters:
+            - text: The channel.
+
+        Returns:
+            The ID of the channel.
+
+        Raises:
+            ValueError: If there is no such channel.
+        """
+        channel_id = self._find(text)
+        if channel_id is None and self._should_reload():
+            self.load()
+            channel_id = self._find(text)
+        if channel_id is None:
+            raise ValueError("Unknown channel '" + text + "'")
+        return channel_id
+
+    def update(self, channel: Dict[str, Any]):
+        """
+        Adds a new channel or the new name of a renamed one (channel_created and channel_rename events).
+
+        Parameters:
+            - channel: The channel from the event (with its ID and name).
+        """
+        with self._lock:
+            old_name = self.names.get(channel["id"])
+            if old_name is not None and self.ids.get(old_name) == channel["id"]:
+                del self.ids[old_name]
+            self.ids[channel["name"]] = channel["id"]
+            self.names[channel["id"]] = channel["name"]
+
+    def _find(self, text: str) -> Optional[str]:
+        text = text.strip()
+        mention = CHANNEL_MENTION.match(text)
+        if mention is not None:
+            # The ID of a mentioned channel is known to Slack even if it is missing from the map
+            return mention.group(1)
+        if RAW_ID.match(text):
+            # Names of channels are lowercase, so they never look like an ID
+            return text
+        with self._lock:
+            return self.ids.get(text.lstrip("#"))
+
+    def _load(self):
+        try:
+            self.load()
+        except Exception as e:
+            # Read again by the first command that needs it
+            logging.warning("[CHANNELS] Channels not loaded: " + str(e))
+
+    def _should_reload(self) -> bool:
+        with self._lock:
+            return (
+                self.loaded_at is None
+                or time.monotonic() - self.loaded_at >= self.RELOAD_SECONDS
+            )
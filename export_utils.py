@@ -0,0 +1,159 @@
+"""
+    This module contains the export of the players and the tasks of the game as files.
+    The rows are generated one by one and written in chunks to a compressed temporary file,
+    so the whole text of the export is never kept in memory, whatever the number of players.
+
+    Functions:
+        - player_rows: Generates the rows of the players.
+        - task_rows: Generates the rows of the tasks.
+        - write_export: Writes the rows to a gzip compressed CSV or JSON file.
+
+    Usage:
+        path = write_export(player_rows(game), PLAYER_FIELDS, "csv")
+        slack_utils.upload_local_file(path, "players.csv.gz", channel, client)
+        os.remove(path)
+"""
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List
+
+EXPORT_FORMATS = ["csv", "json"]
+
+PLAYER_FIELDS = [
+    "user_id",
+    "points",
+    "completed_tasks",
+    "standings",
+    "wrong_answers",
+    "last_attempt_at",
+]
+
+TASK_FIELDS = [
+    "task_no",
+    "points",
+    "needed_task",
+    "is_dm",
+    "channel",
+    "date_and_time",
+    "solved_by",
+    "sent_messages",
+    "near_miss_distance",
+    "state",
+    "description",
+]
+
+# How many rows are written to the file at once
+CHUNK_ROWS = 1000
+
+
+def player_rows(game: Any) -> Iterator[Dict[str, Any]]:
+    """
+    Generates the rows of the players (by points, as the leaderboard).
+
+    Parameters:
+        - game: The game.
+    """
+    with game.lock:
+        players = sorted(game.players.values(), key=lambda player: player.points, reverse=True)
+    for player in players:
+        last_attempt = max(player.last_attempt_at.values(), default=None)
+        yield {
+            "user_id": player.user_id,
+            "points": player.points,
+            "completed_tasks": len(player.standings),
+            "standings": ";".join(
+                str(task_no) + ":" + str(standing)
+                for task_no, standing in sorted(player.standings.items())
+            ),
+            "wrong_answers": sum(player.wrong_answers.values()),
+            "last_attempt_at": datetime.fromtimestamp(last_attempt).isoformat(sep=" ")
+            if last_attempt is not None
+            else None,
+        }
+
+
+def task_rows(game: Any) -> Iterator[Dict[str, Any]]:
+    """
+    Generates the rows of the tasks (by number).
+
+    Parameters:
+        - game: The game.
+    """
+    with game.lock:
+        tasks = [game.tasks[task_no] for task_no in sorted(game.tasks.keys())]
+    for task in tasks:
+        yield {
+            "task_no": task.task_no,
+            "points": int(task.points),
+            "needed_task": task.needed_task,
+            "is_dm": task.is_dm,
+            "channel": task.channel,
+            "date_and_time": task.date_and_time.isoformat(sep=" ")
+            if task.date_and_time is not None
+            else None,
+            "solved_by": task.solved_by,
+            "sent_messages": len(task.sent_messages),
+            "near_miss_distance": task.near_miss_distance,
+            "state": task.state.value,
+            "description": task.raw_description(),
+        }
+
+
+def write_export(
+    rows: Iterable[Dict[str, Any]], fields: List[str], export_format: str
+) -> str:
+    """
+    Writes the rows to a gzip compressed temporary file, CHUNK_ROWS rows at once.
+    The caller removes the file after using it.
+
+    Parameters:
+        - rows: The rows.
+        - fields: The columns of the rows.
+        - export_format: One of EXPORT_FORMATS (a JSON file is an array of objects).
+
+    Returns:
+        The path of the file.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError("Unknown export format '" + export_format + "'")
+    with tempfile.NamedTemporaryFile(suffix="." + export_format + ".gz", delete=False) as f:
+        try:
+            with gzip.GzipFile(fileobj=f, mode="wb") as compressed:
+                for chunk in _chunks(rows, fields, export_format):
+                    compressed.write(chunk.encode("utf-8"))
+        except BaseException:
+            # The caller never gets the path of a half written file
+            f.close()
+            os.remove(f.name)
+            raise
+        return f.name
+
+
+def _chunks(
+    rows: Iterable[Dict[str, Any]], fields: List[str], export_format: str
+) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields)
+    if export_format == "csv":
+        writer.writeheader()
+    else:
+        buffer.write("[")
+    count = 0
+    for row in rows:
+        if export_format == "csv":
+            writer.writerow(row)
+        else:
+            buffer.write(("\n" if count == 0 else ",\n") + json.dumps(row, ensure_ascii=False))
+        count += 1
+        if count % CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if export_format == "json":
+        buffer.write("\n]\n")
+    yield buffer.getvalue()
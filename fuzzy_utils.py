@@ -0,0 +1,126 @@
+"""
+    This module contains the fuzzy matching of the answers: the edit distance and a BK-tree of words,
+    which finds the words within a given edit distance without comparing the query with all of them.
+
+    Functions:
+        - normalize: Normalizes an answer before it is compared.
+        - edit_distance: Returns the Levenshtein distance of two words.
+
+    Classes:
+        - BKTree: The words in a metric tree, searched by the edit distance.
+"""
+from typing import Iterable, List, Optional, Tuple
+
+
+def normalize(text: str, case_sensitive: bool = False) -> str:
+    """
+    Normalizes an answer: removes the whitespace around it, joins the words with single spaces
+    and lowers the letters (unless the case matters).
+
+    Parameters:
+        - text: The answer.
+        - case_sensitive: Whether the letters case matters.
+    """
+    text = " ".join(text.split())
+    return text if case_sensitive else text.lower()
+
+
+def edit_distance(first: str, second: str, limit: Optional[int] = None) -> int:
+    """
+    Returns the Levenshtein distance of two words (insertions, deletions and substitutions).
+
+    Parameters:
+        - first: The first word.
+        - second: The second word.
+        - limit: If given, any distance above it is returned as limit + 1 (computed faster).
+    """
+    if len(first) < len(second):
+        first, second = second, first
+    if limit is not None and len(first) - len(second) > limit:
+        return limit + 1
+    previous = list(range(len(second) + 1))
+    for i, first_char in enumerate(first, 1):
+        current = [i]
+        for j, second_char in enumerate(second, 1):
+            current.append(
+                min(
+                    previous[j] + 1,
+                    current[j - 1] + 1,
+                    previous[j - 1] + (first_char != second_char),
+                )
+            )
+        if limit is not None and min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class BKTree:
+    """
+    This class is used to find the words close to a query.
+    Every child of a node is kept under its distance to the node, so by the triangle inequality
+    a search within distance k only visits the children at distance d - k to d + k from the node
+    (d being the distance of the query to the node).
+
+    Attributes:
+        - size: The number of words in the tree.
+    """
+
+    def __init__(self, words: Iterable[str] = ()):
+        """
+        The constructor.
+
+        Parameters:
+            - words: The words to add.
+        """
+        # A node is a (word, {distance: child node}) pair
+        self._root = None
+        self.size = 0
+        for word in words:
+            self.add(word)
+
+    def add(self, word: str):
+        """
+        Adds a word (a word already in the tree is skipped).
+
+        Parameters:
+            - word: The word.
+        """
+        if self._root is None:
+            self._root = (word, {})
+            self.size = 1
+            return
+        node = self._root
+        while True:
+            distance = edit_distance(word, node[0])
+            if distance == 0:
+                return
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = (word, {})
+                self.size += 1
+                return
+            node = child
+
+    def search(self, word: str, max_distance: int) -> List[Tuple[int, str]]:
+        """
+        Returns the words within the distance of the word, closest first.
+
+        Parameters:
+            - word: The query.
+            - max_distance: The maximal edit distance.
+
+        Returns:
+            The (distance, word) pairs.
+        """
+        found = []
+        nodes = [self._root] if self._root is not None else []
+        while len(nodes) > 0:
+            node_word, children = nodes.pop()
+            distance = edit_distance(word, node_word)
+            if distance <= max_distance:
+                found.append((distance, node_word))
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    nodes.append(child)
+        return sorted(found)
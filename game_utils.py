@@ -5,14 +5,85 @@ from enum import Enum
 import os
 import pickle
 import random
-from typing import Any, Dict, Set, List, Optional
+import sys
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, KeysView, Set, List, Optional, Tuple
 from datetime import datetime
 
 from slack_sdk.web.client import WebClient
+import fuzzy_utils
+import history_utils
+import ledger_utils
 import slack_utils
+import stats_utils
 import logging
 
 
+def message_ref(message: Any) -> Optional[Tuple[str, str]]:
+    """
+    Returns the compact reference to a sent or scheduled message.
+
+    Parameters:
+        - message: The response of chat.postMessage or chat.scheduleMessage.
+
+    Returns:
+        The (channel, ts or scheduled message ID) pair or None if the message was not sent.
+    """
+    if message is None:
+        return None
+    if isinstance(message, tuple):
+        return message
+    if "scheduled_message_id" in message:
+        return (sys.intern(message["channel"]), message["scheduled_message_id"])
+    return (sys.intern(message["channel"]), message["ts"])
+
+
+def new_outbox_entry(
+    channel: str, text: str, task_no: Optional[int] = None, post_at: Optional[float] = None
+) -> Dict[str, Any]:
+    """
+    Creates an entry of the outbox (a message to send after the change of the game is saved).
+
+    Parameters:
+        - channel: The channel or the user ID to send the message to.
+        - text: The text of the message.
+        - task_no: The number of the task the message sends (None for other messages).
+        - post_at: The timestamp to schedule the message at (None to send it at once).
+
+    Returns:
+        The entry.
+    """
+    now = time.time()
+    return {
+        "id": uuid.uuid4().hex,
+        "channel": channel,
+        "text": text,
+        "task_no": task_no,
+        "post_at": post_at,
+        "created_at": now,
+        "attempts": 0,
+        "next_try": now,
+        # Saved by the storage, so it can be sent
+        "committed": False,
+        # Loaded after a restart, so it may have been sent already
+        "recovered": False,
+        "failed": False,
+    }
+
+
+class TaskState(Enum):
+    # Waiting for its time
+    SCHEDULED = "scheduled"
+    # Released, answers are checked
+    LIVE = "live"
+    # No more answers, not sent to anyone anymore
+    CLOSED = "closed"
+    # Closed, with the description, the answers and the sent messages moved to the archive of the storage
+    ARCHIVED = "archived"
+
+
 class Task:
     """
     This class is used to store the information about the tasks in the game.
@@ -28,7 +99,11 @@ class Task:
         - channel: The channel the task is in (if not dm).
         - date_and_time: The date and time the task is scheduled for.
         - solved_by: The number of users that have solved the task.
-        - sent_messages: The IDs of the messages that have been sent to the users.
+        - sent_messages: The (channel, ts or scheduled message ID) pairs of the messages that have been sent to the users.
+        - near_miss_distance: How many typos a wrong answer may have to be told it is close (0 - never).
+        - state: The state of the task in its lifecycle (TaskState).
+        The description, the correct answers and the sent messages of an archived task are read from
+        the archive on every access (and not kept in memory nor pickled with the game).
 
     Methods:
         - create_task_from_modal: Creates a task from the modal.
@@ -40,8 +115,53 @@ class Task:
         - delete_message: Deletes the message.
         - __str__: Returns the string representation of the task.
         - check_answer: Checks if the answer is correct.
+        - is_near_miss: Checks if a wrong answer is close to a correct one.
+        - raw_description: Returns the description without the task header.
+        - is_open: Checks if the task is scheduled or live.
+        - cold_data: Returns the data moved to the archive when the task is archived.
+        - archive: Marks the task archived and drops its cold data from memory.
     """
 
+    __slots__ = (
+        "task_no",
+        "points",
+        "_correct_answers",
+        "needed_task",
+        "is_dm",
+        "channel",
+        "date_and_time",
+        "_description",
+        "do_letters_case_matter",
+        "solved_by",
+        "_sent_messages",
+        "near_miss_distance",
+        "_state",
+        # The BK-tree of the normalized correct answers (not saved)
+        "_near_miss_index",
+        # Reads the cold data of the archived task (set by the game, not saved)
+        "_cold",
+    )
+
+    # The attributes that are pickled
+    SAVED_FIELDS = (
+        "task_no",
+        "points",
+        "correct_answers",
+        "needed_task",
+        "is_dm",
+        "channel",
+        "date_and_time",
+        "description",
+        "do_letters_case_matter",
+        "solved_by",
+        "sent_messages",
+        "near_miss_distance",
+        "state",
+    )
+
+    # The attributes moved to the archive
+    COLD_FIELDS = ("description", "correct_answers", "sent_messages")
+
     def __init__(
         self,
         task_no: int,
@@ -53,6 +173,7 @@ class Task:
         date_and_time: datetime = None,
         description: str = None,
         do_letters_case_matter: bool = False,
+        near_miss_distance: int = 0,
     ):
         """
         The constructor.
@@ -67,6 +188,7 @@ class Task:
             - date_and_time: The date and time the task is scheduled for.
             - description: The description of the task.
             - do_letters_case_matter: Whether the letters case matters or not.
+            - near_miss_distance: How many typos a wrong answer may have to be told it is close (0 - never).
         """
         self.task_no = task_no
         self.points = points
@@ -80,8 +202,133 @@ class Task:
         self.do_letters_case_matter = do_letters_case_matter
         self.solved_by = 0
         self.sent_messages = []
+        self.near_miss_distance = near_miss_distance
+        self._state = TaskState.SCHEDULED
+        self._cold = None
+        self._near_miss_index = None
+        if near_miss_distance > 0:
+            self._near_miss_tree()
         logging.info(f"[TASK] Task {self.task_no} created.")
 
+    def __getstate__(self) -> Dict[str, Any]:
+        """
+        Returns the state to pickle (without the cold data of an archived task).
+        """
+        archived = self._state == TaskState.ARCHIVED
+        return {
+            name: getattr(self, name)
+            for name in self.SAVED_FIELDS
+            if not (archived and name in self.COLD_FIELDS)
+        }
+
+    def __setstate__(self, state: Dict[str, Any]):
+        """
+        Restores the pickled state (tasks saved before kept whole API responses in sent_messages
+        and had no near_miss_distance nor state).
+        """
+        if state.get("sent_messages") is not None:
+            state["sent_messages"] = [
+                ref
+                for ref in (message_ref(message) for message in state["sent_messages"])
+                if ref is not None
+            ]
+        state.setdefault("near_miss_distance", 0)
+        state.setdefault("state", TaskState.SCHEDULED)
+        self._near_miss_index = None
+        self._cold = None
+        for name in self.COLD_FIELDS:
+            setattr(self, "_" + name, None)
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    @property
+    def state(self) -> TaskState:
+        """
+        The state of the task (a scheduled task becomes live at its time).
+        """
+        if self._state == TaskState.SCHEDULED and (
+            self.date_and_time is None or self.date_and_time <= datetime.now()
+        ):
+            self._state = TaskState.LIVE
+        return self._state
+
+    @state.setter
+    def state(self, state: TaskState):
+        self._state = state
+
+    def is_open(self) -> bool:
+        """
+        Checks if the task is scheduled or live (not closed nor archived).
+        """
+        return self._state in (TaskState.SCHEDULED, TaskState.LIVE)
+
+    @property
+    def description(self) -> str:
+        """
+        The description of the task (read from the archive if the task is archived).
+        """
+        if self._description is None and self._state == TaskState.ARCHIVED:
+            return self._archived()["description"]
+        return self._description
+
+    @description.setter
+    def description(self, description: str):
+        self._description = description
+
+    @property
+    def correct_answers(self) -> List[str]:
+        """
+        The correct answers to the task (read from the archive if the task is archived).
+        """
+        if self._correct_answers is None and self._state == TaskState.ARCHIVED:
+            return self._archived()["correct_answers"]
+        return self._correct_answers
+
+    @correct_answers.setter
+    def correct_answers(self, correct_answers: List[str]):
+        self._correct_answers = correct_answers
+
+    @property
+    def sent_messages(self) -> List[Tuple[str, str]]:
+        """
+        The sent messages of the task (read from the archive if the task is archived).
+        """
+        if self._sent_messages is None and self._state == TaskState.ARCHIVED:
+            return self._archived()["sent_messages"]
+        return self._sent_messages
+
+    @sent_messages.setter
+    def sent_messages(self, sent_messages: List[Tuple[str, str]]):
+        self._sent_messages = sent_messages
+
+    def cold_data(self) -> Dict[str, Any]:
+        """
+        Returns the data moved to the archive when the task is archived.
+        """
+        return {
+            "description": self.description,
+            "correct_answers": list(self.correct_answers or []),
+            "sent_messages": [list(ref) for ref in self.sent_messages],
+        }
+
+    def archive(self, cold: Callable[[int], Dict[str, Any]]):
+        """
+        Marks the task archived and drops its cold data from memory (after the storage saved it).
+
+        Parameters:
+            - cold: Reads the cold data of a task by its number.
+        """
+        self._state = TaskState.ARCHIVED
+        self._cold = cold
+        self._near_miss_index = None
+        for name in self.COLD_FIELDS:
+            setattr(self, "_" + name, None)
+
+    def _archived(self) -> Dict[str, Any]:
+        if self._cold is None:
+            raise ValueError("Task " + str(self.task_no) + " is archived and its archive is not loaded")
+        return self._cold(self.task_no)
+
     @staticmethod
     def create_task_from_modal() -> "Task":
         """
@@ -100,8 +347,9 @@ class Task:
         Parameters:
             - client: The slack client.
         """
-        for message in self.sent_messages:
-            slack_utils.update_message(message, self.description, client)
+        for channel, ts in self.sent_messages:
+            if not ts.startswith("Q"):
+                slack_utils.update_message(channel, ts, self.description, client)
 
     def delete_message(self, client: WebClient):
         """
@@ -110,8 +358,36 @@ class Task:
         Parameters:
             - client: The slack client.
         """
-        for message in self.sent_messages:
-            slack_utils.delete_message(message, client)
+        for channel, ts in self.sent_messages:
+            if ts.startswith("Q"):
+                slack_utils.delete_scheduled_message(channel, ts, client)
+            else:
+                slack_utils.delete_message(channel, ts, client)
+
+    def delete_scheduled_messages(self, client: WebClient) -> List[Tuple[str, str]]:
+        """
+        Deletes the scheduled messages of the task that were not posted yet (when the task is closed).
+        The sent messages are not changed here, the caller removes the deleted ones in a transaction.
+
+        Parameters:
+            - client: The slack client.
+
+        Returns:
+            The (channel, scheduled message ID) pairs of the deleted messages.
+        """
+        deleted = []
+        for channel, ts in list(self.sent_messages):
+            if not ts.startswith("Q"):
+                continue
+            try:
+                slack_utils.delete_scheduled_message(channel, ts, client)
+                deleted.append((channel, ts))
+            except Exception as e:
+                # Already posted (its time has passed)
+                logging.warning(
+                    f"[TASK] Scheduled message {ts} of task {self.task_no} not deleted: {e}"
+                )
+        return deleted
 
     def schedule_task(self, client: WebClient, player_ids: List[str]):
         """
@@ -133,17 +409,19 @@ class Task:
                 client,
                 metadata=metadata_task,
             )
-            self.sent_messages.append(mess)
+            self.sent_messages.append(message_ref(mess))
         else:
             messages = []
             for player_id in player_ids:
                 messages.append(
-                    slack_utils.send_scheduled_message(
-                        self.description,
-                        player_id,
-                        self.date_and_time,
-                        client,
-                        metadata=metadata_task,
+                    message_ref(
+                        slack_utils.send_scheduled_message(
+                            self.description,
+                            player_id,
+                            self.date_and_time,
+                            client,
+                            metadata=metadata_task,
+                        )
                     )
                 )
             self.sent_messages = messages
@@ -164,7 +442,7 @@ class Task:
         mess = slack_utils.send_message(
             self.description, [user_id], client, metadata=metadata_task
         )
-        self.sent_messages.append(mess)
+        self.sent_messages.append(message_ref(mess[0]))
         logging.info(f"[TASK] Task {self.task_no} sent to {user_id}.")
 
     def edit_task(self, client, **kwargs):
@@ -179,6 +457,18 @@ class Task:
         if self.needed_task is None:
             self.schedule_task(client)
 
+    def raw_description(self) -> str:
+        """
+        Returns the description without the task header added in the constructor.
+
+        Returns:
+            The description as it was given when creating the task.
+        """
+        header = f"[ZADANIE #{self.task_no} Punkty: {self.points}]\n"
+        if self.description.startswith(header):
+            return self.description[len(header) :]
+        return self.description
+
     def check_answer(self, answer: str) -> bool:
         """
         Checks if the answer is correct.
@@ -195,6 +485,37 @@ class Task:
         else:
             return answer.lower() in [x.lower() for x in self.correct_answers]
 
+    def is_near_miss(self, answer: str) -> bool:
+        """
+        Checks if a wrong answer is close to a correct one: at most near_miss_distance
+        insertions, deletions or substitutions away from it (after normalizing both).
+
+        Parameters:
+            - answer: The answer to check.
+
+        Returns:
+            True if the answer is close to a correct one, False otherwise.
+        """
+        if not self.near_miss_distance or not self.correct_answers:
+            return False
+        answer = fuzzy_utils.normalize(answer, self.do_letters_case_matter)
+        return len(self._near_miss_tree().search(answer, self.near_miss_distance)) > 0
+
+    def _near_miss_tree(self) -> fuzzy_utils.BKTree:
+        # Built again when the answers were edited (or read again by the storage)
+        key = (tuple(self.correct_answers or []), self.do_letters_case_matter)
+        cached = getattr(self, "_near_miss_index", None)
+        if cached is None or cached[0] != key:
+            cached = (
+                key,
+                fuzzy_utils.BKTree(
+                    fuzzy_utils.normalize(answer, self.do_letters_case_matter)
+                    for answer in key[0]
+                ),
+            )
+            self._near_miss_index = cached
+        return cached[1]
+
     def __str__(self) -> str:
         """
         Returns the string representation of the task.
@@ -208,15 +529,27 @@ class Task:
 class Player:
     """
     This class is used to store the information about the users in the game.
+    Uses __slots__ and keeps the completed tasks only as the keys of the standings, as there can be thousands of players.
 
     Attributes:
         - user_id: The user ID of the user.
         - points: The number of points the user has.
-        - completed_tasks: The number of tasks the user has completed.
+        - completed_tasks: The tasks the user has completed (view of the standings keys).
         - standings: The standings of the user.
         - wrong_answers: The number of wrong answers the user has.
+        - solved_at: When the user has solved the tasks (timestamps).
+        - last_attempt_at: When the user has last answered the tasks (timestamps).
     """
 
+    __slots__ = (
+        "user_id",
+        "points",
+        "standings",
+        "wrong_answers",
+        "solved_at",
+        "last_attempt_at",
+    )
+
     def __init__(self, user_id: str):
         """
         The constructor.
@@ -224,13 +557,61 @@ class Player:
         Parameters:
             - user_id: The user ID of the user.
         """
-        self.user_id = user_id
+        self.user_id = sys.intern(user_id)
         self.points = 0
-        self.completed_tasks = set()
         self.standings = {}
         self.wrong_answers = {}
+        self.solved_at = {}
+        self.last_attempt_at = {}
         logging.info(f"[PLAYER] Player {self.user_id} created.")
 
+    @property
+    def completed_tasks(self) -> KeysView:
+        """
+        Returns the tasks the user has completed.
+        """
+        return self.standings.keys()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        """
+        Returns the state to pickle.
+        """
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state: Dict[str, Any]):
+        """
+        Restores the pickled state (also of players saved before the slots and timestamps).
+        """
+        # Completed tasks without a standing are kept with standing 0
+        for task_no in state.pop("completed_tasks", ()):
+            state.setdefault("standings", {}).setdefault(task_no, 0)
+        # Times saved before as datetimes are kept as timestamps
+        for name in ("solved_at", "last_attempt_at"):
+            state[name] = {
+                task_no: moment.timestamp() if isinstance(moment, datetime) else moment
+                for task_no, moment in state.get(name, {}).items()
+            }
+        state["user_id"] = sys.intern(state["user_id"])
+        for name in self.__slots__:
+            setattr(self, name, state[name])
+
+    def released_at(self, task: Task) -> Optional[datetime]:
+        """
+        Returns when the task was released for the user (its date or when the needed task was solved).
+
+        Parameters:
+            - task: The task.
+
+        Returns:
+            The date and time of the release or None if unknown.
+        """
+        release = task.date_and_time
+        if task.needed_task is not None and task.needed_task in self.solved_at:
+            unlocked = datetime.fromtimestamp(self.solved_at[task.needed_task])
+            if release is None or unlocked > release:
+                release = unlocked
+        return release
+
     def right_answer(self, task: Task):
         """
         Updates the user's information after he/she answered correctly.
@@ -238,11 +619,12 @@ class Player:
         Parameters:
             - task: The task.
         """
-        if task.task_no not in self.completed_tasks:
+        if task.task_no not in self.standings:
             self.points += int(task.points)
-            self.completed_tasks.add(task.task_no)
             task.solved_by += 1
             self.standings[task.task_no] = task.solved_by
+            self.solved_at[task.task_no] = time.time()
+            self.last_attempt_at[task.task_no] = self.solved_at[task.task_no]
             logging.info(
                 f"[PLAYER] Player {self.user_id} answered correctly to task {task.task_no}."
             )
@@ -258,6 +640,7 @@ class Player:
             self.wrong_answers[task.task_no] = 1
         else:
             self.wrong_answers[task.task_no] += 1
+        self.last_attempt_at[task.task_no] = time.time()
         logging.info(
             f"[PLAYER] Player {self.user_id} answered incorrectly to task {task.task_no}."
         )
@@ -269,7 +652,7 @@ class Player:
         Returns:
             The string representation of the player.
         """
-        return f"<@{self.user_id}> - {self.points} points - {self.completed_tasks} completed tasks - {self.wrong_answers} wrong answers - {self.standings} standings"
+        return f"<@{self.user_id}> - {self.points} points - {set(self.completed_tasks)} completed tasks - {self.wrong_answers} wrong answers - {self.standings} standings"
 
 
 class MessageType(Enum):
@@ -277,6 +660,7 @@ class MessageType(Enum):
     WRONG_ANSWER = 2
     OUTER_MESSAGE = 3
     ADMIN_MESSAGE = 4
+    NEAR_MISS = 5
 
 
 class Game:
@@ -287,6 +671,11 @@ class Game:
         - tasks: The tasks of the game.
         - players: The players of the game.
         - needed_task: Maps the task number that is needed to be completed before a task can be completed.
+        - statistics: The statistics of the game, updated on every answer.
+        - history: The history of the leaderboard, recorded on every scoring change.
+        - outbox: The messages waiting to be sent after the changes that queued them are saved.
+        - deliveries: The ledger of the tasks queued for (and sent to) every player or channel.
+        - archive: Reads the cold data of the archived tasks from the storage (not saved).
         - RANDOM_QUOTES: Random quotes to send to the users.
         - CORRECT_ANSWER_MESSAGES: Messages to send to the users when they answer correctly.
         - WRONG_ANSWER_MESSAGES: Messages to send to the users when they answer incorrectly.
@@ -331,6 +720,8 @@ class Game:
         "Twoja odpowiedź jest godna potępienia, uważaj, by nie zasłużyć na gniew bogów.",
     ]
 
+    NEAR_MISS_MESSAGE = "Blisko, wojowniku! Sprawdź pisownię i spróbuj jeszcze raz."
+
     @staticmethod
     def load_from_pickle(file_name: str) -> "Game":
         """
@@ -367,7 +758,7 @@ class Game:
             os.rename(file_name, file_name + ".bak")
 
         with open(file_name, "wb") as f:
-            pickle.dump(self, f)
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
 
         logging.info("Game saved to file: " + file_name)
 
@@ -378,6 +769,128 @@ class Game:
         self.tasks = {}
         self.players = {}
         self.needed_task = {}
+        self.statistics = stats_utils.Statistics()
+        self.history = history_utils.LeaderboardHistory()
+        self.client = None
+        self.lock = threading.RLock()
+        self.change_listeners = []
+        self.join_listeners = []
+        # Maps the ID of the entry to the messages waiting to be sent (see outbox_utils)
+        self.outbox = {}
+        self.deliveries = ledger_utils.DeliveryLedger()
+        self.archive = None
+
+    def __getstate__(self) -> Dict[str, Any]:
+        """
+        Returns the state to pickle (without the client and the lock).
+        """
+        state = self.__dict__.copy()
+        state.pop("client", None)
+        state.pop("lock", None)
+        state.pop("change_listeners", None)
+        state.pop("join_listeners", None)
+        state.pop("archive", None)
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]):
+        """
+        Restores the pickled state.
+        """
+        self.__dict__.update(state)
+        self.client = None
+        self.lock = threading.RLock()
+        self.change_listeners = []
+        self.join_listeners = []
+        self.archive = None
+        if "outbox" not in state:
+            self.outbox = {}
+        for entry in self.outbox.values():
+            entry["committed"] = True
+            entry["recovered"] = True
+        if "deliveries" not in state:
+            # Games saved before the ledger delivered (or scheduled) every task without a needed task
+            # to every player (or its channel), and every unlocked task to the players that solved
+            # the needed one, so those deliveries are marked, with the messages still waiting to be sent
+            self.deliveries = ledger_utils.DeliveryLedger()
+            for task_no, task in self.tasks.items():
+                if task.needed_task is not None:
+                    recipients = [
+                        user_id
+                        for user_id, player in self.players.items()
+                        if task.needed_task in player.completed_tasks
+                    ]
+                elif task.is_dm:
+                    recipients = list(self.players.keys())
+                else:
+                    recipients = [task.channel]
+                for recipient in recipients:
+                    self.deliveries.mark(task_no, recipient)
+            for entry in self.outbox.values():
+                if entry["task_no"] is not None and not entry["failed"]:
+                    self.deliveries.mark(entry["task_no"], entry["channel"])
+        if "statistics" not in state:
+            self.statistics = stats_utils.Statistics.rebuild(self.players, self.tasks)
+        if "history" not in state:
+            self.history = history_utils.LeaderboardHistory(
+                {
+                    user_id: player.points
+                    for user_id, player in self.players.items()
+                    if player.points > 0
+                }
+            )
+
+    def set_archive(self, archive: Callable[[int], Dict[str, Any]]):
+        """
+        Sets the reader of the cold data of the archived tasks (from the storage).
+
+        Parameters:
+            - archive: Reads the cold data of a task by its number.
+        """
+        self.archive = archive
+        for task in self.tasks.values():
+            task._cold = archive
+
+    def live_tasks(self) -> Dict[int, Task]:
+        """
+        Returns the tasks that are scheduled or live (the ones the hot paths go through).
+        """
+        with self.lock:
+            return {task_no: task for task_no, task in self.tasks.items() if task.is_open()}
+
+    def close_task(self, task_no: int) -> bool:
+        """
+        Closes a task: answers to it are not checked and it is not sent to anyone anymore.
+        Its messages waiting in the outbox are dropped by the outbox sender, its scheduled messages
+        are deleted by the caller (Task.delete_scheduled_messages). The storage archives it (archive_tasks)
+        once the outbox has no messages of it.
+
+        Parameters:
+            - task_no: The number of the task.
+
+        Returns:
+            Whether the task was open.
+        """
+        with self.lock:
+            task = self.tasks.get(task_no)
+            if task is None or not task.is_open():
+                return False
+            task.state = TaskState.CLOSED
+            logging.info(f"[TASK] Task {task_no} closed.")
+            return True
+
+    def archivable_tasks(self) -> List[int]:
+        """
+        Returns the closed tasks that can be archived (with no messages waiting in the outbox).
+        """
+        with self.lock:
+            waiting = {
+                entry["task_no"] for entry in self.outbox.values() if not entry["failed"]
+            }
+            return [
+                task_no
+                for task_no, task in self.tasks.items()
+                if task.state == TaskState.CLOSED and task_no not in waiting
+            ]
 
     def set_client(self, client: WebClient):
         """
@@ -388,6 +901,157 @@ class Game:
         """
         self.client = client
 
+    def add_change_listener(self, listener: Callable[[List[str]], None]):
+        """
+        Adds a function called with the IDs of the players whose state changed (answers, accepted tasks).
+
+        Parameters:
+            - listener: The function.
+        """
+        self.change_listeners.append(listener)
+
+    def notify_change(self, user_ids: List[str]):
+        """
+        Calls the change listeners. A failing listener is logged and does not stop the others.
+
+        Parameters:
+            - user_ids: The IDs of the players whose state changed.
+        """
+        if len(user_ids) == 0:
+            return
+        for listener in self.change_listeners:
+            try:
+                listener(user_ids)
+            except Exception as e:
+                logging.exception("Change listener failed: " + str(e))
+
+    def add_join_listener(self, listener: Callable[[List[str]], None]):
+        """
+        Adds a function called with the IDs of the players added to the game (after welcome_players).
+
+        Parameters:
+            - listener: The function.
+        """
+        self.join_listeners.append(listener)
+
+    def notify_join(self, user_ids: List[str]):
+        """
+        Calls the join listeners. A failing listener is logged and does not stop the others.
+
+        Parameters:
+            - user_ids: The IDs of the added players.
+        """
+        if len(user_ids) == 0:
+            return
+        for listener in self.join_listeners:
+            try:
+                listener(user_ids)
+            except Exception as e:
+                logging.exception("Join listener failed: " + str(e))
+
+    def enqueue_message(
+        self,
+        channel: str,
+        text: str,
+        task_no: Optional[int] = None,
+        post_at: Optional[float] = None,
+    ) -> str:
+        """
+        Queues a message in the outbox. It is sent after the storage saves the change that queued it.
+
+        Parameters:
+            - channel: The channel or the user ID to send the message to.
+            - text: The text of the message.
+            - task_no: The number of the task the message sends (None for other messages).
+            - post_at: The timestamp to schedule the message at (None to send it at once).
+
+        Returns:
+            The ID of the entry.
+        """
+        entry = new_outbox_entry(channel, text, task_no, post_at)
+        with self.lock:
+            self.outbox[entry["id"]] = entry
+        return entry["id"]
+
+    def deliver_task(self, task_no: int, user_id: str) -> bool:
+        """
+        Queues the task to be sent to the user (or the channel) at once,
+        unless the ledger shows it was already queued for them.
+
+        Parameters:
+            - task_no: The number of the task.
+            - user_id: The user ID or the channel.
+
+        Returns:
+            Whether the task was queued.
+        """
+        with self.lock:
+            if not self.tasks[task_no].is_open():
+                return False
+            if self.deliveries.has(task_no, user_id):
+                logging.info(f"[TASK] Task {task_no} already delivered to {user_id}.")
+                return False
+            logging.info(f"[TASK] Queueing task {task_no} for {user_id}.")
+            self.deliveries.mark(task_no, user_id)
+            self.enqueue_message(user_id, self.tasks[task_no].description, task_no)
+            return True
+
+    def schedule_delivery(self, task_no: int, player_ids: List[str]) -> int:
+        """
+        Queues the task to be scheduled at its time, in its channel or to every player if it is a DM task.
+
+        Parameters:
+            - task_no: The number of the task.
+            - player_ids: The ids of the players.
+
+        Returns:
+            The number of queued messages.
+        """
+        task = self.tasks[task_no]
+        if not task.is_open():
+            return 0
+        post_at = task.date_and_time.timestamp()
+        recipients = player_ids if task.is_dm else [task.channel]
+        with self.lock:
+            queued = 0
+            for recipient in recipients:
+                # Recipients in the ledger already have it (scheduled or sent)
+                if self.deliveries.has(task_no, recipient):
+                    continue
+                self.deliveries.mark(task_no, recipient)
+                self.enqueue_message(recipient, task.description, task_no, post_at)
+                queued += 1
+        logging.info(f"[TASK] Task {task_no} queued to be scheduled for {queued} recipients.")
+        return queued
+
+    def message_delivered(self, outbox_id: str, ref: Tuple[str, str]):
+        """
+        Removes the sent message from the outbox and remembers it in its task and in the ledger.
+
+        Parameters:
+            - outbox_id: The ID of the entry.
+            - ref: The (channel, ts or scheduled message ID) pair of the sent message.
+        """
+        with self.lock:
+            entry = self.outbox.pop(outbox_id, None)
+            if entry is not None and entry["task_no"] in self.tasks:
+                task = self.tasks[entry["task_no"]]
+                if task.state != TaskState.ARCHIVED:
+                    task.sent_messages.append(ref)
+                self.deliveries.mark(entry["task_no"], entry["channel"], ref)
+
+    def message_failed(self, outbox_id: str):
+        """
+        Forgets the delivery of a message of the outbox that was given up, so the task can be delivered again.
+
+        Parameters:
+            - outbox_id: The ID of the entry.
+        """
+        with self.lock:
+            entry = self.outbox.get(outbox_id)
+            if entry is not None and entry["task_no"] is not None:
+                self.deliveries.forget(entry["task_no"], entry["channel"])
+
     def add_player(self, user_id: str):
         """
         Adds a player to the game.
@@ -399,6 +1063,33 @@ class Game:
             self.players[user_id] = Player(user_id)
         logging.info("Player added: " + user_id)
 
+    def welcome_players(self, user_ids: List[str]) -> int:
+        """
+        Adds the players who joined the channel and queues the tasks: the ones whose time has passed
+        are sent at once, the others are scheduled (the ledger skips the tasks they already got).
+        Tasks with a needed task are skipped, they are sent when the player completes the needed task.
+
+        Parameters:
+            - user_ids: The ids of the players.
+
+        Returns:
+            The number of queued messages.
+        """
+        now = datetime.now()
+        queued = 0
+        with self.lock:
+            for user_id in user_ids:
+                self.add_player(user_id)
+            for task_no, task in self.live_tasks().items():
+                if task.needed_task is not None:
+                    continue
+                if task.date_and_time is not None and task.date_and_time > now:
+                    queued += self.schedule_delivery(task_no, user_ids)
+                else:
+                    for user_id in user_ids:
+                        queued += self.deliver_task(task_no, user_id)
+        return queued
+
     def show_players(self) -> str:
         """
         Shows the players.
@@ -424,6 +1115,43 @@ class Game:
                 self.needed_task[task.needed_task] = task.task_no
         logging.info("Task added: " + str(task))
 
+    def add_tasks(self, tasks: List[Task]):
+        """
+        Adds many tasks to the game at once.
+
+        Parameters:
+            - tasks: The tasks.
+        """
+        for task in tasks:
+            self.add_task(task)
+        logging.info("Tasks added: " + str(len(tasks)))
+
+    def release_tasks(self, tasks: List[Task], player_ids: List[str]):
+        """
+        Releases the tasks in one pass: tasks without a needed task are scheduled for the players
+        (or sent right away if their time has passed) and tasks with a needed task are sent to the players
+        that have already completed it. The messages are queued in the outbox.
+
+        Parameters:
+            - tasks: The tasks.
+            - player_ids: The ids of the players to schedule the tasks for.
+        """
+        now = datetime.now()
+        for task in tasks:
+            if task.needed_task is None:
+                if task.date_and_time is not None and task.date_and_time > now:
+                    self.schedule_delivery(task.task_no, player_ids)
+                elif task.is_dm:
+                    for player_id in player_ids:
+                        self.deliver_task(task.task_no, player_id)
+                else:
+                    self.deliver_task(task.task_no, task.channel)
+            else:
+                for player_id, player in self.players.items():
+                    if task.needed_task in player.completed_tasks:
+                        self.deliver_task(task.task_no, player_id)
+        logging.info("Tasks released: " + str(len(tasks)))
+
     def edit_task(self, task_no: int, **kwargs: Dict[str, Any]):
         """
         Edits a task.
@@ -444,6 +1172,7 @@ class Game:
         """
         if task_no in self.tasks:
             del self.tasks[task_no]
+            self.deliveries.forget(task_no)
             # TODO: check how to imlement deleting scheduled tasks, add it as destructor
 
     def show_tasks(self) -> str:
@@ -456,16 +1185,67 @@ class Game:
         return ",\n ".join([str(task) for task in self.tasks.values()])
 
     def complete_task_of_player(self, user_id: str, task_no: int):
-        if not task_no in self.players[user_id].completed_tasks:
-            self.players[user_id].right_answer(self.tasks[task_no])
-            if task_no in self.needed_task:
-                self.tasks[self.needed_task[task_no]].send_task(user_id, self.client)
-            logging.info("Task completed: " + str(task_no) + " by " + str(user_id))
-            slack_utils.send_message(
-                "Gratulacje, zaliczyłeś zadanie " + str(task_no) + "!",
-                [user_id],
-                self.client,
+        """
+        Completes the task of a player (accepted manually by an admin).
+
+        Parameters:
+            - user_id: The id of the player.
+            - task_no: The number of the task.
+        """
+        self.complete_task_of_players([user_id], task_no)
+
+    def complete_task_of_players(
+        self, user_ids: List[str], task_no: int
+    ) -> Dict[str, List[str]]:
+        """
+        Completes the task of many players at once (accepted manually by an admin).
+        All completions are applied under one lock, and the congratulations and the unlocked tasks
+        are queued in the outbox. The game is not saved here, save it once after calling this
+        (the messages are sent after the save).
+
+        Parameters:
+            - user_ids: The ids of the players.
+            - task_no: The number of the task.
+
+        Returns:
+            The ids of the players grouped into "accepted", "already_completed" and "not_players".
+        """
+        result = {"accepted": [], "already_completed": [], "not_players": []}
+        task = self.tasks[task_no]
+        with self.lock:
+            for user_id in user_ids:
+                if user_id not in self.players:
+                    result["not_players"].append(user_id)
+                elif task_no in self.players[user_id].completed_tasks:
+                    result["already_completed"].append(user_id)
+                else:
+                    self.players[user_id].right_answer(task)
+                    self.statistics.add_solve(
+                        self.players[user_id],
+                        task,
+                        task_no,
+                        self.players[user_id].solved_at[task_no],
+                    )
+                    result["accepted"].append(user_id)
+            self.history.record(
+                {user_id: self.players[user_id].points for user_id in result["accepted"]}
             )
+            for user_id in result["accepted"]:
+                self.enqueue_message(
+                    user_id, "Gratulacje, zaliczyłeś zadanie " + str(task_no) + "!"
+                )
+                if task_no in self.needed_task:
+                    self.deliver_task(self.needed_task[task_no], user_id)
+
+        self.notify_change(result["accepted"])
+        logging.info(
+            "Task completed: "
+            + str(task_no)
+            + " by "
+            + str(len(result["accepted"]))
+            + " players"
+        )
+        return result
 
     def handle_message(
         self,
@@ -484,61 +1264,102 @@ class Game:
             - task_no: The number of the task.
             - channel: The channel.
         """
-        if task_no is None:
-            slack_utils.send_message(
-                self.RANDOM_QUOTES[random.randint(0, len(self.RANDOM_QUOTES) - 1)],
-                [channel],
-                self.client,
-                thread_ts=[thread_ts],
-            )
-            logging.info("Random quote sent to OUTER MESSAGE.")
-            return MessageType.OUTER_MESSAGE
-        elif task_no not in self.tasks:
-            slack_utils.send_message(
-                "Nie ma takiego zadania.", [channel], self.client, thread_ts=[thread_ts]
-            )
-            logging.info("Wrong task number")
-            return MessageType.OUTER_MESSAGE
-        elif task_no not in self.players[user_id].completed_tasks:
-            if self.tasks[task_no].check_answer(message):
-                logging.info("Right answer")
-                self.players[user_id].right_answer(self.tasks[task_no])
-                slack_utils.send_message(
-                    self.CORRECT_ANSWER_MESSAGES[
-                        random.randint(0, len(self.CORRECT_ANSWER_MESSAGES) - 1)
-                    ]
-                    + f"\nUkończyłeś zadanie jako #{self.players[user_id].standings[task_no]}, wszystkie punkty: {self.players[user_id].points}",
-                    [channel],
-                    self.client,
-                    thread_ts=[thread_ts],
+        result, reply = self.check_message(message, user_id, task_no)
+        self.reply_to_message(result, reply, user_id, channel, task_no, thread_ts)
+        return result
+
+    def check_message(
+        self, message: str, user_id: str, task_no: Optional[int] = None
+    ) -> Tuple["MessageType", str]:
+        """
+        Checks the message and changes the game (the answer of the player), without sending anything.
+        After a right answer the task it unlocks is queued in the outbox.
+
+        Parameters:
+            - message: The message.
+            - user_id: The id of the user.
+            - task_no: The number of the task.
+
+        Returns:
+            The type of the message and the reply to it.
+        """
+        with self.lock:
+            if task_no is None:
+                logging.info("Random quote sent to OUTER MESSAGE.")
+                return (
+                    MessageType.OUTER_MESSAGE,
+                    self.RANDOM_QUOTES[random.randint(0, len(self.RANDOM_QUOTES) - 1)],
                 )
-                if task_no in self.needed_task:
-                    logging.info("Sending needed task")
-                    self.tasks[self.needed_task[task_no]].send_task(
-                        user_id, self.client
+            elif task_no not in self.tasks:
+                logging.info("Wrong task number")
+                return MessageType.OUTER_MESSAGE, "Nie ma takiego zadania."
+            elif not self.tasks[task_no].is_open():
+                logging.info("Task closed")
+                return MessageType.OUTER_MESSAGE, "To zadanie jest już zamknięte."
+            elif task_no not in self.players[user_id].completed_tasks:
+                if self.tasks[task_no].check_answer(message):
+                    logging.info("Right answer")
+                    self.players[user_id].right_answer(self.tasks[task_no])
+                    self.statistics.add_solve(
+                        self.players[user_id],
+                        self.tasks[task_no],
+                        task_no,
+                        self.players[user_id].solved_at[task_no],
+                    )
+                    self.history.record({user_id: self.players[user_id].points})
+                    if task_no in self.needed_task:
+                        self.deliver_task(self.needed_task[task_no], user_id)
+                    return (
+                        MessageType.RIGHT_ANSWER,
+                        self.CORRECT_ANSWER_MESSAGES[
+                            random.randint(0, len(self.CORRECT_ANSWER_MESSAGES) - 1)
+                        ]
+                        + f"\nUkończyłeś zadanie jako #{self.players[user_id].standings[task_no]}, wszystkie punkty: {self.players[user_id].points}",
+                    )
+                elif self.tasks[task_no].is_near_miss(message):
+                    # Not counted as a wrong answer
+                    logging.info("Near miss")
+                    return MessageType.NEAR_MISS, self.NEAR_MISS_MESSAGE
+                else:
+                    logging.info("Wrong answer")
+                    self.players[user_id].wrong_answer(self.tasks[task_no])
+                    self.statistics.add_wrong_answer(self.players[user_id], task_no)
+                    return (
+                        MessageType.WRONG_ANSWER,
+                        self.WRONG_ANSWER_MESSAGES[
+                            random.randint(0, len(self.WRONG_ANSWER_MESSAGES) - 1)
+                        ],
                     )
-                return MessageType.RIGHT_ANSWER
             else:
-                logging.info("Wrong answer")
-                self.players[user_id].wrong_answer(self.tasks[task_no])
-                slack_utils.send_message(
-                    self.WRONG_ANSWER_MESSAGES[
-                        random.randint(0, len(self.WRONG_ANSWER_MESSAGES) - 1)
-                    ],
-                    [channel],
-                    self.client,
-                    thread_ts=[thread_ts],
+                logging.info("Task already completed")
+                return (
+                    MessageType.OUTER_MESSAGE,
+                    "Na brodę Odyna dzielny wojowniku, już wykonałeś to zadanie.",
                 )
-                return MessageType.WRONG_ANSWER
-        else:
-            slack_utils.send_message(
-                "Na brodę Odyna dzielny wojowniku, już wykonałeś to zadanie.",
-                [channel],
-                self.client,
-                thread_ts=[thread_ts],
-            )
-            logging.info("Task already completed")
-            return MessageType.OUTER_MESSAGE
+
+    def reply_to_message(
+        self,
+        result: "MessageType",
+        reply: str,
+        user_id: str,
+        channel: str,
+        task_no: Optional[int] = None,
+        thread_ts: Optional[str] = None,
+    ):
+        """
+        Sends the reply to a checked message (the unlocked task goes through the outbox).
+
+        Parameters:
+            - result: The type of the message (from check_message).
+            - reply: The reply (from check_message).
+            - user_id: The id of the user.
+            - channel: The channel.
+            - task_no: The number of the task.
+            - thread_ts: The thread of the message.
+        """
+        slack_utils.send_message(reply, [channel], self.client, thread_ts=[thread_ts])
+        if result in (MessageType.RIGHT_ANSWER, MessageType.WRONG_ANSWER):
+            self.notify_change([user_id])
 
     def generate_tasks_view(self) -> str:
         view = """{
@@ -557,6 +1378,8 @@ class Game:
                 """
         first = True
         for task_no, task in self.tasks.items():
+            if task.state == TaskState.ARCHIVED:
+                continue
             if not first:
                 view += (
                     '''
@@ -597,6 +1420,8 @@ class Game:
         view = ""
         first = True
         for task_no, task in self.tasks.items():
+            if task.state == TaskState.ARCHIVED:
+                continue
             if not first:
                 view += (
                     """
@@ -0,0 +1,148 @@
+"""
+    This module contains the class that keeps the history of the leaderboard.
+    Every scoring change is stored as a delta (only the players whose points changed),
+    with a full keyframe every KEYFRAME_INTERVAL snapshots, so reading the board at any time needs
+    at most KEYFRAME_INTERVAL deltas to be applied.
+
+    Classes:
+        - LeaderboardHistory: The history of the leaderboard.
+"""
+import bisect
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+class LeaderboardHistory:
+    """
+    This class is used to store the history of the leaderboard.
+
+    Attributes:
+        - KEYFRAME_INTERVAL: Every how many snapshots a full keyframe is stored.
+        - times: The timestamps of the snapshots.
+        - deltas: The points of the players that changed in each snapshot.
+        - keyframe_indexes: The indexes of the snapshots that have a keyframe.
+        - keyframes: The full points of the players in these snapshots.
+    """
+
+    KEYFRAME_INTERVAL = 50
+
+    def __init__(self, points: Optional[Dict[str, int]] = None):
+        """
+        The constructor.
+
+        Parameters:
+            - points: The points of the players at the start of the history.
+        """
+        self.times = []
+        self.deltas = []
+        self.keyframe_indexes = []
+        self.keyframes = []
+        self._current = {}
+        if points is not None and len(points) > 0:
+            self.record(points)
+
+    def __len__(self) -> int:
+        """
+        Returns the number of snapshots.
+        """
+        return len(self.times)
+
+    def record(self, changed_points: Dict[str, int], timestamp: Optional[float] = None):
+        """
+        Records a snapshot of the leaderboard after a scoring change.
+
+        Parameters:
+            - changed_points: The new points of the players that changed.
+            - timestamp: When the change happened (now by default).
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        if len(self.times) > 0 and timestamp < self.times[-1]:
+            timestamp = self.times[-1]
+        delta = {
+            user_id: points
+            for user_id, points in changed_points.items()
+            if self._current.get(user_id) != points
+        }
+        if len(delta) == 0:
+            return
+        self._current.update(delta)
+        self.times.append(timestamp)
+        self.deltas.append(delta)
+        if (len(self.times) - 1) % self.KEYFRAME_INTERVAL == 0:
+            self.keyframe_indexes.append(len(self.times) - 1)
+            self.keyframes.append(dict(self._current))
+        logging.debug("[HISTORY] Snapshot recorded: " + str(delta))
+
+    def current(self) -> Dict[str, int]:
+        """
+        Returns the points of the players in the last snapshot.
+
+        Returns:
+            The points of the players.
+        """
+        return dict(self._current)
+
+    def board_at(self, timestamp: float) -> Dict[str, int]:
+        """
+        Returns the points of the players at the given time.
+
+        Parameters:
+            - timestamp: The time.
+
+        Returns:
+            The points of the players (empty before the first snapshot).
+        """
+        last = bisect.bisect_right(self.times, timestamp) - 1
+        if last < 0:
+            return {}
+        keyframe_no = bisect.bisect_right(self.keyframe_indexes, last) - 1
+        index = self.keyframe_indexes[keyframe_no]
+        board = dict(self.keyframes[keyframe_no])
+        for delta in self.deltas[index + 1 : last + 1]:
+            board.update(delta)
+        return board
+
+    def ranking_at(self, timestamp: float) -> List[Tuple[str, int]]:
+        """
+        Returns the leaderboard at the given time.
+
+        Parameters:
+            - timestamp: The time.
+
+        Returns:
+            The (user ID, points) pairs, from the best player.
+        """
+        board = self.board_at(timestamp)
+        return sorted(board.items(), key=lambda item: item[1], reverse=True)
+
+    def rank_trajectory(self, user_id: str) -> List[Tuple[float, int, int]]:
+        """
+        Returns how the rank of the player changed over the event.
+        The rank is the number of players with more points plus one (among the players that have scored).
+
+        Parameters:
+            - user_id: The ID of the user.
+
+        Returns:
+            The (timestamp, rank, points) triples, one for every snapshot where the rank or points changed.
+        """
+        board = {}
+        sorted_points = []
+        trajectory = []
+        for timestamp, delta in zip(self.times, self.deltas):
+            for changed_user_id, points in delta.items():
+                if changed_user_id in board:
+                    del sorted_points[
+                        bisect.bisect_left(sorted_points, board[changed_user_id])
+                    ]
+                board[changed_user_id] = points
+                bisect.insort(sorted_points, points)
+            if user_id not in board:
+                continue
+            points = board[user_id]
+            rank = len(sorted_points) - bisect.bisect_right(sorted_points, points) + 1
+            if len(trajectory) == 0 or trajectory[-1][1:] != (rank, points):
+                trajectory.append((timestamp, rank, points))
+        return trajectory
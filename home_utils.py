@@ -0,0 +1,245 @@
+"""
+    This module contains the functions and the class that are used to render and publish the App Home tab.
+
+    Functions:
+        - rank_of_player: Returns the rank of the player.
+        - open_tasks_of_player: Returns the tasks the player can answer now.
+        - generate_player_home_view: Generates the home tab of a player.
+
+    Classes:
+        - HomePublisher: Publishes the home tabs, skipping unchanged ones and coalescing refreshes.
+"""
+import hashlib
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from slack_sdk.web.client import WebClient
+
+import game_utils
+
+RECENT_RESULTS = 5
+
+
+def rank_of_player(game: game_utils.Game, user_id: str) -> int:
+    """
+    Returns the rank of the player (the number of players with more points plus one).
+
+    Parameters:
+        - game: The game.
+        - user_id: The ID of the user.
+
+    Returns:
+        The rank.
+    """
+    points = game.players[user_id].points
+    return 1 + sum(1 for player in game.players.values() if player.points > points)
+
+
+def open_tasks_of_player(
+    game: game_utils.Game, user_id: str
+) -> List[game_utils.Task]:
+    """
+    Returns the tasks the player can answer now (released and not completed yet).
+
+    Parameters:
+        - game: The game.
+        - user_id: The ID of the user.
+
+    Returns:
+        The tasks.
+    """
+    player = game.players[user_id]
+    now = datetime.now()
+    tasks = []
+    for task_no, task in game.live_tasks().items():
+        if task_no in player.completed_tasks:
+            continue
+        if task.date_and_time is not None and task.date_and_time > now:
+            continue
+        if task.needed_task is not None and task.needed_task not in player.completed_tasks:
+            continue
+        tasks.append(task)
+    return tasks
+
+
+def generate_player_home_view(game: game_utils.Game, user_id: str) -> Dict[str, Any]:
+    """
+    Generates the home tab of a player: points, rank, open tasks and recent results.
+
+    Parameters:
+        - game: The game.
+        - user_id: The ID of the user.
+
+    Returns:
+        The view of the home tab.
+    """
+    leaderboard_button = {
+        "type": "actions",
+        "elements": [
+            {
+                "type": "button",
+                "text": {
+                    "type": "plain_text",
+                    "text": "Pokaż wyniki wojowników",
+                    "emoji": True,
+                },
+                "value": "leaderboard_modal",
+                "action_id": "app_home_buttons",
+            }
+        ],
+    }
+    if user_id not in game.players:
+        return {"type": "home", "blocks": [leaderboard_button]}
+
+    player = game.players[user_id]
+    open_tasks = open_tasks_of_player(game, user_id)
+    recent = sorted(
+        player.solved_at.items(), key=lambda item: item[1], reverse=True
+    )[:RECENT_RESULTS]
+
+    blocks = [
+        {
+            "type": "header",
+            "text": {"type": "plain_text", "text": "Witaj wojowniku!", "emoji": True},
+        },
+        {
+            "type": "section",
+            "fields": [
+                {"type": "mrkdwn", "text": "*Punkty:* " + str(player.points)},
+                {
+                    "type": "mrkdwn",
+                    "text": "*Miejsce:* #" + str(rank_of_player(game, user_id)),
+                },
+            ],
+        },
+        {"type": "divider"},
+        {
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": "*Otwarte zadania:* "
+                + (
+                    ", ".join("#" + str(task.task_no) for task in open_tasks)
+                    if len(open_tasks) > 0
+                    else "brak"
+                ),
+            },
+        },
+        {
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": "*Ostatnie wyniki:*\n"
+                + (
+                    "\n".join(
+                        "Zadanie #"
+                        + str(task_no)
+                        + " - ukończone jako #"
+                        + str(player.standings.get(task_no, "?"))
+                        for task_no, _ in recent
+                    )
+                    if len(recent) > 0
+                    else "brak"
+                ),
+            },
+        },
+        leaderboard_button,
+    ]
+    return {"type": "home", "blocks": blocks}
+
+
+class HomePublisher:
+    """
+    This class is used to publish the home tabs.
+    Keeps the hash of the last published view of every user and skips views_publish when nothing changed.
+    Refreshes after a change of the game are coalesced, so a user's home is published at most once per interval.
+
+    Attributes:
+        - render: Returns the view (JSON string) of the home tab of the user.
+        - interval: The minimal number of seconds between two publishes of the same home.
+        - published_hashes: Maps the user ID to the hash of the last published view.
+        - skipped: The number of publishes skipped, as the view did not change.
+    """
+
+    def __init__(
+        self,
+        client: WebClient,
+        render: Callable[[str], str],
+        interval: float = 5.0,
+    ):
+        """
+        The constructor.
+
+        Parameters:
+            - client: The slack client.
+            - render: Returns the view (JSON string) of the home tab of the user.
+            - interval: The minimal number of seconds between two publishes of the same home.
+        """
+        self.client = client
+        self.render = render
+        self.interval = interval
+        self.published_hashes = {}
+        self.skipped = 0
+        self._last_publish = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def publish(self, user_id: str, client: Optional[WebClient] = None) -> bool:
+        """
+        Publishes the home tab of the user, if it changed since the last publish.
+
+        Parameters:
+            - user_id: The ID of the user.
+            - client: The slack client (the one from the constructor by default).
+
+        Returns:
+            True if the view was published.
+        """
+        view = self.render(user_id)
+        view_hash = hashlib.sha1(view.encode("utf-8")).hexdigest()
+        with self._lock:
+            if self.published_hashes.get(user_id) == view_hash:
+                self.skipped += 1
+                return False
+            self.published_hashes[user_id] = view_hash
+            self._last_publish[user_id] = time.monotonic()
+        try:
+            (client or self.client).views_publish(user_id=user_id, view=view)
+        except Exception:
+            # Publish again next time
+            with self._lock:
+                self.published_hashes.pop(user_id, None)
+            raise
+        return True
+
+    def request_refresh(self, user_ids: List[str]):
+        """
+        Requests a refresh of the home tabs after a change of the game.
+        Only homes that have been opened are refreshed, at most once per interval.
+
+        Parameters:
+            - user_ids: The IDs of the users.
+        """
+        now = time.monotonic()
+        with self._lock:
+            for user_id in user_ids:
+                if user_id not in self.published_hashes or user_id in self._pending:
+                    continue
+                delay = max(
+                    0.0, self._last_publish.get(user_id, 0.0) + self.interval - now
+                )
+                timer = threading.Timer(delay, self._refresh, args=(user_id,))
+                timer.daemon = True
+                self._pending[user_id] = timer
+                timer.start()
+
+    def _refresh(self, user_id: str):
+        with self._lock:
+            self._pending.pop(user_id, None)
+        try:
+            self.publish(user_id)
+        except Exception as e:
+            logging.exception("[HOME] Refresh failed for " + user_id + ": " + str(e))
@@ -0,0 +1,333 @@
+"""
+    This module contains the functions that are used to import and export whole task plans (JSON, CSV or YAML files).
+
+    Functions:
+        - detect_format: Detects the format of the plan from the file name.
+        - parse_task_plan: Parses the text of the plan into rows.
+        - build_tasks: Validates the rows and creates the tasks from them.
+        - import_task_plan: Adds all tasks of the plan to the game and releases them in one pass.
+        - export_task_plan: Exports the tasks of the game as a plan.
+
+    Usage (when the bot is not running, as it keeps the game in memory):
+        python import_utils.py import plan.json
+        python import_utils.py export plan.csv
+"""
+import csv
+import io
+import json
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from slack_sdk.web.client import WebClient
+
+import game_utils
+import outbox_utils
+import slack_utils
+import storage_utils
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+PLAN_FORMATS = ["json", "csv", "yaml"]
+
+PLAN_FIELDS = [
+    "task_no",
+    "points",
+    "description",
+    "correct_answers",
+    "needed_task",
+    "is_dm",
+    "channel",
+    "date_and_time",
+    "do_letters_case_matter",
+    "near_miss_distance",
+]
+
+
+def detect_format(file_name: str) -> str:
+    """
+    Detects the format of the plan from the file name.
+
+    Parameters:
+        - file_name: The name of the file.
+
+    Returns:
+        The format of the plan (one of PLAN_FORMATS).
+    """
+    extension = file_name.rsplit(".", 1)[-1].lower()
+    if extension == "yml":
+        extension = "yaml"
+    if extension not in PLAN_FORMATS:
+        raise ValueError(
+            "Unknown plan format '" + extension + "', use one of " + str(PLAN_FORMATS)
+        )
+    return extension
+
+
+def parse_task_plan(text: str, plan_format: str) -> List[Dict[str, Any]]:
+    """
+    Parses the text of the plan into rows.
+
+    Parameters:
+        - text: The text of the plan.
+        - plan_format: The format of the plan.
+
+    Returns:
+        The rows of the plan.
+    """
+    if plan_format == "json":
+        rows = json.loads(text)
+    elif plan_format == "yaml":
+        if yaml is None:
+            raise ValueError("YAML plans need PyYAML installed (pip install pyyaml)")
+        rows = yaml.safe_load(text)
+    elif plan_format == "csv":
+        rows = list(csv.DictReader(io.StringIO(text)))
+    else:
+        raise ValueError("Unknown plan format '" + plan_format + "'")
+
+    if isinstance(rows, dict) and "tasks" in rows:
+        rows = rows["tasks"]
+    if not isinstance(rows, list):
+        raise ValueError("The plan has to be a list of tasks")
+    return rows
+
+
+def _parse_bool(value: Any) -> bool:
+    if isinstance(value, bool):
+        return value
+    if value is None:
+        return False
+    return str(value).strip().lower() in ["true", "1", "yes", "tak", "dm"]
+
+
+def _parse_optional_int(value: Any) -> Optional[int]:
+    if value is None or value == "":
+        return None
+    return int(value)
+
+
+def _parse_answers(value: Any) -> List[str]:
+    if value is None or value == "":
+        return []
+    if isinstance(value, list):
+        return [str(answer) for answer in value]
+    return str(value).split(";")
+
+
+def _parse_date(value: Any) -> datetime:
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value)
+    return datetime.fromisoformat(str(value).strip())
+
+
+def build_tasks(
+    rows: List[Dict[str, Any]], game: game_utils.Game, default_channel: str
+) -> List[game_utils.Task]:
+    """
+    Validates the rows and creates the tasks from them. Nothing is added to the game here,
+    so a plan with any error does not change the game.
+
+    Parameters:
+        - rows: The rows of the plan.
+        - game: The game the tasks will be added to.
+        - default_channel: The channel used when the row does not give one.
+
+    Returns:
+        The tasks, in the order of the rows.
+    """
+    errors = []
+    parsed = []
+    next_task_no = max(game.tasks.keys(), default=-1) + 1
+    for row_no, row in enumerate(rows, start=1):
+        try:
+            task_no = _parse_optional_int(row.get("task_no"))
+            if task_no is None:
+                task_no = next_task_no
+            next_task_no = max(next_task_no, task_no + 1)
+            parsed.append(
+                {
+                    "task_no": task_no,
+                    "points": int(row["points"]),
+                    "description": str(row["description"]),
+                    "correct_answers": _parse_answers(row.get("correct_answers")),
+                    "needed_task": _parse_optional_int(row.get("needed_task")),
+                    "is_dm": _parse_bool(row.get("is_dm", True)),
+                    "channel": row.get("channel") or default_channel,
+                    "date_and_time": _parse_date(row["date_and_time"]),
+                    "do_letters_case_matter": _parse_bool(
+                        row.get("do_letters_case_matter")
+                    ),
+                    "near_miss_distance": _parse_optional_int(row.get("near_miss_distance"))
+                    or 0,
+                }
+            )
+        except (KeyError, ValueError, TypeError) as e:
+            errors.append("Row " + str(row_no) + ": " + type(e).__name__ + " " + str(e))
+
+    # Check the IDs and the dependencies
+    plan_task_nos = set()
+    needed_by = dict(game.needed_task)
+    for data in parsed:
+        if data["task_no"] in game.tasks or data["task_no"] in plan_task_nos:
+            errors.append("Task " + str(data["task_no"]) + " already exists")
+        plan_task_nos.add(data["task_no"])
+    for data in parsed:
+        needed_task = data["needed_task"]
+        if needed_task is None:
+            continue
+        if needed_task not in game.tasks and needed_task not in plan_task_nos:
+            errors.append(
+                "Task "
+                + str(data["task_no"])
+                + " needs task "
+                + str(needed_task)
+                + " which does not exist"
+            )
+        elif needed_task in needed_by:
+            errors.append(
+                "Task "
+                + str(needed_task)
+                + " is already needed by task "
+                + str(needed_by[needed_task])
+            )
+        else:
+            needed_by[needed_task] = data["task_no"]
+
+    # Follow the chains of needed tasks to find cycles
+    needs = {data["task_no"]: data["needed_task"] for data in parsed}
+    for task_no in needs:
+        seen = set()
+        current = task_no
+        while current in needs and needs[current] is not None:
+            if current in seen:
+                errors.append("Task " + str(task_no) + " is in a cycle of needed tasks")
+                break
+            seen.add(current)
+            current = needs[current]
+
+    if len(errors) > 0:
+        raise ValueError("\n".join(errors))
+
+    return [game_utils.Task(**data) for data in parsed]
+
+
+def import_task_plan(
+    game: game_utils.Game,
+    text: str,
+    plan_format: str,
+    asgard_channel: str,
+    player_ids: List[str],
+) -> List[game_utils.Task]:
+    """
+    Adds all tasks of the plan to the game and releases them in one pass.
+    The users of the channel are fetched once for the whole plan by the caller, before the transaction
+    of the game. The game is not saved here (the tasks are sent from the outbox after it is saved).
+
+    Parameters:
+        - game: The game.
+        - text: The text of the plan.
+        - plan_format: The format of the plan.
+        - asgard_channel: The default channel of the tasks.
+        - player_ids: The users of the channel of the game (the recipients of the tasks).
+
+    Returns:
+        The added tasks.
+    """
+    tasks = build_tasks(parse_task_plan(text, plan_format), game, asgard_channel)
+    game.add_tasks(tasks)
+    game.release_tasks(tasks, player_ids)
+    logging.info("[IMPORT] Imported " + str(len(tasks)) + " tasks.")
+    return tasks
+
+
+def export_task_plan(game: game_utils.Game, plan_format: str) -> str:
+    """
+    Exports the tasks of the game as a plan, which can be imported again.
+
+    Parameters:
+        - game: The game.
+        - plan_format: The format of the plan.
+
+    Returns:
+        The text of the plan.
+    """
+    rows = []
+    for task_no in sorted(game.tasks.keys()):
+        task = game.tasks[task_no]
+        rows.append(
+            {
+                "task_no": task.task_no,
+                "points": int(task.points),
+                "description": task.raw_description(),
+                "correct_answers": list(task.correct_answers or []),
+                "needed_task": task.needed_task,
+                "is_dm": task.is_dm,
+                "channel": task.channel,
+                "date_and_time": task.date_and_time.isoformat(sep=" ")
+                if task.date_and_time is not None
+                else None,
+                "do_letters_case_matter": task.do_letters_case_matter,
+                "near_miss_distance": task.near_miss_distance,
+            }
+        )
+
+    if plan_format == "json":
+        return json.dumps(rows, ensure_ascii=False, indent=4)
+    elif plan_format == "yaml":
+        if yaml is None:
+            raise ValueError("YAML plans need PyYAML installed (pip install pyyaml)")
+        return yaml.safe_dump(rows, allow_unicode=True, sort_keys=False)
+    elif plan_format == "csv":
+        output = io.StringIO()
+        writer = csv.DictWriter(output, fieldnames=PLAN_FIELDS)
+        writer.writeheader()
+        for row in rows:
+            row["correct_answers"] = ";".join(row["correct_answers"])
+            row["needed_task"] = "" if row["needed_task"] is None else row["needed_task"]
+            writer.writerow(row)
+        return output.getvalue()
+    raise ValueError("Unknown plan format '" + plan_format + "'")
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+    from pathlib import Path
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(description="Import or export the task plan.")
+    parser.add_argument("command", choices=["import", "export"])
+    parser.add_argument("file")
+    parser.add_argument("--game", default="saved/game_save")
+    parser.add_argument("--channel", default="C04P6595G5S")
+    parser.add_argument("--storage", choices=storage_utils.STORAGE_KINDS, default="pickle")
+    args = parser.parse_args()
+
+    storage = storage_utils.create_storage(args.storage, args.game)
+    game = storage.load()
+    plan_format = detect_format(args.file)
+    if args.command == "import":
+        load_dotenv(dotenv_path=Path(".") / ".env")
+        client = WebClient(token=os.environ.get("BOT_TOKEN"))
+        game.set_client(client)
+        with open(args.file, "r", encoding="utf-8") as f:
+            tasks = import_task_plan(
+                game,
+                f.read(),
+                plan_format,
+                args.channel,
+                slack_utils.get_channel_users(args.channel, client),
+            )
+        storage.save(game)
+        outbox_utils.OutboxSender(game, storage, client).drain()
+        print("Imported " + str(len(tasks)) + " tasks.")
+    else:
+        with open(args.file, "w", encoding="utf-8", newline="") as f:
+            f.write(export_task_plan(game, plan_format))
+        print("Exported " + str(len(game.tasks)) + " tasks.")
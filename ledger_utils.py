@@ -0,0 +1,150 @@
+"""
+    This module contains the ledger of the deliveries of the tasks: which tasks were queued for which
+    players (or channels), with the sent message once it is sent. Every delivery of a task checks it first,
+    so a player rejoining the channel or an admin releasing the tasks again gets no second copy.
+
+    Classes:
+        - DeliveryLedger: The recipients of every task as a bitset, with the sent messages.
+"""
+from typing import Dict, List, Optional, Tuple
+
+
+class DeliveryLedger:
+    """
+    This class is used to remember the deliveries of the tasks.
+    Every recipient gets a number the first time it gets a task, and every task keeps a bitset
+    (a bytearray) of the numbers of its recipients, so the ledger of a task with thousands
+    of players takes a few hundred bytes.
+
+    Attributes:
+        - recipients: The recipients (user IDs or channels), by their numbers.
+        - refs: Maps the (task number, recipient number) to the (channel, ts or scheduled message ID)
+          pair of the sent message.
+    """
+
+    def __init__(self):
+        """
+        The constructor.
+        """
+        self.recipients = []
+        self.refs = {}
+        self._numbers = {}
+        self._bits = {}
+
+    def __getstate__(self) -> Dict:
+        """
+        Returns the state to pickle.
+        """
+        state = self.__dict__.copy()
+        state.pop("_numbers", None)
+        return state
+
+    def __setstate__(self, state: Dict):
+        """
+        Restores the pickled state (the numbers of the recipients are not saved).
+        """
+        self.__dict__.update(state)
+        self._numbers = {recipient: number for number, recipient in enumerate(self.recipients)}
+
+    def has(self, task_no: int, recipient: str) -> bool:
+        """
+        Checks if the task was queued for (or sent to) the recipient.
+
+        Parameters:
+            - task_no: The number of the task.
+            - recipient: The user ID or the channel.
+        """
+        number = self._numbers.get(recipient)
+        bits = self._bits.get(task_no)
+        if number is None or bits is None or number >> 3 >= len(bits):
+            return False
+        return bool(bits[number >> 3] & (1 << (number & 7)))
+
+    def mark(self, task_no: int, recipient: str, ref: Optional[Tuple[str, str]] = None):
+        """
+        Remembers that the task was queued for the recipient (and the sent message, if given).
+
+        Parameters:
+            - task_no: The number of the task.
+            - recipient: The user ID or the channel.
+            - ref: The (channel, ts or scheduled message ID) pair of the sent message.
+        """
+        number = self._numbers.get(recipient)
+        if number is None:
+            number = len(self.recipients)
+            self.recipients.append(recipient)
+            self._numbers[recipient] = number
+        bits = self._bits.setdefault(task_no, bytearray())
+        if number >> 3 >= len(bits):
+            bits.extend(bytes((number >> 3) + 1 - len(bits)))
+        bits[number >> 3] |= 1 << (number & 7)
+        if ref is not None:
+            self.refs[(task_no, number)] = tuple(ref)
+
+    def forget(self, task_no: int, recipient: Optional[str] = None):
+        """
+        Forgets the delivery of the task to the recipient (to all recipients if None),
+        so it can be delivered again.
+
+        Parameters:
+            - task_no: The number of the task.
+            - recipient: The user ID or the channel.
+        """
+        if recipient is None:
+            self._bits.pop(task_no, None)
+            self.refs = {key: ref for key, ref in self.refs.items() if key[0] != task_no}
+            return
+        if not self.has(task_no, recipient):
+            return
+        number = self._numbers[recipient]
+        self._bits[task_no][number >> 3] &= ~(1 << (number & 7)) & 0xFF
+        self.refs.pop((task_no, number), None)
+
+    def ref(self, task_no: int, recipient: str) -> Optional[Tuple[str, str]]:
+        """
+        Returns the (channel, ts or scheduled message ID) pair of the task sent to the recipient
+        (None if it was not sent yet).
+
+        Parameters:
+            - task_no: The number of the task.
+            - recipient: The user ID or the channel.
+        """
+        number = self._numbers.get(recipient)
+        return self.refs.get((task_no, number)) if number is not None else None
+
+    def recipients_of(self, task_no: int) -> List[str]:
+        """
+        Returns the recipients the task was queued for.
+
+        Parameters:
+            - task_no: The number of the task.
+        """
+        bits = self._bits.get(task_no, b"")
+        return [
+            self.recipients[(i << 3) + j]
+            for i, byte in enumerate(bits)
+            if byte
+            for j in range(8)
+            if byte & (1 << j)
+        ]
+
+    def to_dict(self) -> Dict[int, Dict[str, int]]:
+        """
+        Returns the number of recipients and sent messages of every task (for the admin).
+        """
+        sent = {}
+        for task_no, _ in self.refs.keys():
+            sent[task_no] = sent.get(task_no, 0) + 1
+        return {
+            task_no: {"recipients": self.count(task_no), "sent": sent.get(task_no, 0)}
+            for task_no in sorted(self._bits.keys())
+        }
+
+    def count(self, task_no: int) -> int:
+        """
+        Returns the number of recipients the task was queued for.
+
+        Parameters:
+            - task_no: The number of the task.
+        """
+        return sum(bin(byte).count("1") for byte in self._bits.get(task_no, b""))
@@ -0,0 +1,256 @@
+"""
+    This module contains the classes that limit how many answers a player can send and how many replies they get.
+
+    Classes:
+        - AttemptDecision: What to do with an answer of the player.
+        - AttemptLimiter: Sliding window limit of the answers of a player to a task.
+        - ReplyCoalescer: Collapses a burst of wrong answer replies into one summary reply.
+"""
+import collections
+import logging
+import threading
+import time
+from enum import Enum
+from typing import Any, Callable, Dict, List, Optional
+
+from slack_sdk.web.client import WebClient
+
+import slack_utils
+
+
+class AttemptDecision(Enum):
+    """
+    This class is used to represent what to do with an answer of the player.
+    """
+
+    # The answer is checked
+    ALLOWED = 1
+    # The answer is over the limit, the player is told once per window
+    LIMITED = 2
+    # The answer is over the limit and the player has already been told, nothing is sent
+    DROPPED = 3
+
+
+class AttemptLimiter:
+    """
+    This class is used to limit the answers of every player to every task:
+    at most max_attempts answers in the last window seconds.
+    With load (worker processes sharing a database) the answers in the window are read from the database,
+    so the answers handled by every process count, and the clock is time.time() instead of time.monotonic().
+
+    Attributes:
+        - max_attempts: The number of answers allowed in the window.
+        - window: The length of the window in seconds.
+        - load: Returns the times of the saved answers of a player to a task since a time (or None).
+        - allowed: The number of answers allowed.
+        - dropped: The number of answers over the limit.
+        - dropped_by_user: Maps the user ID to the number of their answers over the limit.
+    """
+
+    # Every how many answers the players with empty windows are forgotten
+    PRUNE_EVERY = 1000
+
+    def __init__(
+        self,
+        max_attempts: int = 5,
+        window: float = 60.0,
+        load: Optional[Callable[[str, int, float], List[float]]] = None,
+    ):
+        """
+        The constructor.
+
+        Parameters:
+            - max_attempts: The number of answers allowed in the window.
+            - window: The length of the window in seconds.
+            - load: Returns the times of the saved answers of a player to a task since a time (or None).
+        """
+        self.max_attempts = max_attempts
+        self.window = window
+        self.load = load
+        self.allowed = 0
+        self.dropped = 0
+        self.dropped_by_user = {}
+        # Maps (user ID, task number) to the times of the allowed answers in the window
+        self._attempts = {}
+        # The (user ID, task number) pairs told about the limit, until their window ends
+        self._told = set()
+        self._lock = threading.Lock()
+
+    def check(self, user_id: str, task_no: int, now: Optional[float] = None) -> AttemptDecision:
+        """
+        Checks if the answer of the player to the task can be checked, and counts it.
+
+        Parameters:
+            - user_id: The ID of the user.
+            - task_no: The number of the task.
+            - now: The time of the answer (the clock of the limiter, now by default).
+
+        Returns:
+            The decision.
+        """
+        if now is None:
+            now = self._now()
+        key = (user_id, task_no)
+        # Read outside the lock, not to hold the other players during the query
+        saved = self.load(user_id, task_no, now - self.window) if self.load is not None else None
+        with self._lock:
+            if (self.allowed + self.dropped) % self.PRUNE_EVERY == 0:
+                self._prune(now)
+            if saved is not None:
+                self._attempts[key] = collections.deque(saved)
+            attempts = self._attempts.get(key)
+            if attempts is None:
+                attempts = collections.deque()
+                self._attempts[key] = attempts
+            while len(attempts) > 0 and attempts[0] <= now - self.window:
+                attempts.popleft()
+            if len(attempts) < self.max_attempts:
+                attempts.append(now)
+                self._told.discard(key)
+                self.allowed += 1
+                return AttemptDecision.ALLOWED
+            self.dropped += 1
+            self.dropped_by_user[user_id] = self.dropped_by_user.get(user_id, 0) + 1
+            if key in self._told:
+                return AttemptDecision.DROPPED
+            self._told.add(key)
+        logging.info("[LIMIT] " + user_id + " is over the limit of task " + str(task_no))
+        return AttemptDecision.LIMITED
+
+    def retry_after(self, user_id: str, task_no: int, now: Optional[float] = None) -> float:
+        """
+        Returns after how many seconds the player can answer the task again.
+
+        Parameters:
+            - user_id: The ID of the user.
+            - task_no: The number of the task.
+            - now: The time (the clock of the limiter, now by default).
+        """
+        if now is None:
+            now = self._now()
+        with self._lock:
+            attempts = self._attempts.get((user_id, task_no))
+            if attempts is None or len(attempts) < self.max_attempts:
+                return 0.0
+            return max(attempts[0] + self.window - now, 0.0)
+
+    def configure(self, max_attempts: int, window: float):
+        """
+        Changes the limit (the answers already in the windows are kept).
+
+        Parameters:
+            - max_attempts: The number of answers allowed in the window.
+            - window: The length of the window in seconds.
+        """
+        with self._lock:
+            self.max_attempts = max_attempts
+            self.window = window
+
+    def prune(self, now: Optional[float] = None):
+        """
+        Forgets the players whose windows are empty.
+
+        Parameters:
+            - now: The time (the clock of the limiter, now by default).
+        """
+        if now is None:
+            now = self._now()
+        with self._lock:
+            self._prune(now)
+
+    def _now(self) -> float:
+        return time.time() if self.load is not None else time.monotonic()
+
+    def _prune(self, now: float):
+        for key in [
+            key
+            for key, attempts in self._attempts.items()
+            if len(attempts) == 0 or attempts[-1] <= now - self.window
+        ]:
+            del self._attempts[key]
+            self._told.discard(key)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Returns the limit and its counters (for the admin).
+
+        Returns:
+            The limit and the counters.
+        """
+        with self._lock:
+            return {
+                "max_attempts": self.max_attempts,
+                "window": self.window,
+                "allowed": self.allowed,
+                "dropped": self.dropped,
+                "dropped_by_user": dict(
+                    sorted(self.dropped_by_user.items(), key=lambda item: item[1], reverse=True)
+                ),
+            }
+
+
+class ReplyCoalescer:
+    """
+    This class is used to collapse a burst of wrong answer replies.
+    The first wrong answer of a player in a thread gets its reply at once, the ones in the next
+    window seconds get one summary reply at the end of the window.
+
+    Attributes:
+        - client: The slack client.
+        - window: The length of the window in seconds.
+        - coalesced: The number of replies collapsed into summaries.
+    """
+
+    SUMMARY_MESSAGE = "Odyn widział jeszcze {} złych odpowiedzi. Zastanów się dobrze, wojowniku."
+
+    def __init__(self, client: WebClient, window: float = 10.0):
+        """
+        The constructor.
+
+        Parameters:
+            - client: The slack client.
+            - window: The length of the window in seconds.
+        """
+        self.client = client
+        self.window = window
+        self.coalesced = 0
+        # Maps (user ID, channel, thread) to the number of replies waiting for the summary
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def coalesce(self, user_id: str, channel: str, thread_ts: Optional[str]) -> bool:
+        """
+        Registers a wrong answer reply.
+
+        Parameters:
+            - user_id: The ID of the user.
+            - channel: The channel of the reply.
+            - thread_ts: The thread of the reply.
+
+        Returns:
+            True if the reply will be in the summary, False if it should be sent now.
+        """
+        key = (user_id, channel, thread_ts)
+        with self._lock:
+            if key in self._pending:
+                self._pending[key] += 1
+                self.coalesced += 1
+                return True
+            self._pending[key] = 0
+        timer = threading.Timer(self.window, self._flush, args=(key,))
+        timer.daemon = True
+        timer.start()
+        return False
+
+    def _flush(self, key):
+        with self._lock:
+            count = self._pending.pop(key, 0)
+        if count == 0:
+            return
+        _, channel, thread_ts = key
+        try:
+            slack_utils.send_message(
+                self.SUMMARY_MESSAGE.format(count), [channel], self.client, [thread_ts]
+            )
+        except Exception as e:
+            logging.exception("[LIMIT] Summary reply failed: " + str(e))
@@ -0,0 +1,279 @@
+"""
+    This module contains the views of the game that are kept up to date after changes: the open
+    modals (leaderboard, players) and the scoreboard pinned in the channel of the game.
+
+    Classes:
+        - LiveModals: Opens the live modals, remembers them until they are closed and updates them after changes.
+        - ChannelScoreboard: Posts and pins the scoreboard once, then edits it in place after changes.
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+from typing import Any, Callable, ContextManager, Dict, List, Optional
+
+from slack_sdk.web.client import WebClient
+
+import slack_utils
+
+# The callback ID of the live modals (Slack sends view_closed events for them)
+LIVE_CALLBACK_ID = "live_modal"
+
+
+class LiveModals:
+    """
+    This class is used to keep the open modals up to date.
+    The modals are opened with notify_on_close, so they are forgotten when closed. After a change of
+    the game, every kind of modal is rendered once for all its open views, and each view is updated at
+    most once per interval (with the hash of its last version, so an older update never wins).
+
+    Attributes:
+        - client: The slack client.
+        - render: Returns the view (JSON string) of the kind of modal.
+        - interval: The minimal number of seconds between two updates.
+        - views: Maps the view ID to the kind, the hash of Slack and the hash of the content of the open view.
+        - updated: The number of views_update calls.
+        - skipped: The number of updates skipped, as the view did not change.
+    """
+
+    def __init__(
+        self,
+        client: WebClient,
+        render: Callable[[str], str],
+        interval: float = 5.0,
+    ):
+        """
+        The constructor.
+
+        Parameters:
+            - client: The slack client.
+            - render: Returns the view (JSON string) of the kind of modal.
+            - interval: The minimal number of seconds between two updates.
+        """
+        self.client = client
+        self.render = render
+        self.interval = interval
+        self.views = {}
+        self.updated = 0
+        self.skipped = 0
+        # Maps the kind to the last rendered view and the hash of its content, until the next change
+        self._rendered = {}
+        # Counts the changes, so a view rendered during a change is not cached
+        self._generation = 0
+        self._last_update = 0.0
+        self._pending = None
+        self._lock = threading.Lock()
+
+    def open(self, kind: str, trigger_id: str, client: Optional[WebClient] = None):
+        """
+        Opens a live modal and remembers it.
+
+        Parameters:
+            - kind: The kind of modal (passed to render).
+            - trigger_id: The trigger of the interaction.
+            - client: The slack client (the one from the constructor by default).
+        """
+        view, content_hash = self._view(kind)
+        response = (client or self.client).views_open(trigger_id=trigger_id, view=view)
+        with self._lock:
+            self.views[response["view"]["id"]] = {
+                "kind": kind,
+                "hash": response["view"]["hash"],
+                "content_hash": content_hash,
+                "client": client or self.client,
+            }
+
+    def closed(self, view_id: str):
+        """
+        Forgets a closed modal.
+
+        Parameters:
+            - view_id: The ID of the view.
+        """
+        with self._lock:
+            self.views.pop(view_id, None)
+
+    def request_refresh(self, user_ids: List[str]):
+        """
+        Requests an update of the open modals after a change of the game, at most once per interval.
+
+        Parameters:
+            - user_ids: The IDs of the players whose state changed.
+        """
+        with self._lock:
+            self._rendered = {}
+            self._generation += 1
+            if len(self.views) == 0 or self._pending is not None:
+                return
+            delay = max(0.0, self._last_update + self.interval - time.monotonic())
+            self._pending = threading.Timer(delay, self._refresh)
+            self._pending.daemon = True
+            self._pending.start()
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Returns the number of open modals by kind and the counters (for the admin).
+        """
+        with self._lock:
+            kinds = {}
+            for view in self.views.values():
+                kinds[view["kind"]] = kinds.get(view["kind"], 0) + 1
+            return {"open": kinds, "updated": self.updated, "skipped": self.skipped}
+
+    def _view(self, kind: str):
+        with self._lock:
+            if kind in self._rendered:
+                return self._rendered[kind]
+            generation = self._generation
+        view = json.loads(self.render(kind))
+        view["callback_id"] = LIVE_CALLBACK_ID
+        view["notify_on_close"] = True
+        view = json.dumps(view)
+        rendered = (view, hashlib.sha1(view.encode("utf-8")).hexdigest())
+        with self._lock:
+            if self._generation == generation:
+                self._rendered[kind] = rendered
+        return rendered
+
+    def _refresh(self):
+        with self._lock:
+            self._pending = None
+            self._last_update = time.monotonic()
+            views = list(self.views.items())
+        for view_id, state in views:
+            try:
+                view, content_hash = self._view(state["kind"])
+                if content_hash == state["content_hash"]:
+                    self.skipped += 1
+                    continue
+                response = state["client"].views_update(
+                    view_id=view_id, hash=state["hash"], view=view
+                )
+                self.updated += 1
+                with self._lock:
+                    if view_id in self.views:
+                        state["hash"] = response["view"]["hash"]
+                        state["content_hash"] = content_hash
+            except Exception as e:
+                # A view that is gone (or changed by someone else) is forgotten
+                logging.warning("[LIVE] Update of " + view_id + " failed: " + str(e))
+                self.closed(view_id)
+
+
+class ChannelScoreboard:
+    """
+    This class is used to keep a scoreboard message in the channel of the game.
+    The message is posted and pinned once (or found among the pins after a restart), then edited in
+    place with chat_update at most once per interval, and only if its text changed.
+
+    Attributes:
+        - client: The slack client.
+        - channel: The channel of the scoreboard.
+        - render: Returns the text of the scoreboard (starting with HEADER).
+        - interval: The minimal number of seconds between two edits.
+        - ts: The timestamp of the scoreboard message (None until it is posted).
+        - updated: The number of chat_update calls.
+        - skipped: The number of edits skipped, as the text did not change.
+    """
+
+    HEADER = ":trophy: Tablica wyników"
+
+    def __init__(
+        self,
+        client: WebClient,
+        channel: str,
+        render: Callable[[], str],
+        create_lock: Callable[[], ContextManager],
+        interval: float = 10.0,
+    ):
+        """
+        The constructor.
+
+        Parameters:
+            - client: The slack client.
+            - channel: The channel of the scoreboard.
+            - render: Returns the text of the scoreboard (starting with HEADER).
+            - create_lock: Returns the context in which the scoreboard is looked up and posted,
+              so worker processes do not post it twice (a lease of the storage, not the game transaction,
+              as the Slack calls are made inside it).
+            - interval: The minimal number of seconds between two edits.
+        """
+        self.client = client
+        self.channel = channel
+        self.render = render
+        self.create_lock = create_lock
+        self.interval = interval
+        self.ts = None
+        self.updated = 0
+        self.skipped = 0
+        self._text = None
+        self._last_update = 0.0
+        self._pending = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Finds or posts the scoreboard in the background.
+        """
+        threading.Thread(target=self._start, name="scoreboard", daemon=True).start()
+
+    def ensure(self):
+        """
+        Finds the pinned scoreboard of the bot, or posts and pins a new one.
+        """
+        with self.create_lock():
+            bot_user_id = self.client.auth_test()["user_id"]
+            message = slack_utils.find_pinned_message(
+                self.channel, bot_user_id, self.HEADER, self.client
+            )
+            if message is not None:
+                self.ts = message["ts"]
+                self._text = message.get("text")
+                return
+            self._text = self.render()
+            response = slack_utils.send_message(self._text, [self.channel], self.client)[0]
+            self.ts = response["ts"]
+            slack_utils.pin_message(self.channel, self.ts, self.client)
+        logging.info("[SCOREBOARD] Scoreboard posted in " + self.channel)
+
+    def request_refresh(self, user_ids: List[str]):
+        """
+        Requests an edit of the scoreboard after a change of the game, at most once per interval.
+
+        Parameters:
+            - user_ids: The IDs of the players whose state changed.
+        """
+        with self._lock:
+            if self.ts is None or self._pending is not None:
+                return
+            delay = max(0.0, self._last_update + self.interval - time.monotonic())
+            self._pending = threading.Timer(delay, self._refresh)
+            self._pending.daemon = True
+            self._pending.start()
+
+    def _start(self):
+        try:
+            self.ensure()
+            self._refresh()
+        except Exception as e:
+            logging.exception("[SCOREBOARD] Scoreboard not posted: " + str(e))
+
+    def _refresh(self):
+        with self._lock:
+            self._pending = None
+            self._last_update = time.monotonic()
+        try:
+            text = self.render()
+            if text == self._text:
+                self.skipped += 1
+                return
+            slack_utils.update_message(self.channel, self.ts, text, self.client)
+            self._text = text
+            self.updated += 1
+        except Exception as e:
+            logging.warning("[SCOREBOARD] Edit failed: " + str(e))
+            if "message_not_found" in str(e) or "cant_update_message" in str(e):
+                # Deleted by someone, posted again
+                self.ts = None
+                self._start()
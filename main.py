@@ -10,23 +10,35 @@
 from dotenv import load_dotenv
 import os
 from pathlib import Path
+from functools import lru_cache, partial, wraps
 from slack_bolt import App
 from slack_bolt.adapter.socket_mode import SocketModeHandler
+from slack_sdk.oauth.installation_store import FileInstallationStore, Installation
+from slack_sdk.web.client import WebClient
 import slack_utils
 import game_utils
+import routing_utils
+import search_utils
+import import_utils
+import home_utils
+import analytics_utils
+import channel_utils
+import export_utils
+import limit_utils
+import live_utils
+import profile_utils
+import queue_utils
+import registry_utils
+import worker_utils
+import argparse
 import datetime
+import heapq
+import json
 import logging
-
-# Load .env file
-env_path = Path(".") / ".env"
-# env_path = Path('.') / '.env_hack'
-load_dotenv(dotenv_path=env_path)
-
-# Initialize app
-app = App(token=os.environ.get("BOT_TOKEN"))
-
-# Socket mode handler
-handler = SocketModeHandler(app, os.environ.get("APP_TOKEN"))
+import multiprocessing
+import signal
+import threading
+import time
 
 # Constants
 ASGARD_CHANNEL = "C04P6595G5S"
@@ -36,30 +48,57 @@ ADMIN_USER_IDS = ["U03AECYM5MZ"]
 # ADMIN_USER_IDS = ["U042CQW7GCE"]
 # Logging
 LOG_FILE = "logs/logs.log"
-logging.basicConfig(
-    level=logging.DEBUG,
-    handlers=[logging.FileHandler(LOG_FILE, "a", "utf-8")],
-    format="%(asctime)s %(message)s",
-    datefmt="%d/%m/%Y %H:%M:%S",
-)
 
 # Game
 GAME_FILE = "saved/game_save"
-game = game_utils.Game.load_from_pickle(GAME_FILE)
-game.set_client(app.client)
+DEFAULT_GAME_CONFIG = registry_utils.GameConfig(
+    name="asgard",
+    asgard_channel=ASGARD_CHANNEL,
+    admin_user_ids=ADMIN_USER_IDS,
+    game_file=GAME_FILE,
+)
+
+# Hosted games (see registry_utils), without this file only the default game is hosted
+GAMES_FILE = "games.json"
+INSTALLATIONS_DIR = "saved/installations"
+
+# How often the connection is checked (and restored) in the main loop
+RECONNECT_CHECK_SECONDS = 5
 
-# App home
-with open("modals/app_home.txt", "r", encoding="utf-8") as f:
-    APP_HOME_VIEW = f.read()
+# Slack allows at most 10 socket connections of one app
+MAX_WORKERS = 10
+
+# Threads that handle the queued work of the listeners
+INGRESS_WORKERS = 8
+# Number of queued items above which chatter (random quotes) is shed
+INGRESS_HIGH_WATER = 500
+
+# Number of players on the scoreboard pinned in the channel of the game (0 - no scoreboard)
+SCOREBOARD_SIZE = 10
+# The minimal number of seconds between two edits of the scoreboard
+SCOREBOARD_INTERVAL = 10
+
+# The maximal number of seconds between two checks for new tasks and players in the selects of the modals
+SEARCH_MAX_AGE = 30
+
+# Profiles (odin profile, SIGUSR1) are written here
+PROFILE_DIR = "logs/profiles"
+# The longest profile an admin can ask for, in seconds
+PROFILE_MAX_SECONDS = 300
+# How long the profile started by SIGUSR1 takes, in seconds
+PROFILE_SIGNAL_SECONDS = 30
+# Time between the samples of the always-on sampling in seconds (0 - off, see --profile-sample)
+PROFILE_SAMPLE_INTERVAL = 0
+
+# Set by create_app and start
+app = None
+registry = None
+ingress = None
 
 # Modals
 ADD_TASK_ID = "add_task_modal"
-with open("modals/add_task.txt", "r", encoding="utf-8") as f:
-    ADD_TASK_VIEW = f.read()
 
 SEND_MESSAGE_ID = "send_message_modal"
-with open("modals/send_message.txt", "r", encoding="utf-8") as f:
-    SEND_MESSAGE_VIEW = f.read()
 
 SHOW_TASKS_ID = "show_tasks_modal"
 
@@ -67,9 +106,118 @@ SHOW_PLAYERS_ID = "show_players_modal"
 
 LEADERBOARD_ID = "leaderboard_modal"
 
+STATISTICS_ID = "statistics_modal"
+
 ACCEPT_TASK_ID = "accept_task_modal"
-with open("modals/accept_task.txt", "r", encoding="utf-8") as f:
-    ACCEPT_TASK_VIEW = f.read()
+
+
+@lru_cache(maxsize=None)
+def load_modal(name):
+    """
+    Reads a modal template from the modals directory (once, on first use)
+    """
+    with open("modals/" + name + ".txt", "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def get_registry():
+    """
+    Returns the registry of the hosted games (read from the games file on first use)
+    """
+    global registry
+    if registry is None:
+        registry = registry_utils.GameRegistry.from_file(GAMES_FILE, DEFAULT_GAME_CONFIG)
+    return registry
+
+
+def get_hosted(team_id=None, channel=None, user_id=None, name=None):
+    """
+    Returns the hosted game an event belongs to (by the game name from the view, or by team, channel and user)
+    """
+    hosted = get_registry().by_name(name)
+    if hosted is None:
+        hosted = get_registry().find(team_id, channel, user_id)
+    return hosted
+
+
+def client_for(config):
+    """
+    Returns the client of the workspace of the game
+    """
+    if get_registry().is_multi_workspace():
+        return WebClient(token=os.environ.get(config.bot_token_env))
+    return app.client
+
+
+def on_game_loaded(hosted, game):
+    """
+    Connects a loaded game with its home publisher
+    """
+    hosted.home_publisher.client = hosted.client
+    hosted.live_modals.client = hosted.client
+    hosted.channels = channel_utils.ChannelResolver(hosted.client)
+    hosted.channels.start()
+    hosted.search = search_utils.GameSearch(
+        partial(hosted.storage.snapshot, game),
+        partial(hosted.storage.counts, game),
+        hosted.client,
+        SEARCH_MAX_AGE,
+    )
+    # Only new players change the search (answers do not)
+    game.add_join_listener(hosted.search.request_refresh)
+    hosted.search.start()
+    game.add_change_listener(hosted.home_publisher.request_refresh)
+    game.add_change_listener(hosted.live_modals.request_refresh)
+    if SCOREBOARD_SIZE > 0:
+        hosted.scoreboard = live_utils.ChannelScoreboard(
+            hosted.client,
+            hosted.config.asgard_channel,
+            partial(render_scoreboard, hosted),
+            partial(hosted.storage.lease, "scoreboard"),
+            SCOREBOARD_INTERVAL,
+        )
+        game.add_change_listener(hosted.scoreboard.request_refresh)
+        hosted.scoreboard.start()
+
+
+def install_workspaces(installation_store):
+    """
+    Saves the installations of the configured workspaces, so Bolt gives every team its own client
+    """
+    for hosted in get_registry().hosted_games:
+        if hosted.config.team_id is None:
+            continue
+        token = os.environ.get(hosted.config.bot_token_env)
+        auth = WebClient(token=token).auth_test()
+        installation_store.save(
+            Installation(
+                team_id=hosted.config.team_id,
+                user_id=auth["user_id"],
+                bot_token=token,
+                bot_id=auth["bot_id"],
+                bot_user_id=auth["user_id"],
+            )
+        )
+
+
+def render_home(hosted, user_id):
+    """
+    Renders the home tab of the user (admin panel or the player's results)
+    """
+    if hosted.is_admin(user_id):
+        return load_modal("app_home")
+    hosted.storage.refresh(hosted.game)
+    return json.dumps(home_utils.generate_player_home_view(hosted.game, user_id))
+
+
+def with_game_name(view, hosted):
+    """
+    Adds the name of the game to the view, so its submission goes to the same game
+    """
+    view = json.loads(view)
+    view["private_metadata"] = hosted.config.name
+    return json.dumps(view)
+
 
 # IDs in modals
 BLOCK_CHANNEL_ID = "channel_to_send"
@@ -96,6 +244,9 @@ SELECTED_CASE_SENSITIVE_ID = "select_case_sensitive"
 BLOCK_NEEDED_TASK_ID = "needed_task"
 SELECTED_NEEDED_TASK_ID = "select_needed_task"
 
+BLOCK_NEAR_MISS_ID = "near_miss_distance"
+SELECTED_NEAR_MISS_ID = "select_near_miss_distance"
+
 BLOCK_TASK_ACCEPT_USER_ID = "task_accept_user_select"
 SELECTED_TASK_ACCEPT_USER_ID = "select_task_accept_user"
 
@@ -103,74 +254,640 @@ BLOCK_TASK_ACCEPT_ID = "task_accept_select"
 SELECTED_TASK_ACCEPT_ID = "select_task_accept"
 
 
-def open_modal(modal_id, trigger_id, client):
+def open_modal(modal_id, trigger_id, client, hosted):
     """
     Opens a modal with a given id
     """
+    game = hosted.game
     if modal_id == ADD_TASK_ID:
-        client.views_open(trigger_id=trigger_id, view=ADD_TASK_VIEW)
+        client.views_open(
+            trigger_id=trigger_id, view=with_game_name(load_modal("add_task"), hosted)
+        )
     elif modal_id == SEND_MESSAGE_ID:
-        client.views_open(trigger_id=trigger_id, view=SEND_MESSAGE_VIEW)
+        client.views_open(
+            trigger_id=trigger_id,
+            view=with_game_name(load_modal("send_message"), hosted),
+        )
     elif modal_id == SHOW_TASKS_ID:
         view = game.generate_tasks_view()
         logging.info("[OPEN_MODAL] " + str(view))
         client.views_open(trigger_id=trigger_id, view=view)
-    elif modal_id == SHOW_PLAYERS_ID:
-        client.views_open(trigger_id=trigger_id, view=game.generate_players_view())
-    elif modal_id == LEADERBOARD_ID:
-        client.views_open(trigger_id=trigger_id, view=game.generate_leaderboard_view())
+    elif modal_id in (SHOW_PLAYERS_ID, LEADERBOARD_ID):
+        # Kept up to date until closed
+        hosted.live_modals.open(modal_id, trigger_id, client)
+    elif modal_id == STATISTICS_ID:
+        statistics = hosted.storage.snapshot(game).statistics
+        client.views_open(
+            trigger_id=trigger_id, view=json.dumps(statistics.generate_view())
+        )
     elif modal_id == ACCEPT_TASK_ID:
-        accept_view = ACCEPT_TASK_VIEW.replace("{{tasks}}", game.generate_tasks_list())
-        client.views_open(trigger_id=trigger_id, view=accept_view)
+        # The tasks and players are searched by the selects (options requests)
+        client.views_open(
+            trigger_id=trigger_id, view=with_game_name(load_modal("accept_task"), hosted)
+        )
+
+
+def render_live_modal(hosted, modal_id):
+    """
+    Renders a live modal (leaderboard or players) of the game
+    """
+    game = hosted.game
+    hosted.storage.refresh(game)
+    if modal_id == SHOW_PLAYERS_ID:
+        return with_game_name(game.generate_players_view(), hosted)
+    return with_game_name(game.generate_leaderboard_view(), hosted)
+
+
+def render_scoreboard(hosted):
+    """
+    Renders the text of the scoreboard pinned in the channel of the game
+    """
+    game = hosted.game
+    hosted.storage.refresh(game)
+    with game.lock:
+        top = heapq.nlargest(
+            SCOREBOARD_SIZE, game.players.values(), key=lambda player: player.points
+        )
+    lines = [
+        str(rank) + ". <@" + player.user_id + "> - " + str(player.points) + " pkt."
+        for rank, player in enumerate(top, 1)
+        if player.points > 0
+    ]
+    if len(lines) == 0:
+        lines = ["Brak wyników"]
+    return live_utils.ChannelScoreboard.HEADER + "\n" + "\n".join(lines)
 
 
 # Events
 
 
-@app.action("app_home_buttons")
 def app_home_buttons(client, ack, body, action):
     trigger_id = body["trigger_id"]
     ack()
-    open_modal(action["value"], trigger_id, client)
+    hosted = get_hosted(body["team"]["id"], user_id=body["user"]["id"])
+    open_modal(action["value"], trigger_id, client, hosted)
+
+
+def task_options(ack, body, payload):
+    """
+    Returns the tasks matching the text typed in a task select of a modal
+    """
+    hosted = get_hosted(
+        body["team"]["id"],
+        user_id=body["user"]["id"],
+        name=body["view"].get("private_metadata"),
+    )
+    if hosted is None or hosted.search is None:
+        ack(options=[])
+        return
+    ack(options=hosted.search.task_options(payload.get("value", "")))
+
+
+def player_options(ack, body, payload):
+    """
+    Returns the players matching the text typed in a player select of a modal
+    """
+    hosted = get_hosted(
+        body["team"]["id"],
+        user_id=body["user"]["id"],
+        name=body["view"].get("private_metadata"),
+    )
+    if hosted is None or hosted.search is None:
+        ack(options=[])
+        return
+    ack(options=hosted.search.player_options(payload.get("value", "")))
+
 
+def channel_changed(event, context):
+    """
+    Updates the channels of the games of the workspace after a channel was created or renamed
+    """
+    for hosted in get_registry().hosted_games:
+        if hosted.channels is not None and hosted.config.team_id in (None, context.get("team_id")):
+            hosted.channels.update(event["channel"])
 
-@app.event("app_home_opened")
-def app_home_opened(client, event):
-    if event["user"] in ADMIN_USER_IDS:
-        client.views_publish(user_id=event["user"], view=APP_HOME_VIEW)
+
+def live_modal_closed(ack, body):
+    """
+    Forgets a closed live modal, so it is not updated anymore
+    """
+    ack()
+    hosted = get_hosted(
+        body["team"]["id"],
+        user_id=body["user"]["id"],
+        name=body["view"].get("private_metadata"),
+    )
+    if hosted is not None:
+        hosted.live_modals.closed(body["view"]["id"])
+
+
+def app_home_opened(client, event, context):
+    hosted = get_hosted(context.get("team_id"), user_id=event["user"])
+    if hosted is None:
+        return
+    # Waits for the game to be loaded, its storage is read while rendering the home
+    hosted.game
+    # Skipped when the home did not change since the last publish
+    hosted.home_publisher.publish(event["user"], client)
+
+
+def handle_admin_command(message, user, channel, thread_ts, client, hosted, files=None):
+    """
+    Handles an admin (odin) command sent in a direct message to the bot.
+    """
+    game = hosted.game
+    words = message.split(" ")
+    # Handle too few words
+    if len(words) == 1:
+        slack_utils.send_message(
+            "To check available commands type `odin help`",
+            [channel],
+            client,
+            thread_ts=[thread_ts],
+        )
+        return
+
+    # Available admin commands
+    ADMIN_COMMANDS = [
+        "help",
+        "write_on_channel",
+        "write_to_everyone",
+        "show_players",
+        "show_tasks",
+        "add_task",
+        "import",
+        "export",
+        "statistics",
+        "history",
+        "limits",
+        "queue",
+        "outbox",
+        "deliveries",
+        "reconcile",
+        "close_task",
+        "profile",
+        "analytics",
+    ]
+    # Non-existent command
+    if words[1] not in ADMIN_COMMANDS:
+        slack_utils.send_ephemeral_message(
+            "There is no command '"
+            + words[1]
+            + "', to check available commands type `odin help",
+            channel,
+            user,
+            client,
+            thread_ts=thread_ts,
+        )
     else:
-        client.views_publish(
-            user_id=event["user"],
-            view="""{
-                "type": "home",
-                "blocks": [
-                    {
-                        "type": "actions",
-                        "elements": [
-                            {
-                                "type": "button",
-                                "text": {
-                                    "type": "plain_text",
-                                    "text": "Pokaż wyniki wojowników",
-                                    "emoji": true
-                                },
-                                "value": "leaderboard_modal",
-                                "action_id": "app_home_buttons"
-                            }
-                        ]
-                    }
+        if words[1] == "help":
+            # Show available commands
+            slack_utils.send_message(
+                "Available commands are: " + str(ADMIN_COMMANDS),
+                [channel],
+                client,
+                [thread_ts],
+            )
+        elif words[1] == "write_on_channel":
+            if len(words) < 6:
+                slack_utils.send_ephemeral_message(
+                    "Usage: odin "
+                    + words[1]
+                    + " [date YYYY/MM/DD] [time HH:MM] [#channel] MESSAGE: [text]\n"
+                    + "Example: odin "
+                    + words[1]
+                    + " 2023/02/28 21:37 asgard MESSAGE: papieżowa",
+                    channel,
+                    user,
+                    client,
+                    thread_ts=thread_ts,
+                )
+                return
+            try:
+                d = datetime.datetime.strptime(words[2], "%Y/%m/%d")
+                t = datetime.datetime.strptime(words[3], "%H:%M")
+            except ValueError:
+                slack_utils.send_ephemeral_message(
+                    "Wrong date or time format\n"
+                    + "Usage: odin "
+                    + words[1]
+                    + " [date YYYY/MM/DD] [time HH:MM] [#channel] MESSAGE: [text]\n"
+                    + "Example: odin "
+                    + words[1]
+                    + " 2023/02/28 21:37 asgard MESSAGE: papieżowa",
+                    channel,
+                    user,
+                    client,
+                    thread_ts=thread_ts,
+                )
+                return
+            try:
+                target_channel = hosted.channels.resolve(words[4])
+            except ValueError as e:
+                slack_utils.send_ephemeral_message(
+                    str(e), channel, user, client, thread_ts=thread_ts
+                )
+                return
+            message = " ".join(words[6:])
+            slack_utils.send_scheduled_message(
+                message,
+                target_channel,
+                datetime.datetime.combine(d.date(), t.time()),
+                client,
+            )
+
+        elif words[1] == "write_to_everyone":
+            if len(words) < 6:
+                slack_utils.send_ephemeral_message(
+                    "Usage: odin "
+                    + words[1]
+                    + " [date YYYY/MM/DD] [time HH:MM] [#channel_to_get_people_from] MESSAGE: [text]\n"
+                    + "Example: odin "
+                    + words[1]
+                    + " 2023/02/28 21:37 asgard MESSAGE: papieżowa",
+                    channel,
+                    user,
+                    client,
+                    thread_ts=thread_ts,
+                )
+                return
+            try:
+                d = datetime.datetime.strptime(words[2], "%Y/%m/%d")
+                t = datetime.datetime.strptime(words[3], "%H:%M")
+            except ValueError:
+                slack_utils.send_ephemeral_message(
+                    "Wrong date or time format\n"
+                    + "Usage: odin "
+                    + words[1]
+                    + " [date YYYY/MM/DD] [time HH:MM] [#channel] MESSAGE: [text]\n"
+                    + "Example: odin "
+                    + words[1]
+                    + " 2023/02/28 21:37 asgard MESSAGE: papieżowa",
+                    channel,
+                    user,
+                    client,
+                    thread_ts=thread_ts,
+                )
+                return
+            try:
+                target_channel = hosted.channels.resolve(words[4])
+            except ValueError as e:
+                slack_utils.send_ephemeral_message(
+                    str(e), channel, user, client, thread_ts=thread_ts
+                )
+                return
+            message = " ".join(words[6:])
+            for user in slack_utils.get_channel_users(target_channel, client):
+                slack_utils.send_scheduled_message(
+                    message,
+                    user,
+                    datetime.datetime.combine(d.date(), t.time()),
+                    client,
+                )
+        elif words[1] in ("show_players", "show_tasks"):
+            export_format = words[2].lower() if len(words) > 2 else "csv"
+            if export_format not in export_utils.EXPORT_FORMATS:
+                slack_utils.send_ephemeral_message(
+                    "Usage: odin "
+                    + words[1]
+                    + " ["
+                    + "|".join(export_utils.EXPORT_FORMATS)
+                    + "]",
+                    channel,
+                    user,
+                    client,
+                    thread_ts=thread_ts,
+                )
+                return
+            # The rows are streamed to a compressed file and uploaded at once
+            snapshot = hosted.storage.snapshot(game)
+            if words[1] == "show_players":
+                name = "players"
+                path = export_utils.write_export(
+                    export_utils.player_rows(snapshot), export_utils.PLAYER_FIELDS, export_format
+                )
+            else:
+                name = "tasks"
+                path = export_utils.write_export(
+                    export_utils.task_rows(snapshot), export_utils.TASK_FIELDS, export_format
+                )
+            try:
+                slack_utils.upload_local_file(
+                    path, name + "." + export_format + ".gz", channel, client, thread_ts=thread_ts
+                )
+            finally:
+                os.remove(path)
+        elif words[1] == "add_task":
+            pass
+        elif words[1] == "import":
+            if files is None or len(files) == 0:
+                slack_utils.send_ephemeral_message(
+                    "Usage: attach a task plan (.json, .csv or .yaml) to the message `odin import`",
+                    channel,
+                    user,
+                    client,
+                    thread_ts=thread_ts,
+                )
+                return
+            try:
+                plan_format = import_utils.detect_format(files[0]["name"])
+                text = slack_utils.download_file(files[0], client).decode("utf-8")
+                # Read before the transaction, not to hold the database while paging through the members
+                player_ids = slack_utils.get_channel_users(hosted.config.asgard_channel, client)
+                with hosted.storage.transaction(game, task_nos=None):
+                    tasks = import_utils.import_task_plan(
+                        game, text, plan_format, hosted.config.asgard_channel, player_ids
+                    )
+                    hosted.storage.record_changes(
+                        game, task_nos=[task.task_no for task in tasks]
+                    )
+                # The game has no listeners of new tasks
+                hosted.search.request_refresh([])
+            except ValueError as e:
+                slack_utils.send_message(
+                    "Task plan was not imported:\n" + str(e),
+                    [channel],
+                    client,
+                    [thread_ts],
+                )
+                return
+            slack_utils.send_message(
+                "Imported " + str(len(tasks)) + " tasks.", [channel], client, [thread_ts]
+            )
+        elif words[1] == "statistics":
+            slack_utils.upload_file(
+                json.dumps(
+                    hosted.storage.snapshot(game).statistics.to_dict(),
+                    ensure_ascii=False,
+                    indent=4,
+                ),
+                "statistics.json",
+                channel,
+                client,
+                thread_ts=thread_ts,
+            )
+        elif words[1] == "analytics":
+            export_format = words[2].lower() if len(words) > 2 else "csv"
+            try:
+                if export_format not in analytics_utils.EXPORT_FORMATS:
+                    raise ValueError(
+                        "Usage: odin analytics [" + "|".join(analytics_utils.EXPORT_FORMATS) + "]"
+                    )
+                matrix = analytics_utils.ScoreMatrix(hosted.storage.snapshot(game))
+                content = matrix.export(export_format)
+            except ValueError as e:
+                slack_utils.send_ephemeral_message(
+                    str(e), channel, user, client, thread_ts=thread_ts
+                )
+                return
+            slack_utils.upload_file(
+                json.dumps(matrix.report(), ensure_ascii=False, indent=4),
+                "analytics.json",
+                channel,
+                client,
+                thread_ts=thread_ts,
+            )
+            slack_utils.upload_file(
+                content, "scores." + export_format, channel, client, thread_ts=thread_ts
+            )
+        elif words[1] == "history":
+            usage = (
+                "Usage: odin history [@user] or odin history [date YYYY/MM/DD] [time HH:MM]"
+            )
+            history = hosted.storage.snapshot(game).history
+            if len(words) == 3 and words[2].startswith("<@"):
+                user_id = words[2][2:].split("|")[0].rstrip(">")
+                lines = [
+                    datetime.datetime.fromtimestamp(timestamp).strftime("%Y/%m/%d %H:%M")
+                    + " - #"
+                    + str(rank)
+                    + ", "
+                    + str(points)
+                    + " pkt."
+                    for timestamp, rank, points in history.rank_trajectory(user_id)
                 ]
-            }""",
+                text = "\n".join(lines[-50:]) if len(lines) > 0 else "Brak historii"
+            elif len(words) == 4:
+                try:
+                    when = datetime.datetime.strptime(
+                        words[2] + " " + words[3], "%Y/%m/%d %H:%M"
+                    )
+                except ValueError:
+                    slack_utils.send_ephemeral_message(
+                        usage, channel, user, client, thread_ts=thread_ts
+                    )
+                    return
+                ranking = history.ranking_at(when.timestamp())
+                text = "\n".join(
+                    str(place) + ". <@" + user_id + "> - " + str(points) + " pkt."
+                    for place, (user_id, points) in enumerate(ranking[:30], start=1)
+                )
+                if text == "":
+                    text = "Brak wyników"
+            else:
+                slack_utils.send_ephemeral_message(
+                    usage, channel, user, client, thread_ts=thread_ts
+                )
+                return
+            slack_utils.send_message(text, [channel], client, [thread_ts])
+        elif words[1] == "limits":
+            if len(words) == 4:
+                try:
+                    hosted.attempt_limiter.configure(int(words[2]), float(words[3]))
+                except ValueError:
+                    slack_utils.send_ephemeral_message(
+                        "Usage: odin limits [max_attempts window_seconds]",
+                        channel,
+                        user,
+                        client,
+                        thread_ts=thread_ts,
+                    )
+                    return
+            limits = hosted.attempt_limiter.to_dict()
+            limits["coalesced_replies"] = hosted.wrong_replies.coalesced
+            slack_utils.send_message(
+                "```" + json.dumps(limits, indent=4) + "```", [channel], client, [thread_ts]
+            )
+        elif words[1] == "queue":
+            slack_utils.send_message(
+                "```" + json.dumps(ingress.to_dict(), indent=4) + "```",
+                [channel],
+                client,
+                [thread_ts],
+            )
+        elif words[1] == "profile":
+            try:
+                seconds = int(words[2]) if len(words) > 2 else PROFILE_SIGNAL_SECONDS
+                if seconds < 1 or seconds > PROFILE_MAX_SECONDS:
+                    raise ValueError()
+            except ValueError:
+                slack_utils.send_ephemeral_message(
+                    "Usage: odin profile [seconds, at most " + str(PROFILE_MAX_SECONDS) + "]",
+                    channel,
+                    user,
+                    client,
+                    thread_ts=thread_ts,
+                )
+                return
+
+            # The profile runs in its own thread, not to hold a worker of the queue
+            def profile():
+                try:
+                    result = profile_utils.run_profile(seconds, PROFILE_DIR, game=game)
+                    text = "```" + json.dumps(result, indent=4) + "```"
+                except RuntimeError as e:
+                    text = str(e)
+                slack_utils.send_message(text, [channel], client, [thread_ts])
+
+            threading.Thread(target=profile, name="profile", daemon=True).start()
+            slack_utils.send_message(
+                "Profiling for " + str(seconds) + " s...", [channel], client, [thread_ts]
+            )
+        elif words[1] == "outbox":
+            slack_utils.send_message(
+                "```" + json.dumps(hosted.outbox_sender.to_dict(), indent=4) + "```",
+                [channel],
+                client,
+                [thread_ts],
+            )
+        elif words[1] == "deliveries":
+            # The recipients of every task in the ledger and how many of the messages were sent
+            with hosted.game.lock:
+                deliveries = hosted.game.deliveries.to_dict()
+            slack_utils.send_message(
+                "```" + json.dumps(deliveries, indent=4) + "```",
+                [channel],
+                client,
+                [thread_ts],
+            )
+        elif words[1] == "reconcile":
+            # Adds the members of the channel that are not players now, without waiting for the timer
+            def reconcile():
+                try:
+                    counts = hosted.reconciler.reconcile()
+                    text = "```" + json.dumps(counts, indent=4) + "```"
+                except Exception as e:
+                    logging.exception("[RECONCILE] Reconciliation failed: " + str(e))
+                    text = "Reconciliation failed: " + str(e)
+                slack_utils.send_message(text, [channel], client, [thread_ts])
+
+            threading.Thread(target=reconcile, name="reconcile", daemon=True).start()
+        elif words[1] == "close_task":
+            try:
+                task_no = int(words[2])
+                if task_no not in game.tasks:
+                    raise ValueError()
+            except (IndexError, ValueError):
+                slack_utils.send_ephemeral_message(
+                    "Usage: odin close_task [task number]",
+                    channel,
+                    user,
+                    client,
+                    thread_ts=thread_ts,
+                )
+                return
+            with hosted.storage.transaction(game, (), [task_no]):
+                closed = game.close_task(task_no)
+                if closed:
+                    hosted.storage.record_changes(game, (), [task_no])
+            deleted = []
+            if closed:
+                # Scheduled messages would still be posted by Slack at the time of the task
+                deleted = game.tasks[task_no].delete_scheduled_messages(client)
+                if len(deleted) > 0:
+                    with hosted.storage.transaction(game, (), [task_no]):
+                        task = game.tasks[task_no]
+                        task.sent_messages = [
+                            ref for ref in task.sent_messages if ref not in deleted
+                        ]
+                        hosted.storage.record_changes(game, (), [task_no])
+                # Its messages waiting in the outbox are dropped by the sender
+                hosted.outbox_sender.wake()
+            # Closed tasks without messages in the outbox (this one, or ones closed before)
+            archived = hosted.storage.archive_tasks(game)
+            if closed:
+                text = (
+                    "Task "
+                    + str(task_no)
+                    + " closed, "
+                    + str(len(deleted))
+                    + " scheduled messages deleted."
+                )
+            else:
+                text = "Task " + str(task_no) + " was already closed."
+            if task_no in archived or game.tasks[task_no].state == game_utils.TaskState.ARCHIVED:
+                text += " It is archived."
+            else:
+                text += " It will be archived when its messages in the outbox are dropped."
+            if len(archived) > 0:
+                text += " Archived tasks: " + ", ".join(str(archived_no) for archived_no in archived) + "."
+            slack_utils.send_message(text, [channel], client, [thread_ts])
+        elif words[1] == "export":
+            plan_format = words[2].lower() if len(words) > 2 else "json"
+            if plan_format not in import_utils.PLAN_FORMATS:
+                slack_utils.send_ephemeral_message(
+                    "Usage: odin export [" + "|".join(import_utils.PLAN_FORMATS) + "]",
+                    channel,
+                    user,
+                    client,
+                    thread_ts=thread_ts,
+                )
+                return
+            slack_utils.upload_file(
+                import_utils.export_task_plan(game, plan_format),
+                "tasks." + plan_format,
+                channel,
+                client,
+                thread_ts=thread_ts,
+            )
+
+
+def message_im(payload, client, context):
+    """
+    Handles a message event. Events are classified first, so only the ones that can change the game do API calls and saves.
+    The rest is queued by priority: admin commands, answers (in threads), other messages (random quotes, shed first).
+    """
+    hosted = get_hosted(context.get("team_id"), user_id=payload.get("user"))
+    if hosted is None:
+        return
+    route = routing_utils.classify_message_event(
+        payload, hosted.config.admin_user_ids, context.get("bot_user_id")
+    )
+    if route in (
+        routing_utils.EventRoute.IGNORE,
+        routing_utils.EventRoute.CHANNEL_CHATTER,
+        routing_utils.EventRoute.CHANNEL_THREAD,
+    ):
+        # Answers are only accepted in DMs, channel messages cannot change the game
+        return
+
+    if route == routing_utils.EventRoute.ADMIN_COMMAND:
+        priority = queue_utils.Priority.ADMIN
+    elif "thread_ts" in payload:
+        priority = queue_utils.Priority.ANSWER
+    else:
+        priority = queue_utils.Priority.CHATTER
+    queued = ingress.submit(
+        priority,
+        "message_im:" + route.name,
+        partial(handle_message_event, payload, client, hosted, route),
+        key=payload.get("user"),
+    )
+    if not queued and priority != queue_utils.Priority.CHATTER:
+        slack_utils.send_ephemeral_message(
+            "Odyn ma teraz zbyt wiele na głowie, spróbuj ponownie za chwilę.",
+            payload["channel"],
+            payload["user"],
+            client,
+            thread_ts=payload.get("thread_ts", payload["ts"]),
         )
 
 
-@app.event("message")
-def message_im(payload, client):
+def handle_message_event(payload, client, hosted, route):
     """
-    Handles a direct message to the bot.
+    Handles a classified message event (an admin command, an answer or another direct message).
     """
-    print(payload)
-    logging.debug("[MSG] Received message")
+    logging.debug("[MSG] Received message, route: " + route.name)
     # Get the message
     message = payload["text"]
 
@@ -180,22 +897,8 @@ def message_im(payload, client):
     # Get the channel
     channel = payload["channel"]
 
-    thread_ts = payload["ts"]
-
-    is_thread = False
-    if "thread_ts" in payload:
-        thread_ts = payload["thread_ts"]
-        is_thread = True
-
-    task_no = None
-    if is_thread:
-        result = client.conversations_history(channel=channel)
-        conversation_history = result["messages"]
-        for text in conversation_history:
-            if text["ts"] == thread_ts and "metadata" in text:
-                task_no = int(text["metadata"]["event_type"])
-                print(task_no)
-                break
+    thread_ts = payload.get("thread_ts", payload["ts"])
+    is_thread = "thread_ts" in payload
 
     logging.debug(
         "[MSG] Message: {}, user: {}, channel: {}, thread_ts: {}, is_thread: {}".format(
@@ -203,158 +906,61 @@ def message_im(payload, client):
         )
     )
 
-    # Check if the message is a DM
-    if channel[0] == "D":
-        logging.debug("[MSG] Message is a DM")
-        try:
-            if (
-                " " in message
-                and user in ADMIN_USER_IDS
-                and message.split(" ")[0].lower() == "odin"
-            ):
-                # Handle too few words
-                words = message.split(" ")
-                if len(words) == 1:
-                    slack_utils.send_message(
-                        "To check available commands type `odin help`",
-                        [channel],
-                        client,
-                        thread_ts=[thread_ts],
-                    )
-                    return
-
-                # Available admin commands
-                ADMIN_COMMANDS = [
-                    "help",
-                    "write_on_channel",
-                    "write_to_everyone",
-                    "show_players",
-                    "add_task",
-                ]
-                # Non-existent command
-                if words[1] not in ADMIN_COMMANDS:
-                    slack_utils.send_ephemeral_message(
-                        "There is no command '"
-                        + words[1]
-                        + "', to check available commands type `odin help",
-                        channel,
-                        user,
-                        client,
-                        thread_ts=thread_ts,
-                    )
-                else:
-                    if words[1] == "help":
-                        # Show available commands
-                        slack_utils.send_message(
-                            "Available commands are: " + str(ADMIN_COMMANDS),
-                            [channel],
-                            client,
-                            [thread_ts],
-                        )
-                    elif words[1] == "write_on_channel":
-                        if len(words) < 6:
-                            slack_utils.send_ephemeral_message(
-                                "Usage: odin "
-                                + words[1]
-                                + " [date YYYY/MM/DD] [time HH:MM] [#channel] MESSAGE: [text]\n"
-                                + "Example: odin "
-                                + words[1]
-                                + " 2023/02/28 21:37 asgard MESSAGE: papieżowa",
-                                channel,
-                                user,
-                                client,
-                                thread_ts=thread_ts,
-                            )
-                            return
-                        try:
-                            d = datetime.datetime.strptime(words[2], "%Y/%m/%d")
-                            t = datetime.datetime.strptime(words[3], "%H:%M")
-                        except ValueError:
-                            slack_utils.send_ephemeral_message(
-                                "Wrong date or time format\n"
-                                + "Usage: odin "
-                                + words[1]
-                                + " [date YYYY/MM/DD] [time HH:MM] [#channel] MESSAGE: [text]\n"
-                                + "Example: odin "
-                                + words[1]
-                                + " 2023/02/28 21:37 asgard MESSAGE: papieżowa",
-                                channel,
-                                user,
-                                client,
-                                thread_ts=thread_ts,
-                            )
-                            return
-                        channel = words[4]
-                        print(str(channel), type(channel))
-                        message = " ".join(words[6:])
-                        slack_utils.send_scheduled_message(
-                            message,
-                            channel,
-                            datetime.datetime.combine(d.date(), t.time()),
-                            client,
-                        )
-
-                    elif words[1] == "write_to_everyone":
-                        if len(words) < 6:
-                            slack_utils.send_ephemeral_message(
-                                "Usage: odin "
-                                + words[1]
-                                + " [date YYYY/MM/DD] [time HH:MM] [#channel_to_get_people_from] MESSAGE: [text]\n"
-                                + "Example: odin "
-                                + words[1]
-                                + " 2023/02/28 21:37 asgard MESSAGE: papieżowa",
-                                channel,
-                                user,
-                                client,
-                                thread_ts=thread_ts,
-                            )
-                            return
-                        try:
-                            d = datetime.datetime.strptime(words[2], "%Y/%m/%d")
-                            t = datetime.datetime.strptime(words[3], "%H:%M")
-                        except ValueError:
-                            slack_utils.send_ephemeral_message(
-                                "Wrong date or time format\n"
-                                + "Usage: odin "
-                                + words[1]
-                                + " [date YYYY/MM/DD] [time HH:MM] [#channel] MESSAGE: [text]\n"
-                                + "Example: odin "
-                                + words[1]
-                                + " 2023/02/28 21:37 asgard MESSAGE: papieżowa",
-                                channel,
-                                user,
-                                client,
-                                thread_ts=thread_ts,
-                            )
-                            return
-                        channel = words[4]
-                        message = " ".join(words[6:])
-                        for user in slack_utils.get_channel_users(channel, client):
-                            slack_utils.send_scheduled_message(
-                                message,
-                                user,
-                                datetime.datetime.combine(d.date(), t.time()),
-                                client,
-                            )
-                        pass
-                    elif words[1] == "show_players":
-                        # TODO show players and points
-                        pass
-                    elif words[1] == "add_task":
-                        pass
-            else:
-                print("Not admin")
-                game.handle_message(message, user, channel, task_no, thread_ts)
-        except Exception as e:
-            slack_utils.send_ephemeral_message(
-                "There was an error :(", channel, user, client, thread_ts=thread_ts
+    try:
+        if route == routing_utils.EventRoute.ADMIN_COMMAND:
+            handle_admin_command(
+                message, user, channel, thread_ts, client, hosted, payload.get("files")
             )
-            print(e)
-    game.save_to_pickle(GAME_FILE)
+            return
+
+        game = hosted.game
+        task_no = None
+        if is_thread:
+            task_no = slack_utils.get_thread_task_no(channel, thread_ts, client)
+
+        # Answers over the limit are not checked, the player is told once per window
+        if task_no is not None:
+            decision = hosted.attempt_limiter.check(user, task_no)
+            if decision == limit_utils.AttemptDecision.LIMITED:
+                slack_utils.send_ephemeral_message(
+                    "Zbyt wiele odpowiedzi, spróbuj ponownie za "
+                    + str(int(hosted.attempt_limiter.retry_after(user, task_no)) + 1)
+                    + " s.",
+                    channel,
+                    user,
+                    client,
+                    thread_ts=thread_ts,
+                )
+            if decision != limit_utils.AttemptDecision.ALLOWED:
+                return
+
+        # The answer is checked and saved atomically, the replies are sent after
+        answered = (
+            game_utils.MessageType.RIGHT_ANSWER,
+            game_utils.MessageType.WRONG_ANSWER,
+        )
+        task_nos = [task_no] if task_no is not None else []
+        with hosted.storage.transaction(game, [user], task_nos):
+            result, reply = game.check_message(message, user, task_no)
+            if result in answered:
+                hosted.storage.record_answer(
+                    game, user, task_no, result == game_utils.MessageType.RIGHT_ANSWER
+                )
+        if result == game_utils.MessageType.WRONG_ANSWER and hosted.wrong_replies.coalesce(
+            user, channel, thread_ts
+        ):
+            # The reply goes into the summary of the burst
+            game.notify_change([user])
+        else:
+            game.reply_to_message(result, reply, user, channel, task_no, thread_ts)
+    except Exception as e:
+        slack_utils.send_ephemeral_message(
+            "There was an error :(", channel, user, client, thread_ts=thread_ts
+        )
+        logging.exception("[MSG] Error while handling message: " + str(e))
 
 
-@app.event("member_joined_channel")
-def member_joined_channel(payload, say, client):
+def member_joined_channel(payload, say, client, context):
     """
     Handles a new user joining the channel, adding him to the game
     """
@@ -364,8 +970,10 @@ def member_joined_channel(payload, say, client):
     # Get the channel
     channel = payload["channel"]
 
-    # Check if the user joined the channel
-    if channel == ASGARD_CHANNEL:
+    # Check if the user joined the channel of a game
+    hosted = get_hosted(context.get("team_id"), channel=channel)
+    if hosted is not None and channel == hosted.config.asgard_channel:
+        game = hosted.game
         # Send the message
         message = "Przekroczyłeś Bifrost, witamy w Asgardzie <@" + user + ">!"
         client.chat_postEphemeral(
@@ -375,17 +983,13 @@ def member_joined_channel(payload, say, client):
             username="Hajmdal",
             icon_url="https://fwcdn.pl/cpo/05/85/585/332.4.jpg",
         )
-        game.add_player(user)
-        for task_no, task in game.tasks.items():
-            if task.date_and_time < datetime.datetime.now():
-                task.send_task(user, client)
-            else:
-                task.schedule_task(client, [user])
-
-        game.save_to_pickle(GAME_FILE)
+        with hosted.storage.transaction(game, [user], None):
+            game.welcome_players([user])
+            hosted.storage.record_changes(game, [user], game.live_tasks().keys())
+        hosted.home_publisher.request_refresh([user])
+        game.notify_join([user])
 
 
-@app.view(SEND_MESSAGE_ID)
 def send_message_submission(body, client, ack):
     """
     Handles the submission of the send message modal
@@ -428,11 +1032,16 @@ def send_message_submission(body, client, ack):
         logging.debug("[SEND_MSG] Message data: " + str(mess))
 
 
-@app.view(ADD_TASK_ID)
 def add_task_submission(body, client, ack):
     """
     Handles the submission of the add task modal
     """
+    hosted = get_hosted(
+        body["team"]["id"],
+        user_id=body["user"]["id"],
+        name=body["view"].get("private_metadata"),
+    )
+    game = hosted.game
     # Acknowledge the request
     ack()
     logging.debug("[ADD_TASK] Received submission: " + str(body))
@@ -487,20 +1096,20 @@ def add_task_submission(body, client, ack):
         correct_answers = [correct_answers]
     # Get needed task
 
-    if (
-        "value"
-        in body["view"]["state"]["values"][BLOCK_NEEDED_TASK_ID][
-            SELECTED_NEEDED_TASK_ID
-        ]
-    ):
-        needed_task = int(
-            body["view"]["state"]["values"][BLOCK_NEEDED_TASK_ID][
-                SELECTED_NEEDED_TASK_ID
-            ]["value"]
-        )
+    selected_needed_task = body["view"]["state"]["values"][BLOCK_NEEDED_TASK_ID][
+        SELECTED_NEEDED_TASK_ID
+    ].get("selected_option")
+    if selected_needed_task is not None:
+        needed_task = int(selected_needed_task["value"])
     else:
         needed_task = None
 
+    # Get the number of typos of a near miss
+    near_miss_distance = body["view"]["state"]["values"][BLOCK_NEAR_MISS_ID][
+        SELECTED_NEAR_MISS_ID
+    ].get("value")
+    near_miss_distance = int(near_miss_distance) if near_miss_distance else 0
+
     logging.debug(
         "[ADD_TASK] Extracted data: "
         + str(channels)
@@ -518,38 +1127,55 @@ def add_task_submission(body, client, ack):
         + str(correct_answers)
         + " "
         + str(needed_task)
+        + " "
+        + str(near_miss_distance)
     )
 
-    task = game_utils.Task(
-        task_no=len(game.tasks.keys()),
-        points=task_points,
-        correct_answers=correct_answers,
-        needed_task=needed_task,
-        is_dm=(task_type == "dm"),
-        channel=channels[0],
-        description=message,
-        do_letters_case_matter=case_sensitive,
-        date_and_time=datetime.datetime.fromtimestamp(date),
+    # Read before the transaction, not to hold the database while paging through the members
+    player_ids = (
+        slack_utils.get_channel_users(hosted.config.asgard_channel, client)
+        if needed_task is None
+        else None
     )
-
-    if needed_task is None:
-        task.schedule_task(
-            client, slack_utils.get_channel_users(ASGARD_CHANNEL, client)
+    # The number of the task is taken from all tasks (other workers may have added some),
+    # after the highest one as in the import (the imported numbers can have gaps)
+    with hosted.storage.transaction(game, task_nos=None):
+        task = game_utils.Task(
+            task_no=max(game.tasks.keys(), default=-1) + 1,
+            points=task_points,
+            correct_answers=correct_answers,
+            needed_task=needed_task,
+            is_dm=(task_type == "dm"),
+            channel=channels[0],
+            description=message,
+            do_letters_case_matter=case_sensitive,
+            date_and_time=datetime.datetime.fromtimestamp(date),
+            near_miss_distance=near_miss_distance,
         )
-    else:
-        for player_id, player in game.players.items():
-            if needed_task in player.completed_tasks:
-                task.send_task(player_id, client)
 
-    game.add_task(task)
-    game.save_to_pickle(GAME_FILE)
+        game.add_task(task)
+        if needed_task is None:
+            game.schedule_delivery(task.task_no, player_ids)
+        else:
+            for player_id, player in hosted.storage.snapshot(game).players.items():
+                if needed_task in player.completed_tasks:
+                    game.deliver_task(task.task_no, player_id)
+
+        hosted.storage.record_changes(game, task_nos=[task.task_no])
+    # The game has no listeners of new tasks
+    hosted.search.request_refresh([])
 
 
-@app.view(ACCEPT_TASK_ID)
 def accept_task_submission(body, client, ack):
     """
     Handles the submission of the accept task modal
     """
+    hosted = get_hosted(
+        body["team"]["id"],
+        user_id=body["user"]["id"],
+        name=body["view"].get("private_metadata"),
+    )
+    game = hosted.game
     # Acknowledge the request
     ack()
     logging.debug("[ACCEPT_TASK] Received submission: " + str(body))
@@ -562,13 +1188,35 @@ def accept_task_submission(body, client, ack):
     )
 
     # Get the users
-    users_to_accept = body["view"]["state"]["values"][BLOCK_TASK_ACCEPT_USER_ID][
-        SELECTED_TASK_ACCEPT_USER_ID
-    ]["selected_conversations"]
+    users_to_accept = [
+        option["value"]
+        for option in body["view"]["state"]["values"][BLOCK_TASK_ACCEPT_USER_ID][
+            SELECTED_TASK_ACCEPT_USER_ID
+        ]["selected_options"]
+    ]
 
-    for user in users_to_accept:
-        logging.debug("[ACCEPT_TASK] Accepting task " + str(task) + " for user " + user)
-        game.complete_task_of_player(user, task)
+    logging.debug(
+        "[ACCEPT_TASK] Accepting task " + str(task) + " for users " + str(users_to_accept)
+    )
+    with hosted.storage.transaction(game, users_to_accept, [task]):
+        result = game.complete_task_of_players(users_to_accept, task)
+        hosted.storage.record_changes(
+            game,
+            result["accepted"],
+            [task] + ([game.needed_task[task]] if task in game.needed_task else []),
+        )
+
+    # Report the result to the admin
+    summary = "Zadanie " + str(task) + " zaliczone: " + str(len(result["accepted"]))
+    if len(result["already_completed"]) > 0:
+        summary += "\nJuż wcześniej zaliczone: " + ", ".join(
+            "<@" + user_id + ">" for user_id in result["already_completed"]
+        )
+    if len(result["not_players"]) > 0:
+        summary += "\nNie są graczami: " + ", ".join(
+            "<@" + user_id + ">" for user_id in result["not_players"]
+        )
+    slack_utils.send_message(summary, [body["user"]["id"]], client)
 
 
 # TODO Summaries
@@ -576,10 +1224,225 @@ def accept_task_submission(body, client, ack):
     check everything from beginning as if it was for real
 """
 
+
+
+def queued(priority, listener):
+    """
+    Wraps a listener, so it only queues its work (in the lane of its user). A view submission is acknowledged at once.
+    Bolt reads the arguments of the listener through functools.wraps.
+    """
+
+    @wraps(listener)
+    def handler(**kwargs):
+        if "ack" in kwargs:
+            kwargs["ack"]()
+            kwargs["ack"] = lambda *args, **kw: None
+        # The user of the event (joins, App Home) or of the view submission
+        event = kwargs.get("event") or kwargs.get("payload") or {}
+        user = event.get("user") or kwargs.get("body", {}).get("user", {}).get("id")
+        ingress.submit(priority, listener.__name__, partial(listener, **kwargs), key=user)
+
+    return handler
+
+
+def create_app(token=None):
+    """
+    Creates the app and registers the listeners. Does not connect nor load the games.
+    The token is verified on the first request instead of here, so creating the app does no API calls.
+    With games in many workspaces, the clients of the teams come from the installation store.
+    """
+    global app, ingress
+    ingress = queue_utils.IngressQueue(INGRESS_WORKERS, high_water=INGRESS_HIGH_WATER)
+    if get_registry().is_multi_workspace():
+        app = App(
+            installation_store=FileInstallationStore(base_dir=INSTALLATIONS_DIR),
+            request_verification_enabled=False,
+        )
+    else:
+        app = App(
+            token=token or os.environ.get("BOT_TOKEN"), token_verification_enabled=False
+        )
+    for hosted in get_registry().hosted_games:
+        hosted.home_publisher = home_utils.HomePublisher(
+            app.client, partial(render_home, hosted)
+        )
+        hosted.live_modals = live_utils.LiveModals(
+            app.client, partial(render_live_modal, hosted)
+        )
+
+    # Modals are opened at once, their trigger expires after 3 seconds
+    app.action("app_home_buttons")(app_home_buttons)
+    app.event("app_home_opened")(queued(queue_utils.Priority.ANSWER, app_home_opened))
+    app.event("message")(message_im)
+    app.event("member_joined_channel")(
+        queued(queue_utils.Priority.ANSWER, member_joined_channel)
+    )
+    app.event("channel_created")(channel_changed)
+    app.event("channel_rename")(channel_changed)
+    app.view(SEND_MESSAGE_ID)(queued(queue_utils.Priority.ADMIN, send_message_submission))
+    app.view(ADD_TASK_ID)(queued(queue_utils.Priority.ADMIN, add_task_submission))
+    app.view(ACCEPT_TASK_ID)(queued(queue_utils.Priority.ADMIN, accept_task_submission))
+    app.view_closed(live_utils.LIVE_CALLBACK_ID)(live_modal_closed)
+    # Options of the external selects are returned at once, Slack waits 3 seconds for them
+    app.options(SELECTED_TASK_ACCEPT_ID)(task_options)
+    app.options(SELECTED_NEEDED_TASK_ID)(task_options)
+    app.options(SELECTED_TASK_ACCEPT_USER_ID)(player_options)
+    return app
+
+
+def start(workers=1, inbox=None, responses=None):
+    """
+    Starts the bot: the games are loaded in the background while the socket connects.
+    Listeners that need a game wait for it. Returns the connected handler.
+    With more workers the games are shared with the other worker processes (through the sqlite storage),
+    and the events come from the router of the main process (inbox) instead of a socket (no handler).
+    """
+    global registry
+    timings = []
+    phase_start = time.perf_counter()
+
+    def phase(name):
+        nonlocal phase_start
+        now = time.perf_counter()
+        timings.append(name + " " + str(round((now - phase_start) * 1000)) + " ms")
+        phase_start = now
+
+    # Load .env file
+    env_path = Path(".") / ".env"
+    # env_path = Path('.') / '.env_hack'
+    load_dotenv(dotenv_path=env_path)
+    logging.basicConfig(
+        level=logging.DEBUG,
+        handlers=[logging.FileHandler(LOG_FILE, "a", "utf-8")],
+        format="%(asctime)s %(message)s",
+        datefmt="%d/%m/%Y %H:%M:%S",
+    )
+    phase("env")
+
+    registry = registry_utils.GameRegistry.from_file(
+        GAMES_FILE, DEFAULT_GAME_CONFIG, shared=workers > 1
+    )
+    create_app()
+    phase("app")
+
+    if get_registry().is_multi_workspace():
+        install_workspaces(app.installation_store)
+        phase("install")
+
+    game_loading_start = time.perf_counter()
+    get_registry().load_all(client_for, on_game_loaded)
+
+    if inbox is None:
+        handler = SocketModeHandler(app, os.environ.get("APP_TOKEN"))
+        handler.connect()
+        phase("connect")
+    else:
+        handler = None
+        worker_utils.EnvelopeWorker(app, inbox, responses).start()
+        phase("worker")
+
+    loaded = get_registry().wait_all()
+    timings.append(
+        str(len(loaded))
+        + "/"
+        + str(len(get_registry().hosted_games))
+        + " games ready after "
+        + str(round((time.perf_counter() - game_loading_start) * 1000))
+        + " ms"
+    )
+    phase("game wait")
+    logging.info("[STARTUP] " + ", ".join(timings))
+    return handler
+
+
+def profile_on_signal(signum, frame):
+    """
+    Starts a profile of PROFILE_SIGNAL_SECONDS (kill -USR1 <pid>)
+    """
+
+    def profile():
+        try:
+            profile_utils.run_profile(PROFILE_SIGNAL_SECONDS, PROFILE_DIR)
+        except RuntimeError as e:
+            logging.warning("[PROFILE] " + str(e))
+
+    threading.Thread(target=profile, name="profile", daemon=True).start()
+
+
+def run(workers=1, sample_interval=PROFILE_SAMPLE_INTERVAL, inbox=None, responses=None):
+    """
+    Runs the bot (one worker), restoring the connection when it is lost
+    """
+    handler = start(workers, inbox, responses)
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, profile_on_signal)
+    if sample_interval > 0:
+        profile_utils.start_background_sampling(
+            sample_interval,
+            os.path.join(PROFILE_DIR, "handlers_" + str(os.getpid()) + ".folded"),
+        )
+    try:
+        while True:
+            # The state stays in memory, only the connection is restored
+            if handler is not None and not handler.client.is_connected():
+                logging.info("[STARTUP] Reconnecting")
+                handler.connect()
+            time.sleep(RECONNECT_CHECK_SECONDS)
+    finally:
+        get_registry().save_all()
+
+
+def route(workers, sample_interval=PROFILE_SAMPLE_INTERVAL):
+    """
+    Runs the worker processes and forwards the events of every user to the same worker,
+    restoring the connection when it is lost
+    """
+    load_dotenv(dotenv_path=Path(".") / ".env")
+    inboxes = [multiprocessing.Queue() for _ in range(workers)]
+    responses = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(
+            target=run,
+            args=(workers, sample_interval, inboxes[i], responses),
+            name="worker_" + str(i),
+        )
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    # Envelopes wait in the inboxes until the workers have started
+    router = worker_utils.EnvelopeRouter(os.environ.get("APP_TOKEN"), inboxes, responses)
+    router.start()
+    try:
+        while True:
+            if not router.client.is_connected():
+                router.client.connect()
+            time.sleep(RECONNECT_CHECK_SECONDS)
+    finally:
+        for process in processes:
+            process.join()
+
+
 # Start the app
 if __name__ == "__main__":
-    while True:
-        try:
-            handler.start()
-        finally:
-            game.save_to_pickle(GAME_FILE)
+    parser = argparse.ArgumentParser(description="Runs the bot.")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        choices=range(1, MAX_WORKERS + 1),
+        metavar="1-" + str(MAX_WORKERS),
+        help="Number of worker processes, the events of every user go to one of them (needs the sqlite storage)",
+    )
+    parser.add_argument(
+        "--profile-sample",
+        type=float,
+        default=PROFILE_SAMPLE_INTERVAL,
+        metavar="SECONDS",
+        help="Always sample the running handlers every SECONDS (0 - off), written to " + PROFILE_DIR,
+    )
+    args = parser.parse_args()
+    if args.workers == 1:
+        run(1, args.profile_sample)
+    else:
+        route(args.workers, args.profile_sample)
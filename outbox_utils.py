@@ -0,0 +1,204 @@
+"""
+    This module contains the sender of the outbox of a game.
+    Changes of the game queue their messages in game.outbox (Game.enqueue_message), the storage saves
+    them with the change, and the sender sends them only after that, retrying the failed ones.
+    Messages recovered after a restart are first looked up in Slack, so they are not sent twice.
+
+    Classes:
+        - OutboxSender: Sends the messages of the outbox of a game and records their delivery.
+"""
+import datetime
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from slack_sdk.web.client import WebClient
+
+import game_utils
+import slack_utils
+
+
+class OutboxSender:
+    """
+    This class is used to send the messages of the outbox of a game.
+
+    Attributes:
+        - game: The game.
+        - storage: The storage of the game (records the deliveries).
+        - client: The slack client.
+        - sent: The number of messages sent.
+        - recovered: The number of messages found already sent after a restart.
+    """
+
+    # How many messages are sent at once
+    BATCH_SIZE = 50
+    # After how many failed attempts a message is given up
+    MAX_ATTEMPTS = 10
+    # The longest wait between two attempts in seconds
+    MAX_BACKOFF = 300
+    # How often the outbox is checked without being woken up, in seconds
+    POLL_SECONDS = 5
+    # Messages due in less than this many seconds are posted at once (Slack rejects a post_at in the past)
+    SCHEDULE_MARGIN = 15
+
+    def __init__(self, game: game_utils.Game, storage: Any, client: WebClient):
+        """
+        The constructor.
+
+        Parameters:
+            - game: The game.
+            - storage: The storage of the game.
+            - client: The slack client.
+        """
+        self.game = game
+        self.storage = storage
+        self.client = client
+        self.sent = 0
+        self.recovered = 0
+        self._wake = threading.Event()
+
+    def start(self):
+        """
+        Starts the sender thread (the recovered messages are sent first).
+        """
+        self._wake.set()
+        threading.Thread(target=self._run, name="outbox_sender", daemon=True).start()
+
+    def wake(self):
+        """
+        Wakes up the sender after new messages were saved.
+        """
+        self._wake.set()
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Returns the state of the outbox (for the admin).
+
+        Returns:
+            The numbers of pending, failed, sent and recovered messages.
+        """
+        with self.game.lock:
+            entries = list(self.game.outbox.values())
+        return {
+            "pending": sum(1 for entry in entries if not entry["failed"]),
+            "failed": sum(1 for entry in entries if entry["failed"]),
+            "sent": self.sent,
+            "recovered": self.recovered,
+        }
+
+    def drain(self):
+        """
+        Sends all messages that are due, in batches.
+        """
+        self.storage.claim_outbox(self.game)
+        while True:
+            now = time.time()
+            with self.game.lock:
+                due = sorted(
+                    (
+                        entry
+                        for entry in self.game.outbox.values()
+                        if entry["committed"] and not entry["failed"] and entry["next_try"] <= now
+                    ),
+                    key=lambda entry: entry["created_at"],
+                )[: self.BATCH_SIZE]
+                # The messages of closed tasks are dropped
+                dropped = [
+                    entry
+                    for entry in due
+                    if entry["task_no"] in self.game.tasks
+                    and not self.game.tasks[entry["task_no"]].is_open()
+                ]
+            if len(due) == 0:
+                return
+            due = [entry for entry in due if entry not in dropped]
+            refs = slack_utils.run_concurrently(
+                [lambda entry=entry: self._send(entry) for entry in due]
+            )
+            delivered = [(entry, ref) for entry, ref in zip(due, refs) if ref is not None]
+            failed = [entry for entry, ref in zip(due, refs) if ref is None]
+            with self.storage.transaction(self.game):
+                for entry in dropped:
+                    entry["failed"] = True
+                    self.game.message_failed(entry["id"])
+                    logging.info(
+                        "[OUTBOX] Message " + entry["id"] + " of closed task "
+                        + str(entry["task_no"]) + " dropped."
+                    )
+                for entry, ref in delivered:
+                    self.game.message_delivered(entry["id"], ref)
+                for entry in failed:
+                    entry["attempts"] += 1
+                    entry["next_try"] = now + min(2 ** entry["attempts"], self.MAX_BACKOFF)
+                    if entry["attempts"] >= self.MAX_ATTEMPTS:
+                        entry["failed"] = True
+                        self.game.message_failed(entry["id"])
+                        logging.error(
+                            "[OUTBOX] Message " + entry["id"] + " to " + entry["channel"] + " given up."
+                        )
+                self.storage.record_delivery(self.game, delivered, failed + dropped)
+            self.sent += len(delivered)
+            if len(dropped) > 0:
+                self.storage.archive_tasks(self.game)
+            if len(delivered) == 0 and len(dropped) == 0:
+                # Everything failed, wait for the next try
+                return
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.POLL_SECONDS)
+            self._wake.clear()
+            try:
+                self.drain()
+            except Exception as e:
+                logging.exception("[OUTBOX] Sending failed: " + str(e))
+
+    def _send(self, entry: Dict[str, Any]) -> Tuple[str, str]:
+        if entry["recovered"]:
+            try:
+                ref = self._find_sent(entry)
+            except Exception as e:
+                # Better sent twice than never
+                logging.warning("[OUTBOX] Could not check message " + entry["id"] + ": " + str(e))
+                ref = None
+            if ref is not None:
+                self.recovered += 1
+                logging.info("[OUTBOX] Message " + entry["id"] + " was already sent.")
+                return ref
+        if entry["task_no"] is not None:
+            metadata = {
+                "event_type": str(entry["task_no"]),
+                "event_payload": {"task_no": str(entry["task_no"]), "outbox_id": entry["id"]},
+            }
+        else:
+            metadata = {"event_type": "outbox", "event_payload": {"outbox_id": entry["id"]}}
+        # Recovered after a downtime, delayed by retries or queued just before the time of the task
+        if entry["post_at"] is not None and entry["post_at"] > time.time() + self.SCHEDULE_MARGIN:
+            response = slack_utils.send_scheduled_message(
+                entry["text"],
+                entry["channel"],
+                datetime.datetime.fromtimestamp(entry["post_at"]),
+                self.client,
+                metadata=metadata,
+            )
+        else:
+            response = slack_utils.send_message(
+                entry["text"], [entry["channel"]], self.client, metadata=metadata
+            )[0]
+        return game_utils.message_ref(response)
+
+    def _find_sent(self, entry: Dict[str, Any]) -> Optional[Tuple[str, str]]:
+        if entry["post_at"] is not None and entry["post_at"] > time.time():
+            message = slack_utils.find_scheduled_message(
+                entry["channel"], entry["text"], entry["post_at"], self.client
+            )
+            if message is not None:
+                return message["channel_id"], message["id"]
+        # Posted at once, or scheduled and already posted by Slack
+        message = slack_utils.find_message_by_metadata(
+            entry["channel"], "outbox_id", entry["id"], self.client
+        )
+        if message is not None:
+            return message["channel"], message["ts"]
+        return None
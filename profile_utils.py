@@ -0,0 +1,272 @@
+"""
+    This module contains the profiling hooks of the bot, to see what the process does when it is slow
+    without restarting it under a debugger.
+
+    Classes:
+        - SamplingProfiler: Samples the stacks of the threads and counts them in the folded (flamegraph) format.
+
+    Functions:
+        - tagged: Tags the samples of the current thread with the name of the handler it runs.
+        - run_profile: Runs a time-boxed profile and writes the stack file and the allocations report.
+        - start_background_sampling: Starts low-rate sampling of the handlers, dumped to a file periodically.
+
+    The stack files can be turned into flamegraphs with flamegraph.pl or speedscope.
+    To see all allocations of the game (not only the ones made during the profile), start the bot
+    with PYTHONTRACEMALLOC=10, so tracemalloc traces from the start.
+"""
+import collections
+import contextlib
+import datetime
+import logging
+import os
+import pickle
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Any, Dict, Optional
+
+# Maps the ID of the thread to the name of the handler it runs
+_handlers = {}
+# Only one time-boxed profile runs at once
+_profile_lock = threading.Lock()
+
+# The modules whose allocations are the state of the game
+GAME_MODULES = ("game_utils", "stats_utils", "history_utils", "storage_utils")
+
+
+@contextlib.contextmanager
+def tagged(name: str):
+    """
+    Tags the samples of the current thread with the name of the handler it runs.
+
+    Parameters:
+        - name: The name of the handler.
+    """
+    ident = threading.get_ident()
+    previous = _handlers.get(ident)
+    _handlers[ident] = name
+    try:
+        yield
+    finally:
+        if previous is None:
+            _handlers.pop(ident, None)
+        else:
+            _handlers[ident] = previous
+
+
+class SamplingProfiler:
+    """
+    This class is used to sample the stacks of the threads of the process.
+    Every sample is counted as "thread;handler;frame;...;frame", the folded format of flamegraphs.
+
+    Attributes:
+        - interval: The time between two samples in seconds.
+        - tagged_only: Whether only the threads running a tagged handler are sampled.
+        - samples: The number of samples taken.
+    """
+
+    def __init__(self, interval: float = 0.01, tagged_only: bool = False):
+        """
+        The constructor.
+
+        Parameters:
+            - interval: The time between two samples in seconds.
+            - tagged_only: Whether only the threads running a tagged handler are sampled.
+        """
+        self.interval = interval
+        self.tagged_only = tagged_only
+        self.samples = 0
+        self._stacks = collections.Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Starts sampling in the background.
+        """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops sampling.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def sample(self):
+        """
+        Takes one sample of all threads (except the calling one).
+        """
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        own = threading.get_ident()
+        stacks = []
+        for ident, frame in sys._current_frames().items():
+            handler = _handlers.get(ident)
+            if ident == own or (self.tagged_only and handler is None):
+                continue
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(
+                    code.co_name
+                    + " ("
+                    + os.path.basename(code.co_filename)
+                    + ":"
+                    + str(code.co_firstlineno)
+                    + ")"
+                )
+                frame = frame.f_back
+            # Numbered threads of one pool (ingress_0, ingress_1...) are one root
+            thread = names.get(ident, str(ident)).rstrip("0123456789").rstrip("_")
+            frames.append(handler or "-")
+            frames.append(thread)
+            stacks.append(";".join(reversed(frames)))
+        with self._lock:
+            self._stacks.update(stacks)
+            self.samples += 1
+
+    def dump(self, file_name: str):
+        """
+        Writes the counted stacks to a file in the folded format ("stack count" lines).
+
+        Parameters:
+            - file_name: The name of the file.
+        """
+        with self._lock:
+            stacks = self._stacks.most_common()
+        with open(file_name, "w", encoding="utf-8") as f:
+            for stack, count in stacks:
+                f.write(stack + " " + str(count) + "\n")
+
+    def summary(self, n: int = 5) -> Dict[str, Any]:
+        """
+        Returns the number of samples by handler and the functions most often on top of the stack.
+
+        Parameters:
+            - n: How many functions are returned.
+        """
+        handlers = collections.Counter()
+        frames = collections.Counter()
+        with self._lock:
+            for stack, count in self._stacks.items():
+                parts = stack.split(";")
+                handlers[parts[1]] += count
+                frames[parts[-1]] += count
+            return {
+                "samples": self.samples,
+                "handlers": dict(handlers.most_common()),
+                "top_frames": dict(frames.most_common(n)),
+            }
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sample()
+            except Exception as e:
+                logging.exception("[PROFILE] Sampling failed: " + str(e))
+
+
+def run_profile(
+    seconds: float, out_dir: str, interval: float = 0.01, game: Optional[Any] = None
+) -> Dict[str, Any]:
+    """
+    Samples all threads for the given time and takes a tracemalloc snapshot at the end.
+    Writes the stack file (folded format) and the top allocations report to out_dir.
+
+    Parameters:
+        - seconds: How long to profile.
+        - out_dir: The directory of the files.
+        - interval: The time between two samples in seconds.
+        - game: The game, whose pickled size is added to the report.
+
+    Returns:
+        The names of the files and the summary of the samples.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        raise RuntimeError("A profile is already running")
+    try:
+        os.makedirs(out_dir, exist_ok=True)
+        name = os.path.join(
+            out_dir,
+            "profile_"
+            + datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+            + "_"
+            + str(os.getpid()),
+        )
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(10)
+        profiler = SamplingProfiler(interval)
+        profiler.start()
+        time.sleep(seconds)
+        profiler.stop()
+        snapshot = tracemalloc.take_snapshot()
+        if started_tracing:
+            tracemalloc.stop()
+
+        profiler.dump(name + ".folded")
+        snapshot = snapshot.filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen*")]
+        )
+        lines = [
+            "Allocations traced "
+            + ("during the profile" if started_tracing else "since tracemalloc was started"),
+            "",
+            "Top allocations:",
+        ]
+        lines += [str(stat) for stat in snapshot.statistics("lineno")[:30]]
+        lines += ["", "Top allocations of the game:"]
+        game_filter = [tracemalloc.Filter(True, "*" + module + ".py") for module in GAME_MODULES]
+        lines += [str(stat) for stat in snapshot.filter_traces(game_filter).statistics("lineno")[:15]]
+        if game is not None:
+            with game.lock:
+                size = len(pickle.dumps(game, protocol=pickle.HIGHEST_PROTOCOL))
+            lines += ["", "Pickled game: " + str(size) + " B"]
+        with open(name + "_alloc.txt", "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        logging.info("[PROFILE] Profile written to " + name)
+        return {
+            "stacks": name + ".folded",
+            "allocations": name + "_alloc.txt",
+            **profiler.summary(),
+        }
+    finally:
+        _profile_lock.release()
+
+
+def start_background_sampling(
+    interval: float, file_name: str, dump_every: float = 60.0
+) -> SamplingProfiler:
+    """
+    Starts low-rate sampling of the threads running tagged handlers.
+    The counted stacks (since the start) are written to the file every dump_every seconds.
+
+    Parameters:
+        - interval: The time between two samples in seconds.
+        - file_name: The name of the stack file.
+        - dump_every: How often the file is written, in seconds.
+
+    Returns:
+        The profiler.
+    """
+    directory = os.path.dirname(file_name)
+    if directory != "":
+        os.makedirs(directory, exist_ok=True)
+    profiler = SamplingProfiler(interval, tagged_only=True)
+    profiler.start()
+
+    def dump():
+        while True:
+            time.sleep(dump_every)
+            try:
+                profiler.dump(file_name)
+            except Exception as e:
+                logging.exception("[PROFILE] Writing samples failed: " + str(e))
+
+    threading.Thread(target=dump, name="profiler_dump", daemon=True).start()
+    return profiler
@@ -0,0 +1,198 @@
+"""
+    This module contains the queue the work of the listeners goes through.
+    Listeners only enqueue their work, so the events are acknowledged at once, and the workers take
+    the work with the highest priority first. The work of a user always goes to the same worker (its lane),
+    so the events of one user are handled one at a time, and the ones of the same priority in the order they came.
+
+    Classes:
+        - Priority: The priority of the work.
+        - IngressQueue: Bounded queues by priority, with the workers that empty them.
+"""
+import collections
+import logging
+import threading
+import time
+from enum import Enum
+from typing import Any, Callable, Dict, Optional
+
+import profile_utils
+
+
+class Priority(Enum):
+    """
+    This class is used to represent the priority of the work (the lower value is taken first).
+    """
+
+    # Admin commands and modal submissions
+    ADMIN = 0
+    # Answers and other changes of the game
+    ANSWER = 1
+    # Messages that do not change the game (random quotes), shed first
+    CHATTER = 2
+
+
+class IngressQueue:
+    """
+    This class is used to queue the work of the listeners.
+    Every priority has its own bounded queue. When a queue is full, admin and answer work waits for
+    up to put_timeout seconds (slowing down the listeners) before it is shed, chatter is shed at once.
+    Chatter is also shed when all queues together hold more than high_water items.
+    Work with a key (the user ID) is queued in the lane of the key, hash(key) % workers, and only the worker
+    of that lane takes it. Work without a key is taken by any worker.
+
+    Attributes:
+        - workers: The number of worker threads (and lanes).
+        - capacities: Maps the priority to the size of its queue.
+        - high_water: The number of queued items above which chatter is shed.
+        - put_timeout: How many seconds admin and answer work waits for a place in a full queue.
+        - shed: Maps the priority to the number of items shed.
+        - processed: Maps the priority to the number of items taken by the workers.
+        - max_wait: Maps the priority to the longest time (in seconds) an item waited in the queue.
+    """
+
+    DEFAULT_CAPACITIES = {Priority.ADMIN: 100, Priority.ANSWER: 2000, Priority.CHATTER: 200}
+
+    def __init__(
+        self,
+        workers: int = 8,
+        capacities: Optional[Dict[Priority, int]] = None,
+        high_water: int = 500,
+        put_timeout: float = 2.0,
+    ):
+        """
+        The constructor. Starts the workers.
+
+        Parameters:
+            - workers: The number of worker threads.
+            - capacities: Maps the priority to the size of its queue (DEFAULT_CAPACITIES by default).
+            - high_water: The number of queued items above which chatter is shed.
+            - put_timeout: How many seconds admin and answer work waits for a place in a full queue.
+        """
+        self.workers = workers
+        self.capacities = dict(capacities or self.DEFAULT_CAPACITIES)
+        self.high_water = high_water
+        self.put_timeout = put_timeout
+        self.shed = {priority: 0 for priority in Priority}
+        self.processed = {priority: 0 for priority in Priority}
+        self.max_wait = {priority: 0.0 for priority in Priority}
+        self._total_wait = {priority: 0.0 for priority in Priority}
+        # The work without a key, and the work of every lane
+        self._queues = {priority: collections.deque() for priority in Priority}
+        self._lanes = [
+            {priority: collections.deque() for priority in Priority} for _ in range(workers)
+        ]
+        self._sizes = {priority: 0 for priority in Priority}
+        self._condition = threading.Condition()
+        for i in range(workers):
+            threading.Thread(
+                target=self._work, args=(i,), name="ingress_" + str(i), daemon=True
+            ).start()
+
+    def depth(self, priority: Optional[Priority] = None) -> int:
+        """
+        Returns the number of queued items.
+
+        Parameters:
+            - priority: The priority (all queues by default).
+        """
+        with self._condition:
+            if priority is not None:
+                return self._sizes[priority]
+            return self._depth()
+
+    def submit(
+        self, priority: Priority, name: str, job: Callable[[], Any], key: Optional[str] = None
+    ) -> bool:
+        """
+        Queues the work.
+
+        Parameters:
+            - priority: The priority of the work.
+            - name: The name of the work (for the logs).
+            - job: The work.
+            - key: The user ID whose work is handled in order (None - any worker takes it).
+
+        Returns:
+            True if the work was queued, False if it was shed.
+        """
+        deadline = time.monotonic() + self.put_timeout
+        if key is None:
+            queue = self._queues[priority]
+        else:
+            queue = self._lanes[hash(key) % self.workers][priority]
+        with self._condition:
+            if priority == Priority.CHATTER and self._depth() >= self.high_water:
+                return self._shed(priority, name)
+            while self._sizes[priority] >= self.capacities[priority]:
+                remaining = deadline - time.monotonic()
+                if priority == Priority.CHATTER or remaining <= 0:
+                    return self._shed(priority, name)
+                self._condition.wait(remaining)
+            queue.append((time.monotonic(), name, job))
+            self._sizes[priority] += 1
+            self._condition.notify_all()
+        return True
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Returns the depths of the queues and the wait times (for the admin).
+
+        Returns:
+            The statistics of every priority.
+        """
+        with self._condition:
+            return {
+                priority.name: {
+                    "depth": self._sizes[priority],
+                    "capacity": self.capacities[priority],
+                    "processed": self.processed[priority],
+                    "shed": self.shed[priority],
+                    "average_wait": round(
+                        self._total_wait[priority] / self.processed[priority], 3
+                    )
+                    if self.processed[priority] > 0
+                    else None,
+                    "max_wait": round(self.max_wait[priority], 3),
+                }
+                for priority in Priority
+            }
+
+    def _depth(self) -> int:
+        return sum(self._sizes.values())
+
+    def _next(self, lane: int) -> Optional[tuple]:
+        # The oldest work of the highest priority, from the shared queue or the lane of the worker
+        for priority in Priority:
+            shared = self._queues[priority]
+            own = self._lanes[lane][priority]
+            if len(shared) > 0 and (len(own) == 0 or shared[0][0] <= own[0][0]):
+                return (priority,) + shared.popleft()
+            if len(own) > 0:
+                return (priority,) + own.popleft()
+        return None
+
+    def _shed(self, priority: Priority, name: str) -> bool:
+        self.shed[priority] += 1
+        logging.warning("[QUEUE] Shed " + name + " (" + priority.name + ")")
+        return False
+
+    def _work(self, lane: int):
+        while True:
+            with self._condition:
+                item = self._next(lane)
+                while item is None:
+                    self._condition.wait()
+                    item = self._next(lane)
+                priority, queued_at, name, job = item
+                self._sizes[priority] -= 1
+                wait = time.monotonic() - queued_at
+                self.processed[priority] += 1
+                self._total_wait[priority] += wait
+                self.max_wait[priority] = max(self.max_wait[priority], wait)
+                # Wake up the listeners waiting for a place
+                self._condition.notify_all()
+            try:
+                with profile_utils.tagged(name):
+                    job()
+            except Exception as e:
+                logging.exception("[QUEUE] " + name + " failed: " + str(e))
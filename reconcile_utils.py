@@ -0,0 +1,130 @@
+"""
+    This module contains the reconciliation of the members of the channel of a game with its players.
+    Users who joined the channel while the bot was down never got the member_joined_channel event,
+    so at startup and then every few minutes the members of the channel are compared with the players,
+    and the missing ones are added and get their tasks (through the outbox, in batches).
+
+    Classes:
+        - ChannelReconciler: Adds the members of the channel that are not players yet.
+"""
+import logging
+import threading
+import time
+from typing import Any, Dict
+
+from slack_sdk.web.client import WebClient
+
+import game_utils
+import slack_utils
+
+
+class ChannelReconciler:
+    """
+    This class is used to add the members of the channel of a game that are not players.
+
+    Attributes:
+        - game: The game.
+        - storage: The storage of the game.
+        - client: The slack client.
+        - channel: The channel of the game.
+        - interval: The number of seconds between two reconciliations (0 - only at startup).
+        - last: The counts of the last reconciliation.
+        - added: The number of players added by all reconciliations.
+    """
+
+    # How many players are added in one transaction
+    BATCH_SIZE = 100
+
+    def __init__(
+        self,
+        game: game_utils.Game,
+        storage: Any,
+        client: WebClient,
+        channel: str,
+        interval: float = 600.0,
+    ):
+        """
+        The constructor.
+
+        Parameters:
+            - game: The game.
+            - storage: The storage of the game.
+            - client: The slack client.
+            - channel: The channel of the game.
+            - interval: The number of seconds between two reconciliations (0 - only at startup).
+        """
+        self.game = game
+        self.storage = storage
+        self.client = client
+        self.channel = channel
+        self.interval = interval
+        self.last = None
+        self.added = 0
+        self._bot_user_id = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Starts the reconciliation thread (the first reconciliation runs at once).
+        """
+        threading.Thread(target=self._run, name="reconciler", daemon=True).start()
+
+    def reconcile(self) -> Dict[str, Any]:
+        """
+        Adds the members of the channel that are not players, and queues their tasks.
+
+        Returns:
+            The counts: members of the channel, players, added players, players that left the channel
+            and queued messages.
+        """
+        with self._lock:
+            start = time.perf_counter()
+            if self._bot_user_id is None:
+                self._bot_user_id = self.client.auth_test()["user_id"]
+            members = set(slack_utils.get_channel_users(self.channel, self.client))
+            members.discard(self._bot_user_id)
+            game = self.storage.snapshot(self.game)
+            with game.lock:
+                players = set(game.players.keys())
+            missing = sorted(members - players)
+
+            added = 0
+            queued = 0
+            for i in range(0, len(missing), self.BATCH_SIZE):
+                batch = missing[i : i + self.BATCH_SIZE]
+                with self.storage.transaction(self.game, batch, None):
+                    # Another worker may have added some of them in the meantime
+                    batch = [user_id for user_id in batch if user_id not in self.game.players]
+                    queued += self.game.welcome_players(batch)
+                    self.storage.record_changes(self.game, batch, self.game.live_tasks().keys())
+                if len(batch) > 0:
+                    added += len(batch)
+                    self.game.notify_change(batch)
+                    self.game.notify_join(batch)
+            self.added += added
+            self.last = {
+                "members": len(members),
+                "players": len(players),
+                "added": added,
+                "left": len(players - members),
+                "queued": queued,
+                "seconds": round(time.perf_counter() - start, 3),
+            }
+        logging.info("[RECONCILE] Channel " + self.channel + ": " + str(self.last))
+        return self.last
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Returns the counts of the last reconciliation and the number of all added players (for the admin).
+        """
+        return {"last": self.last, "added": self.added, "interval": self.interval}
+
+    def _run(self):
+        while True:
+            try:
+                self.reconcile()
+            except Exception as e:
+                logging.exception("[RECONCILE] Reconciliation failed: " + str(e))
+            if not self.interval:
+                return
+            time.sleep(self.interval)
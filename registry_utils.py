@@ -0,0 +1,415 @@
+"""
+    This module contains the classes that are used to host many games (events, workspaces) in one process.
+
+    Classes:
+        - GameConfig: The configuration of one hosted game.
+        - HostedGame: A game with its configuration, client and save file.
+        - GameRegistry: All hosted games, looked up by team, channel or user.
+
+    The games are configured in a JSON file (GAMES_FILE), for example:
+        [
+            {
+                "name": "hacknarok",
+                "team_id": "T01234567",
+                "asgard_channel": "C04P6595G5S",
+                "admin_user_ids": ["U03AECYM5MZ"],
+                "game_file": "saved/game_save",
+                "storage": "pickle",
+                "max_attempts": 5,
+                "attempt_window": 60,
+                "reply_window": 10,
+                "reconcile_interval": 600,
+                "bot_token_env": "BOT_TOKEN"
+            }
+        ]
+    Without the file, one game is hosted with the default configuration.
+    The storage is "pickle" (default) or "sqlite" (game_file is then the database file).
+"""
+import json
+import logging
+import os
+import threading
+from concurrent.futures import Future, wait
+from typing import Any, Callable, Dict, List, Optional
+
+from slack_sdk.web.client import WebClient
+
+import game_utils
+import limit_utils
+import outbox_utils
+import reconcile_utils
+import storage_utils
+
+
+class GameConfig:
+    """
+    This class is used to store the configuration of one hosted game.
+
+    Attributes:
+        - name: The name of the game.
+        - team_id: The ID of the workspace (None matches every workspace).
+        - asgard_channel: The channel of the game.
+        - admin_user_ids: The IDs of the admins of the game.
+        - game_file: The file the game is saved to.
+        - bot_token_env: The environment variable with the bot token of the workspace.
+        - storage: The kind of the storage of the game (one of storage_utils.STORAGE_KINDS).
+        - max_attempts: The number of answers a player can send to a task in attempt_window seconds.
+        - attempt_window: The length of the window of the answer limit in seconds.
+        - reply_window: For how many seconds wrong answer replies are collapsed into one summary.
+        - reconcile_interval: Every how many seconds the members of the channel missing from the players are added (0 - only at startup).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        asgard_channel: str,
+        admin_user_ids: List[str],
+        game_file: str,
+        team_id: Optional[str] = None,
+        bot_token_env: str = "BOT_TOKEN",
+        storage: str = "pickle",
+        max_attempts: int = 5,
+        attempt_window: float = 60.0,
+        reply_window: float = 10.0,
+        reconcile_interval: float = 600.0,
+    ):
+        """
+        The constructor.
+
+        Parameters:
+            - name: The name of the game.
+            - asgard_channel: The channel of the game.
+            - admin_user_ids: The IDs of the admins of the game.
+            - game_file: The file the game is saved to.
+            - team_id: The ID of the workspace (None matches every workspace).
+            - bot_token_env: The environment variable with the bot token of the workspace.
+            - storage: The kind of the storage of the game (one of storage_utils.STORAGE_KINDS).
+            - max_attempts: The number of answers a player can send to a task in attempt_window seconds.
+            - attempt_window: The length of the window of the answer limit in seconds.
+            - reply_window: For how many seconds wrong answer replies are collapsed into one summary.
+            - reconcile_interval: Every how many seconds the members of the channel missing from the players are added (0 - only at startup).
+        """
+        if storage not in storage_utils.STORAGE_KINDS:
+            raise ValueError(
+                "Unknown storage '" + storage + "' of the game " + name
+                + ", use one of " + str(storage_utils.STORAGE_KINDS)
+            )
+        self.name = name
+        self.team_id = team_id
+        self.asgard_channel = asgard_channel
+        self.admin_user_ids = admin_user_ids
+        self.game_file = game_file
+        self.bot_token_env = bot_token_env
+        self.storage = storage
+        self.max_attempts = max_attempts
+        self.attempt_window = attempt_window
+        self.reply_window = reply_window
+        self.reconcile_interval = reconcile_interval
+
+    @staticmethod
+    def from_dict(data: Dict[str, Any]) -> "GameConfig":
+        """
+        Creates the configuration from a dictionary (an entry of the games file).
+
+        Parameters:
+            - data: The dictionary.
+
+        Returns:
+            The configuration.
+        """
+        return GameConfig(
+            name=data["name"],
+            asgard_channel=data["asgard_channel"],
+            admin_user_ids=list(data["admin_user_ids"]),
+            game_file=data["game_file"],
+            team_id=data.get("team_id"),
+            bot_token_env=data.get("bot_token_env", "BOT_TOKEN"),
+            storage=data.get("storage", "pickle"),
+            max_attempts=int(data.get("max_attempts", 5)),
+            attempt_window=float(data.get("attempt_window", 60.0)),
+            reply_window=float(data.get("reply_window", 10.0)),
+            reconcile_interval=float(data.get("reconcile_interval", 600.0)),
+        )
+
+
+class HostedGame:
+    """
+    This class is used to store a hosted game with its configuration and client.
+
+    Attributes:
+        - config: The configuration of the game.
+        - client: The slack client of the workspace of the game.
+        - home_publisher: The publisher of the home tabs of the players of the game.
+        - live_modals: The open leaderboard and players modals of the game, kept up to date.
+        - scoreboard: The scoreboard pinned in the channel of the game.
+        - search: The search of the tasks and players for the selects of the modals.
+        - channels: Resolves the channels given in the admin commands to their IDs.
+        - storage: The storage the game is saved to.
+        - attempt_limiter: The limit of the answers of the players.
+        - wrong_replies: Collapses bursts of wrong answer replies.
+        - outbox_sender: Sends the messages of the outbox of the game.
+        - reconciler: Adds the members of the channel of the game that are not players.
+    """
+
+    def __init__(self, config: GameConfig, shared: bool = False):
+        """
+        The constructor.
+
+        Parameters:
+            - config: The configuration of the game.
+            - shared: Whether other processes host the game too (worker mode).
+        """
+        self.config = config
+        self.shared = shared
+        self.client = None
+        self.home_publisher = None
+        self.live_modals = None
+        self.scoreboard = None
+        self.search = None
+        self.channels = None
+        self.storage = None
+        self.attempt_limiter = limit_utils.AttemptLimiter(
+            config.max_attempts, config.attempt_window
+        )
+        self.wrong_replies = limit_utils.ReplyCoalescer(None, config.reply_window)
+        self.outbox_sender = None
+        self.reconciler = None
+        self._game = Future()
+
+    @property
+    def game(self) -> game_utils.Game:
+        """
+        Returns the game, waiting for it if it is still being loaded.
+        """
+        return self._game.result()
+
+    def is_loaded(self) -> bool:
+        """
+        Returns True if the game has been loaded (False while loading or if loading failed).
+        """
+        return self._game.done() and self._game.exception() is None
+
+    def has_failed(self) -> bool:
+        """
+        Returns True if loading the game failed.
+        """
+        return self._game.done() and self._game.exception() is not None
+
+    def load(
+        self,
+        client: WebClient,
+        on_load: Optional[Callable[["HostedGame", game_utils.Game], None]] = None,
+    ):
+        """
+        Loads the game from its storage, starts sending its outbox and reconciling its channel.
+
+        Parameters:
+            - client: The slack client of the workspace of the game.
+            - on_load: Called with the hosted game and the game, before anyone waiting for the game gets it.
+        """
+        try:
+            self.client = client
+            self.wrong_replies.client = client
+            self.storage = storage_utils.create_storage(
+                self.config.storage, self.config.game_file, self.shared
+            )
+            if self.shared:
+                # The answers handled by the other processes count too
+                self.attempt_limiter.load = self.storage.attempt_times
+            game = self.storage.load()
+            game.set_client(client)
+            # Tasks closed before the restart whose messages were sent since then
+            archived = self.storage.archive_tasks(game)
+            if len(archived) > 0:
+                logging.info("[REGISTRY] Archived tasks: " + str(archived))
+            if on_load is not None:
+                on_load(self, game)
+            self._game.set_result(game)
+            self.outbox_sender = outbox_utils.OutboxSender(game, self.storage, client)
+            self.storage.on_commit = self.outbox_sender.wake
+            self.outbox_sender.start()
+            # Users who joined the channel while the bot was down
+            self.reconciler = reconcile_utils.ChannelReconciler(
+                game,
+                self.storage,
+                client,
+                self.config.asgard_channel,
+                self.config.reconcile_interval,
+            )
+            self.reconciler.start()
+            logging.info("[REGISTRY] Game " + self.config.name + " loaded.")
+        except Exception as e:
+            logging.exception("[REGISTRY] Game " + self.config.name + " not loaded: " + str(e))
+            if not self._game.done():
+                self._game.set_exception(e)
+
+    def save(self):
+        """
+        Saves the whole game to its storage.
+        """
+        self.storage.save(self.game)
+
+    def is_admin(self, user_id: str) -> bool:
+        """
+        Checks if the user is an admin of the game.
+
+        Parameters:
+            - user_id: The ID of the user.
+        """
+        return user_id in self.config.admin_user_ids
+
+
+class GameRegistry:
+    """
+    This class is used to store all hosted games.
+
+    Attributes:
+        - hosted_games: The hosted games, in the order of the configuration.
+    """
+
+    def __init__(self, configs: List[GameConfig], shared: bool = False):
+        """
+        The constructor.
+
+        Parameters:
+            - configs: The configurations of the games.
+            - shared: Whether other processes host the games too (worker mode, needs the sqlite storage).
+        """
+        names = [config.name for config in configs]
+        if len(set(names)) != len(names):
+            raise ValueError("Names of the games have to be unique: " + str(names))
+        if shared and any(config.storage != "sqlite" for config in configs):
+            raise ValueError("Worker processes can only share games with the sqlite storage")
+        self.hosted_games = [HostedGame(config, shared) for config in configs]
+        self._by_name = {hosted.config.name: hosted for hosted in self.hosted_games}
+
+    @staticmethod
+    def from_file(
+        file_name: str, default_config: GameConfig, shared: bool = False
+    ) -> "GameRegistry":
+        """
+        Creates the registry from the games file, or with the default game if there is no file.
+
+        Parameters:
+            - file_name: The name of the games file.
+            - default_config: The configuration used when there is no file.
+            - shared: Whether other processes host the games too (worker mode).
+
+        Returns:
+            The registry.
+        """
+        if not os.path.exists(file_name):
+            return GameRegistry([default_config], shared)
+        with open(file_name, "r", encoding="utf-8") as f:
+            return GameRegistry([GameConfig.from_dict(data) for data in json.load(f)], shared)
+
+    def team_ids(self) -> List[str]:
+        """
+        Returns the IDs of the workspaces with a configured team.
+        """
+        return sorted(
+            {hosted.config.team_id for hosted in self.hosted_games if hosted.config.team_id}
+        )
+
+    def is_multi_workspace(self) -> bool:
+        """
+        Returns True if the games are in more than one workspace.
+        """
+        return len(self.team_ids()) > 1
+
+    def by_name(self, name: Optional[str]) -> Optional[HostedGame]:
+        """
+        Returns the hosted game with the given name.
+
+        Parameters:
+            - name: The name of the game.
+        """
+        return self._by_name.get(name)
+
+    def find(
+        self,
+        team_id: Optional[str] = None,
+        channel: Optional[str] = None,
+        user_id: Optional[str] = None,
+    ) -> Optional[HostedGame]:
+        """
+        Finds the game an event belongs to: the game of the channel, then the game the user is an admin
+        or a player of, then the first game of the workspace. Games that failed to load are skipped
+        (the ones still loading are kept, the event waits for them).
+
+        Parameters:
+            - team_id: The ID of the workspace.
+            - channel: The channel of the event.
+            - user_id: The ID of the user of the event.
+
+        Returns:
+            The hosted game or None if no game is hosted in the workspace.
+        """
+        candidates = [
+            hosted
+            for hosted in self.hosted_games
+            if (hosted.config.team_id is None or team_id is None or hosted.config.team_id == team_id)
+            and not hosted.has_failed()
+        ]
+        if len(candidates) == 0:
+            return None
+        if len(candidates) == 1:
+            return candidates[0]
+        if channel is not None:
+            for hosted in candidates:
+                if hosted.config.asgard_channel == channel:
+                    return hosted
+        if user_id is not None:
+            for hosted in candidates:
+                if hosted.is_admin(user_id):
+                    return hosted
+            for hosted in candidates:
+                if hosted.is_loaded() and user_id in hosted.game.players:
+                    return hosted
+        return candidates[0]
+
+    def load_all(
+        self,
+        client_for: Callable[[GameConfig], WebClient],
+        on_load: Optional[Callable[[HostedGame, game_utils.Game], None]] = None,
+    ):
+        """
+        Loads all games in the background, each in its own thread.
+
+        Parameters:
+            - client_for: Returns the slack client of the workspace of a game.
+            - on_load: Called with every hosted game and its game after it is loaded.
+        """
+        for hosted in self.hosted_games:
+            threading.Thread(
+                target=lambda hosted=hosted: hosted.load(client_for(hosted.config), on_load),
+                name="game_loader_" + hosted.config.name,
+                daemon=True,
+            ).start()
+
+    def wait_all(self) -> List[HostedGame]:
+        """
+        Waits until all games are loaded. A game that failed to load is logged and the others are served.
+
+        Returns:
+            The games that are loaded.
+        """
+        wait([hosted._game for hosted in self.hosted_games])
+        failed = [hosted.config.name for hosted in self.hosted_games if hosted.has_failed()]
+        if len(failed) > 0:
+            logging.error("[REGISTRY] Games not loaded, not served: " + str(failed))
+        return [hosted for hosted in self.hosted_games if hosted.is_loaded()]
+
+    def save_all(self):
+        """
+        Saves all loaded games (the shared ones are already saved with every change).
+        A game that fails to save does not stop the others.
+        """
+        for hosted in self.hosted_games:
+            if hosted.is_loaded() and not hosted.shared:
+                try:
+                    hosted.save()
+                except Exception as e:
+                    logging.exception(
+                        "[REGISTRY] Game " + hosted.config.name + " not saved: " + str(e)
+                    )
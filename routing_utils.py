@@ -0,0 +1,75 @@
+"""
+    This module contains the functions that are used to classify incoming message events before any work is done on them.
+
+    Functions:
+        - classify_message_event: Decides which route a message event should take.
+        - is_admin_command: Checks if the text is an admin (odin) command.
+"""
+from enum import Enum
+from typing import Any, Dict, List, Optional
+
+
+class EventRoute(Enum):
+    IGNORE = 1
+    ADMIN_COMMAND = 2
+    DIRECT_MESSAGE = 3
+    CHANNEL_THREAD = 4
+    CHANNEL_CHATTER = 5
+
+
+# Subtypes that are sent by users and still carry something for the bot to handle.
+# Everything else (bot_message, message_changed, message_deleted, channel_join, ...) is dropped.
+HANDLED_SUBTYPES = {"file_share", "thread_broadcast"}
+
+ADMIN_COMMAND_PREFIX = "odin"
+
+
+def is_admin_command(text: str) -> bool:
+    """
+    Checks if the text is an admin (odin) command.
+
+    Parameters:
+        - text: The text of the message.
+
+    Returns:
+        True if the first word of the text is the admin command prefix.
+    """
+    words = text.split(" ")
+    return len(words) > 0 and words[0].lower() == ADMIN_COMMAND_PREFIX
+
+
+def classify_message_event(
+    payload: Dict[str, Any],
+    admin_user_ids: List[str],
+    bot_user_id: Optional[str] = None,
+) -> EventRoute:
+    """
+    Decides which route a message event should take. Only looks at the payload, so it does not call the API.
+
+    Parameters:
+        - payload: The message event.
+        - admin_user_ids: The IDs of the admins of the game.
+        - bot_user_id: The user ID of the bot (its own messages are dropped).
+
+    Returns:
+        The route of the event.
+    """
+    if "bot_id" in payload or payload.get("subtype") not in HANDLED_SUBTYPES | {None}:
+        return EventRoute.IGNORE
+
+    user = payload.get("user")
+    channel = payload.get("channel")
+    text = payload.get("text")
+    if user is None or channel is None or text is None:
+        return EventRoute.IGNORE
+    if bot_user_id is not None and user == bot_user_id:
+        return EventRoute.IGNORE
+
+    if channel[0] == "D":
+        if user in admin_user_ids and is_admin_command(text):
+            return EventRoute.ADMIN_COMMAND
+        return EventRoute.DIRECT_MESSAGE
+
+    if "thread_ts" in payload:
+        return EventRoute.CHANNEL_THREAD
+    return EventRoute.CHANNEL_CHATTER
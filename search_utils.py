@@ -0,0 +1,228 @@
+"""
+    This module contains the search of the tasks and players for the external selects of the modals
+    (block_suggestion requests), backed by prefix indexes kept in memory and rebuilt in the background,
+    so the requests (answered within 3 seconds) only read them.
+
+    Classes:
+        - PrefixIndex: Sorted words of the entries, searched by prefix with bisect.
+        - GameSearch: The indexes of the tasks and players of a game, rebuilt when the game changes.
+"""
+import bisect
+import logging
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+from slack_sdk.web.client import WebClient
+
+import game_utils
+import slack_utils
+
+# Slack shows at most 100 options
+MAX_OPTIONS = 100
+# Slack cuts the text of an option at 75 characters
+MAX_OPTION_TEXT = 75
+
+
+def words_of(text: str) -> List[str]:
+    """
+    Returns the lowercase words of the text (the keys of the index).
+
+    Parameters:
+        - text: The text.
+    """
+    return re.findall(r"\w+", text.lower())
+
+
+class PrefixIndex:
+    """
+    This class is used to find entries by the prefix of any of their words.
+    The words are kept sorted, so a search is one bisect and a scan of the matching words.
+
+    Attributes:
+        - values: The values of the entries, in the order they were given.
+    """
+
+    def __init__(self, entries: Iterable[Tuple[str, Any]]):
+        """
+        The constructor.
+
+        Parameters:
+            - entries: The (text, value) pairs to index.
+        """
+        self.values = []
+        keys = []
+        for position, (text, value) in enumerate(entries):
+            self.values.append(value)
+            for word in set(words_of(text)):
+                keys.append((word, position))
+        keys.sort()
+        self._keys = keys
+
+    def search(self, query: str, limit: int = MAX_OPTIONS) -> List[Any]:
+        """
+        Returns the values whose words start with every word of the query, in the order of the entries.
+
+        Parameters:
+            - query: The query (all values for an empty query).
+            - limit: The maximal number of values.
+        """
+        words = words_of(query)
+        if len(words) == 0:
+            return self.values[:limit]
+        positions = None
+        for word in words:
+            found = set()
+            start = bisect.bisect_left(self._keys, (word,))
+            for key, position in self._keys[start:]:
+                if not key.startswith(word):
+                    break
+                found.add(position)
+            positions = found if positions is None else positions & found
+            if len(positions) == 0:
+                return []
+        return [self.values[position] for position in sorted(positions)[:limit]]
+
+
+class GameSearch:
+    """
+    This class is used to search the tasks and players of a game.
+    A background thread rebuilds the indexes when the number of tasks or players changed. It checks
+    the counts after every addition (request_refresh, a join listener of the game and called after new
+    tasks) and at least every max_age seconds (for additions by other worker processes), but not more
+    often than MIN_INTERVAL seconds. Only when they changed is the whole game read with source
+    (which for shared games reads the database).
+
+    Attributes:
+        - source: Returns the latest game.
+        - counts: Returns the number of the tasks that are not archived and the number of the players.
+        - client: The slack client (for the names of the players).
+        - max_age: The maximal number of seconds between two checks of the game.
+        - names: Maps the user ID to the name of the user.
+    """
+
+    # The minimal number of seconds between two downloads of the names of the users
+    NAMES_MAX_AGE = 600
+    # The minimal number of seconds between two checks of the game
+    MIN_INTERVAL = 2.0
+
+    def __init__(
+        self,
+        source: Callable[[], Any],
+        counts: Callable[[], Tuple[int, int]],
+        client: WebClient,
+        max_age: float = 30.0,
+    ):
+        """
+        The constructor.
+
+        Parameters:
+            - source: Returns the latest game.
+            - counts: Returns the number of the tasks that are not archived and the number of the players.
+            - client: The slack client (for the names of the players).
+            - max_age: The maximal number of seconds between two checks of the game.
+        """
+        self.source = source
+        self.counts = counts
+        self.client = client
+        self.max_age = max_age
+        self.names = {}
+        self._names_at = None
+        self._tasks = PrefixIndex([])
+        self._players = PrefixIndex([])
+        self._sizes = None
+        self._wake = threading.Event()
+
+    def start(self):
+        """
+        Starts the thread that builds the indexes (the first build runs at once).
+        """
+        self._wake.set()
+        threading.Thread(target=self._run, name="search", daemon=True).start()
+
+    def request_refresh(self, user_ids: List[str]):
+        """
+        Requests a check of the game after new players or tasks were added.
+
+        Parameters:
+            - user_ids: The IDs of the added players.
+        """
+        self._wake.set()
+
+    def task_options(self, query: str) -> List[Dict[str, Any]]:
+        """
+        Returns the options of the tasks matching the query (by number or words of the description).
+
+        Parameters:
+            - query: The text typed by the user.
+        """
+        return [_option(text, value) for text, value in self._tasks.search(query)]
+
+    def player_options(self, query: str) -> List[Dict[str, Any]]:
+        """
+        Returns the options of the players matching the query (by name or user ID).
+
+        Parameters:
+            - query: The text typed by the user.
+        """
+        return [_option(text, value) for text, value in self._players.search(query)]
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.max_age)
+            self._wake.clear()
+            try:
+                self._update()
+            except Exception as e:
+                logging.exception("[SEARCH] Indexing failed: " + str(e))
+            time.sleep(self.MIN_INTERVAL)
+
+    def _update(self):
+        # Reading the whole game can take seconds for big shared games, the counts do not
+        sizes = tuple(self.counts())
+        if sizes == self._sizes:
+            return
+        game = self.source()
+        with game.lock:
+            # Archived tasks are not offered (their descriptions are not in memory)
+            tasks = [
+                game.tasks[task_no]
+                for task_no in sorted(game.tasks.keys())
+                if game.tasks[task_no].state != game_utils.TaskState.ARCHIVED
+            ]
+            user_ids = list(game.players.keys())
+        if any(user_id not in self.names for user_id in user_ids):
+            self._update_names(time.monotonic())
+
+        task_entries = []
+        for task in tasks:
+            text = "#" + str(task.task_no) + " " + task.raw_description()
+            task_entries.append((str(task.task_no) + " " + text, (text, str(task.task_no))))
+        player_entries = []
+        for user_id in sorted(user_ids, key=lambda user_id: self.names.get(user_id, user_id)):
+            name = self.names.get(user_id, user_id)
+            player_entries.append((name + " " + user_id, (name, user_id)))
+        # The requests read the indexes without a lock, so they are replaced whole
+        self._tasks = PrefixIndex(task_entries)
+        self._players = PrefixIndex(player_entries)
+        self._sizes = sizes
+        logging.info(
+            "[SEARCH] Indexed " + str(len(tasks)) + " tasks and " + str(len(user_ids)) + " players."
+        )
+
+    def _update_names(self, now: float):
+        if self._names_at is not None and now - self._names_at < self.NAMES_MAX_AGE:
+            return
+        self._names_at = now
+        try:
+            self.names = slack_utils.get_user_names(self.client)
+        except Exception as e:
+            logging.warning("[SEARCH] Names of the users not loaded: " + str(e))
+
+
+def _option(text: str, value: str) -> Dict[str, Any]:
+    return {
+        "text": {"type": "plain_text", "text": text.replace("\n", " ")[:MAX_OPTION_TEXT]},
+        "value": value,
+    }
@@ -9,11 +9,25 @@
         - send_message_to_everyone_in_channel: Sends a message to everyone in a channel.
         - schedule_message_to_everyone_in_channel: Schedules a message to everyone in a channel.
         - get_parent_message: Gets the parent message of a thread.
+        - get_thread_task_no: Gets the number of the task a thread was started by.
+        - find_message_by_metadata: Finds a recent message of the bot by a value in its metadata.
+        - find_scheduled_message: Finds a scheduled message by its text and time.
+        - download_file: Downloads a file shared with the bot.
+        - upload_file: Uploads a file to a Slack channel.
+        - upload_local_file: Uploads a file from the disk to a Slack channel.
+        - delete_scheduled_message: Deletes a scheduled message.
+        - pin_message: Pins a message in its channel.
+        - find_pinned_message: Finds a pinned message of a user by the start of its text.
+        - get_user_names: Gets the names of all users of the workspace.
+        - run_concurrently: Runs many API calls at once.
 """
 
 from slack_sdk.web.client import WebClient
-from typing import List, Optional
+from typing import Any, Callable, Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
 import datetime
+import logging
+import urllib.request
 
 
 def send_message(
@@ -36,10 +50,14 @@ def send_message(
     """
     if thread_ts is None or len(thread_ts) != len(channels):
         thread_ts = [None] * len(channels)
+    responses = []
     for channel, thread in zip(channels, thread_ts):
-        client.chat_postMessage(
-            channel=channel, text=message, thread_ts=thread, metadata=metadata
+        responses.append(
+            client.chat_postMessage(
+                channel=channel, text=message, thread_ts=thread, metadata=metadata
+            )
         )
+    return responses
 
 
 def send_ephemeral_message(
@@ -108,8 +126,14 @@ def get_channel_users(channel: str, client: WebClient) -> List[str]:
     Example:
         get_channel_users("C04P6595G5S", app.client)
     """
-    payload = client.conversations_members(channel=channel)
-    return payload["members"]
+    users = []
+    cursor = None
+    while True:
+        payload = client.conversations_members(channel=channel, limit=1000, cursor=cursor)
+        users += payload["members"]
+        cursor = payload.get("response_metadata", {}).get("next_cursor")
+        if not cursor:
+            return users
 
 
 def send_message_to_everyone_in_channel(
@@ -174,6 +198,91 @@ def get_parent_message(channel: str, ts: str, client: WebClient) -> str:
     return payload["messages"][0]
 
 
+def get_thread_task_no(channel: str, ts: str, client: WebClient) -> Optional[int]:
+    """
+    Gets the number of the task a thread was started by (from the metadata of the parent message).
+    Only the parent message is fetched, instead of the whole channel history.
+
+    Parameters:
+        - channel: The channel the thread is in.
+        - ts: The timestamp of the parent message.
+
+    Returns:
+        - The number of the task or None if the thread was not started by a task.
+
+    Example:
+        get_thread_task_no("D04P6595G5S", "1624941795.000200", app.client)
+    """
+    payload = client.conversations_replies(
+        channel=channel, ts=ts, limit=1, include_all_metadata=True
+    )
+    for message in payload["messages"]:
+        if message["ts"] == ts and "metadata" in message:
+            # Other messages of the bot (like congratulations) have a non-numeric event type
+            event_type = message["metadata"]["event_type"]
+            return int(event_type) if event_type.isdigit() else None
+    return None
+
+
+def _conversation_id(channel: str, client: WebClient) -> str:
+    # Messages to a user ID go to the direct message conversation with them
+    if channel.startswith("U") or channel.startswith("W"):
+        return client.conversations_open(users=channel)["channel"]["id"]
+    return channel
+
+
+def find_message_by_metadata(
+    channel: str, key: str, value: str, client: WebClient, limit: int = 100
+) -> Optional[Dict[str, Any]]:
+    """
+    Finds a recent message of the bot by a value in its metadata.
+
+    Parameters:
+        - channel: The channel or the user ID the message was sent to.
+        - key: The key in the event payload of the metadata.
+        - value: The value of the key.
+        - limit: How many of the latest messages are searched.
+
+    Returns:
+        - The message (with "channel" set) or None if it was not found.
+
+    Example:
+        find_message_by_metadata("U03AECYM5MZ", "outbox_id", "3f2a...", app.client)
+    """
+    channel = _conversation_id(channel, client)
+    payload = client.conversations_history(
+        channel=channel, limit=limit, include_all_metadata=True
+    )
+    for message in payload["messages"]:
+        if message.get("metadata", {}).get("event_payload", {}).get(key) == value:
+            return dict(message, channel=channel)
+    return None
+
+
+def find_scheduled_message(
+    channel: str, message: str, post_at: float, client: WebClient
+) -> Optional[Dict[str, Any]]:
+    """
+    Finds a scheduled message by its text and time.
+
+    Parameters:
+        - channel: The channel or the user ID the message was scheduled to.
+        - message: The text of the message.
+        - post_at: The timestamp the message was scheduled at.
+
+    Returns:
+        - The scheduled message (with "id" and "channel_id") or None if it was not found.
+
+    Example:
+        find_scheduled_message("C04P6595G5S", "Hello!", 1624941795, app.client)
+    """
+    payload = client.chat_scheduledMessages_list(channel=_conversation_id(channel, client))
+    for scheduled in payload["scheduled_messages"]:
+        if scheduled["text"] == message and int(scheduled["post_at"]) == int(post_at):
+            return scheduled
+    return None
+
+
 def get_user_name(user_id: str, client: WebClient) -> str:
     """
     Gets the name of a user.
@@ -191,6 +300,27 @@ def get_user_name(user_id: str, client: WebClient) -> str:
     return payload["user"]["name"]
 
 
+def get_user_names(client: WebClient) -> Dict[str, str]:
+    """
+    Gets the names of all users of the workspace (one users_list call per 200 users).
+
+    Returns:
+        - The dictionary mapping the user ID to the name of the user.
+
+    Example:
+        get_user_names(app.client)
+    """
+    names = {}
+    cursor = None
+    while True:
+        payload = client.users_list(limit=200, cursor=cursor)
+        for user in payload["members"]:
+            names[user["id"]] = user["name"]
+        cursor = payload.get("response_metadata", {}).get("next_cursor")
+        if not cursor:
+            return names
+
+
 def update_message(channel: str, ts: str, message: str, client: WebClient):
     """
     Updates a message.
@@ -206,6 +336,48 @@ def update_message(channel: str, ts: str, message: str, client: WebClient):
     return client.chat_update(channel=channel, ts=ts, text=message)
 
 
+def pin_message(channel: str, ts: str, client: WebClient):
+    """
+    Pins a message in its channel.
+
+    Parameters:
+        - channel: The channel the message is in.
+        - ts: The timestamp of the message.
+
+    Example:
+        pin_message("C04P6595G5S", "1624941795.000200", app.client)
+    """
+    return client.pins_add(channel=channel, timestamp=ts)
+
+
+def find_pinned_message(
+    channel: str, user_id: str, prefix: str, client: WebClient
+) -> Optional[Dict[str, Any]]:
+    """
+    Finds a pinned message of a user (for example the bot) by the start of its text.
+
+    Parameters:
+        - channel: The channel.
+        - user_id: The ID of the user that sent the message.
+        - prefix: The start of the text of the message.
+
+    Returns:
+        - The message or None if it was not found.
+
+    Example:
+        find_pinned_message("C04P6595G5S", "U04BOT", "Tablica wyników", app.client)
+    """
+    for item in client.pins_list(channel=channel).get("items", []):
+        message = item.get("message")
+        if (
+            message is not None
+            and message.get("user") == user_id
+            and message.get("text", "").startswith(prefix)
+        ):
+            return message
+    return None
+
+
 def delete_message(channel: str, ts: str, client: WebClient):
     """
     Deletes a message.
@@ -218,3 +390,128 @@ def delete_message(channel: str, ts: str, client: WebClient):
         delete_message("C04P6595G5S", "1624941795.000200", app.client)
     """
     return client.chat_delete(channel=channel, ts=ts)
+
+
+def delete_scheduled_message(channel: str, scheduled_message_id: str, client: WebClient):
+    """
+    Deletes a scheduled message, that has not been sent yet.
+
+    Parameters:
+        - channel: The channel the message is scheduled in.
+        - scheduled_message_id: The ID of the scheduled message.
+
+    Example:
+        delete_scheduled_message("C04P6595G5S", "Q1298393284", app.client)
+    """
+    return client.chat_deleteScheduledMessage(
+        channel=channel, scheduled_message_id=scheduled_message_id
+    )
+
+
+def download_file(file: Dict[str, Any], client: WebClient) -> bytes:
+    """
+    Downloads a file shared with the bot.
+
+    Parameters:
+        - file: The file object from the message event (payload["files"][i]).
+
+    Returns:
+        - The content of the file.
+
+    Example:
+        download_file(payload["files"][0], app.client)
+    """
+    request = urllib.request.Request(
+        file["url_private_download"],
+        headers={"Authorization": "Bearer " + client.token},
+    )
+    with urllib.request.urlopen(request) as response:
+        return response.read()
+
+
+def upload_file(
+    content: str,
+    file_name: str,
+    channel: str,
+    client: WebClient,
+    thread_ts: Optional[str] = None,
+    title: Optional[str] = None,
+):
+    """
+    Uploads a file to a Slack channel.
+
+    Parameters:
+        - content: The content of the file.
+        - file_name: The name of the file.
+        - channel: The channel to upload the file to.
+        - thread_ts: The thread to upload the file to.
+        - title: The title of the file.
+
+    Example:
+        upload_file("a,b\n1,2", "plan.csv", "D04P6595G5S", app.client)
+    """
+    return client.files_upload_v2(
+        channel=channel,
+        content=content,
+        filename=file_name,
+        title=title or file_name,
+        thread_ts=thread_ts,
+    )
+
+
+def upload_local_file(
+    path: str,
+    file_name: str,
+    channel: str,
+    client: WebClient,
+    thread_ts: Optional[str] = None,
+    title: Optional[str] = None,
+):
+    """
+    Uploads a file from the disk to a Slack channel (in one files_upload_v2 call).
+
+    Parameters:
+        - path: The path of the file.
+        - file_name: The name of the file in Slack.
+        - channel: The channel to upload the file to.
+        - thread_ts: The thread to upload the file to.
+        - title: The title of the file.
+
+    Example:
+        upload_local_file("/tmp/players.csv.gz", "players.csv.gz", "D04P6595G5S", app.client)
+    """
+    return client.files_upload_v2(
+        channel=channel,
+        file=path,
+        filename=file_name,
+        title=title or file_name,
+        thread_ts=thread_ts,
+    )
+
+
+def run_concurrently(jobs: List[Callable[[], Any]], max_workers: int = 8) -> List[Any]:
+    """
+    Runs many API calls at once. A failing call is logged and does not stop the others.
+
+    Parameters:
+        - jobs: The calls to run (functions without arguments).
+        - max_workers: The maximum number of calls running at the same time.
+
+    Returns:
+        - The results of the calls, in the order of the jobs (None for the failed ones).
+
+    Example:
+        run_concurrently([lambda: send_message("Hello!", [user], app.client) for user in users])
+    """
+    if len(jobs) == 0:
+        return []
+
+    def run(job):
+        try:
+            return job()
+        except Exception as e:
+            logging.exception("[SLACK] Call failed: " + str(e))
+            return None
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(jobs))) as executor:
+        return list(executor.map(run, jobs))
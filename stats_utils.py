@@ -0,0 +1,317 @@
+"""
+    This module contains the classes that keep the statistics of the game.
+    The aggregates are updated on every answer, so reading them does not need to scan the players.
+
+    Classes:
+        - TaskStatistics: The statistics of one task.
+        - Statistics: The statistics of the whole game.
+"""
+import heapq
+import logging
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+
+class TaskStatistics:
+    """
+    This class is used to store the statistics of one task.
+
+    Attributes:
+        - task_no: The number of the task.
+        - solve_count: The number of players that have solved the task.
+        - attempt_count: The number of all answers to the task (right and wrong).
+        - attempts_to_solve: Maps the number of attempts needed to solve the task to the number of players.
+        - first_solve_at: When the task was solved for the first time (timestamp).
+        - last_solve_at: When the task was solved for the last time (timestamp).
+    """
+
+    __slots__ = (
+        "task_no",
+        "solve_count",
+        "attempt_count",
+        "attempts_to_solve",
+        "first_solve_at",
+        "last_solve_at",
+        "_lower_solve_times",
+        "_upper_solve_times",
+    )
+
+    def __init__(self, task_no: int):
+        """
+        The constructor.
+
+        Parameters:
+            - task_no: The number of the task.
+        """
+        self.task_no = task_no
+        self.solve_count = 0
+        self.attempt_count = 0
+        self.attempts_to_solve = {}
+        self.first_solve_at = None
+        self.last_solve_at = None
+        # Running median of the solve times (in seconds), max-heap of the lower half and min-heap of the upper half.
+        self._lower_solve_times = []
+        self._upper_solve_times = []
+
+    def add_solve(
+        self, attempts: int, solve_time: Optional[float], solved_at: Optional[float]
+    ):
+        """
+        Adds a solve of the task.
+
+        Parameters:
+            - attempts: The number of attempts the player needed.
+            - solve_time: The number of seconds from the release of the task to the solve (None if unknown).
+            - solved_at: When the task was solved (timestamp).
+        """
+        self.solve_count += 1
+        self.attempts_to_solve[attempts] = self.attempts_to_solve.get(attempts, 0) + 1
+        if solved_at is not None:
+            if self.first_solve_at is None or solved_at < self.first_solve_at:
+                self.first_solve_at = solved_at
+            if self.last_solve_at is None or solved_at > self.last_solve_at:
+                self.last_solve_at = solved_at
+        if solve_time is None:
+            return
+
+        if len(self._lower_solve_times) == 0 or solve_time <= -self._lower_solve_times[0]:
+            heapq.heappush(self._lower_solve_times, -solve_time)
+        else:
+            heapq.heappush(self._upper_solve_times, solve_time)
+        # Keep the lower half equal or one bigger than the upper half
+        if len(self._lower_solve_times) > len(self._upper_solve_times) + 1:
+            heapq.heappush(
+                self._upper_solve_times, -heapq.heappop(self._lower_solve_times)
+            )
+        elif len(self._upper_solve_times) > len(self._lower_solve_times):
+            heapq.heappush(
+                self._lower_solve_times, -heapq.heappop(self._upper_solve_times)
+            )
+
+    def median_solve_time(self) -> Optional[float]:
+        """
+        Returns the median number of seconds from the release of the task to the solve.
+
+        Returns:
+            The median or None if nobody has solved the task yet.
+        """
+        if len(self._lower_solve_times) == 0:
+            return None
+        if len(self._lower_solve_times) > len(self._upper_solve_times):
+            return -self._lower_solve_times[0]
+        return (-self._lower_solve_times[0] + self._upper_solve_times[0]) / 2
+
+    def __getstate__(self) -> Dict[str, Any]:
+        """
+        Returns the state to pickle.
+        """
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state: Dict[str, Any]):
+        """
+        Restores the pickled state (statistics saved before kept the solve times as datetimes).
+        """
+        for name in ("first_solve_at", "last_solve_at"):
+            if isinstance(state[name], datetime):
+                state[name] = state[name].timestamp()
+        for name in self.__slots__:
+            setattr(self, name, state[name])
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Returns the statistics as a dictionary (for the export).
+
+        Returns:
+            The statistics.
+        """
+        return {
+            "task_no": self.task_no,
+            "solve_count": self.solve_count,
+            "attempt_count": self.attempt_count,
+            "attempts_to_solve": dict(sorted(self.attempts_to_solve.items())),
+            "median_solve_time": self.median_solve_time(),
+            "first_solve_at": str(datetime.fromtimestamp(self.first_solve_at))
+            if self.first_solve_at
+            else None,
+            "last_solve_at": str(datetime.fromtimestamp(self.last_solve_at))
+            if self.last_solve_at
+            else None,
+        }
+
+
+class Statistics:
+    """
+    This class is used to store the statistics of the whole game.
+
+    Attributes:
+        - tasks: Maps the task number to its statistics.
+        - right_answers: Maps the user ID to the number of right answers.
+        - wrong_answers: Maps the user ID to the number of wrong answers.
+    """
+
+    def __init__(self):
+        """
+        The constructor.
+        """
+        self.tasks = {}
+        self.right_answers = {}
+        self.wrong_answers = {}
+
+    @staticmethod
+    def rebuild(players: Dict[str, Any], tasks: Dict[int, Any]) -> "Statistics":
+        """
+        Rebuilds the statistics from the players (for games saved before the statistics were kept).
+        Solve times are only known for the solves that have a timestamp.
+
+        Parameters:
+            - players: The players of the game.
+            - tasks: The tasks of the game.
+
+        Returns:
+            The statistics.
+        """
+        statistics = Statistics()
+        for task_no in tasks:
+            statistics.task(task_no)
+        for player in players.values():
+            for task_no, wrong in player.wrong_answers.items():
+                statistics.task(task_no).attempt_count += wrong
+                statistics.wrong_answers[player.user_id] = (
+                    statistics.wrong_answers.get(player.user_id, 0) + wrong
+                )
+            for task_no in sorted(player.completed_tasks):
+                statistics.add_solve(
+                    player, tasks.get(task_no), task_no, player.solved_at.get(task_no)
+                )
+        logging.info("[STATS] Statistics rebuilt.")
+        return statistics
+
+    def task(self, task_no: int) -> TaskStatistics:
+        """
+        Returns the statistics of the task (creates them if needed).
+
+        Parameters:
+            - task_no: The number of the task.
+
+        Returns:
+            The statistics of the task.
+        """
+        if task_no not in self.tasks:
+            self.tasks[task_no] = TaskStatistics(task_no)
+        return self.tasks[task_no]
+
+    def add_solve(
+        self, player: Any, task: Any, task_no: int, solved_at: Optional[float]
+    ):
+        """
+        Adds a right answer of the player. Call it after Player.right_answer.
+
+        Parameters:
+            - player: The player.
+            - task: The task (None if it was deleted).
+            - task_no: The number of the task.
+            - solved_at: When the task was solved (timestamp, None if unknown).
+        """
+        attempts = player.wrong_answers.get(task_no, 0) + 1
+        solve_time = None
+        release = player.released_at(task) if task is not None else None
+        if solved_at is not None and release is not None:
+            solve_time = max(solved_at - release.timestamp(), 0)
+        task_statistics = self.task(task_no)
+        task_statistics.attempt_count += 1
+        task_statistics.add_solve(attempts, solve_time, solved_at)
+        self.right_answers[player.user_id] = self.right_answers.get(player.user_id, 0) + 1
+
+    def add_wrong_answer(self, player: Any, task_no: int):
+        """
+        Adds a wrong answer of the player. Call it after Player.wrong_answer.
+
+        Parameters:
+            - player: The player.
+            - task_no: The number of the task.
+        """
+        self.task(task_no).attempt_count += 1
+        self.wrong_answers[player.user_id] = self.wrong_answers.get(player.user_id, 0) + 1
+
+    def accuracy(self, user_id: str) -> Optional[float]:
+        """
+        Returns the part of the answers of the player that were right.
+
+        Parameters:
+            - user_id: The ID of the user.
+
+        Returns:
+            The accuracy (0-1) or None if the player has not answered yet.
+        """
+        right = self.right_answers.get(user_id, 0)
+        wrong = self.wrong_answers.get(user_id, 0)
+        if right + wrong == 0:
+            return None
+        return right / (right + wrong)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Returns the statistics as a dictionary (for the export).
+
+        Returns:
+            The statistics.
+        """
+        user_ids = set(self.right_answers.keys()) | set(self.wrong_answers.keys())
+        return {
+            "tasks": [self.tasks[task_no].to_dict() for task_no in sorted(self.tasks)],
+            "players": [
+                {
+                    "user_id": user_id,
+                    "right_answers": self.right_answers.get(user_id, 0),
+                    "wrong_answers": self.wrong_answers.get(user_id, 0),
+                    "accuracy": self.accuracy(user_id),
+                }
+                for user_id in sorted(user_ids)
+            ],
+        }
+
+    def generate_view(self) -> Dict[str, Any]:
+        """
+        Generates the statistics modal.
+
+        Returns:
+            The view of the modal.
+        """
+        blocks = []
+        for task_no in sorted(self.tasks):
+            task_statistics = self.tasks[task_no]
+            median = task_statistics.median_solve_time()
+            attempts = ", ".join(
+                str(attempts) + ": " + str(count)
+                for attempts, count in sorted(task_statistics.attempts_to_solve.items())
+            )
+            blocks.append(
+                {
+                    "type": "context",
+                    "elements": [
+                        {
+                            "type": "mrkdwn",
+                            "text": "*Zadanie "
+                            + str(task_no)
+                            + "* - rozwiązane: "
+                            + str(task_statistics.solve_count)
+                            + ", odpowiedzi: "
+                            + str(task_statistics.attempt_count)
+                            + ", mediana czasu: "
+                            + (str(round(median / 60, 1)) + " min" if median is not None else "-")
+                            + "\nPróby do rozwiązania: "
+                            + (attempts if attempts != "" else "-"),
+                        }
+                    ],
+                }
+            )
+        if len(blocks) == 0:
+            blocks.append(
+                {"type": "section", "text": {"type": "mrkdwn", "text": "Brak danych"}}
+            )
+        return {
+            "type": "modal",
+            "title": {"type": "plain_text", "text": "Statystyki", "emoji": True},
+            "close": {"type": "plain_text", "text": "Zamknij", "emoji": True},
+            "blocks": blocks[:100],
+        }
@@ -0,0 +1,1097 @@
+"""
+    This module contains the storages the game can be saved to.
+
+    Classes:
+        - PickleStorage: Saves the whole game to one pickle file (on every change).
+        - SqliteStorage: Saves the game to a SQLite database (WAL mode), changing only the rows of the change.
+
+    Functions:
+        - create_storage: Creates the storage of the given kind.
+
+    Closed tasks are archived with storage.archive_tasks: their description, answers and sent messages are
+    moved to cold storage (files next to the pickle, or the rows of the database) and read only on access.
+
+    Changes of the game are made inside storage.transaction(game, user_ids, task_nos), then saved with
+    storage.record_answer or storage.record_changes, which also save the messages the change queued in
+    game.outbox, and call storage.on_commit after the save so they can be sent. A shared SqliteStorage (many worker processes using
+    one database) first reads the rows of the given players and tasks, so the change (like the standing
+    of a right answer) is made on the latest state and written atomically.
+"""
+import contextlib
+import gzip
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import game_utils
+import history_utils
+import stats_utils
+
+STORAGE_KINDS = ["pickle", "sqlite"]
+
+
+class PickleStorage:
+    """
+    This class is used to save the whole game to one pickle file.
+    Every record_* method saves the whole game, as a pickle can not be changed in place.
+    The cold data of the archived tasks is kept in one compressed JSON file per task, in the archive
+    directory next to the file, so it is not saved again with every change.
+
+    Attributes:
+        - file_name: The name of the file.
+        - archive_dir: The directory of the archived tasks.
+        - on_commit: Called after messages of the outbox were saved.
+    """
+
+    def __init__(self, file_name: str):
+        """
+        The constructor.
+
+        Parameters:
+            - file_name: The name of the file.
+        """
+        self.file_name = file_name
+        self.archive_dir = file_name + "_archive"
+        self.on_commit = None
+        # The numbers of the tasks with a file in the archive directory
+        self._archived = set()
+
+    def load(self) -> game_utils.Game:
+        """
+        Loads the game.
+
+        Returns:
+            The game.
+        """
+        game = game_utils.Game.load_from_pickle(self.file_name)
+        if os.path.isdir(self.archive_dir):
+            self._archived = {
+                int(name[len("task_") : -len(".json.gz")])
+                for name in os.listdir(self.archive_dir)
+                if name.startswith("task_") and name.endswith(".json.gz")
+            }
+        game.set_archive(self.load_archived)
+        return game
+
+    def save(self, game: game_utils.Game):
+        """
+        Saves the whole game.
+
+        Parameters:
+            - game: The game.
+        """
+        # Archived tasks of a game copied from another storage
+        for task_no, task in game.tasks.items():
+            if task.state == game_utils.TaskState.ARCHIVED and task_no not in self._archived:
+                self._write_archived(task_no, task.cold_data())
+        game.save_to_pickle(self.file_name)
+        committed = False
+        for entry in game.outbox.values():
+            if not entry["committed"]:
+                entry["committed"] = True
+                committed = True
+        if committed and self.on_commit is not None:
+            self.on_commit()
+
+    def transaction(
+        self,
+        game: game_utils.Game,
+        user_ids: Iterable[str] = (),
+        task_nos: Optional[Iterable[int]] = (),
+    ):
+        """
+        Returns the context in which the game is changed (the lock of the game).
+
+        Parameters:
+            - game: The game.
+            - user_ids: The IDs of the users that will change.
+            - task_nos: The numbers of the tasks that will change (None for all tasks).
+        """
+        return game.lock
+
+    def lease(self, name: str, seconds: float = 60.0):
+        """
+        Returns the context in which work that must not run twice is done (only one process uses the file,
+        so it holds nothing).
+
+        Parameters:
+            - name: The name of the work.
+            - seconds: How long the lease is held at most.
+        """
+        return contextlib.nullcontext()
+
+    def refresh(self, game: game_utils.Game):
+        """
+        Nothing to do, the game in memory is the only copy.
+
+        Parameters:
+            - game: The game.
+        """
+
+    def snapshot(self, game: game_utils.Game) -> game_utils.Game:
+        """
+        Returns the game (for reports of the whole game).
+
+        Parameters:
+            - game: The game.
+        """
+        return game
+
+    def counts(self, game: game_utils.Game) -> Tuple[int, int]:
+        """
+        Returns the number of the tasks that are not archived and the number of the players
+        (a cheap check whether the game has new tasks or players).
+
+        Parameters:
+            - game: The game.
+        """
+        return _counts(game)
+
+    def record_answer(
+        self, game: game_utils.Game, user_id: str, task_no: int, correct: bool
+    ):
+        """
+        Saves the game after an answer of the player.
+
+        Parameters:
+            - game: The game.
+            - user_id: The ID of the user.
+            - task_no: The number of the task.
+            - correct: Whether the answer was right.
+        """
+        self.save(game)
+
+    def record_changes(
+        self,
+        game: game_utils.Game,
+        user_ids: Iterable[str] = (),
+        task_nos: Iterable[int] = (),
+    ):
+        """
+        Saves the game after the players or tasks changed (for example a task was sent to someone).
+
+        Parameters:
+            - game: The game.
+            - user_ids: The IDs of the users that changed.
+            - task_nos: The numbers of the tasks that changed.
+        """
+        self.save(game)
+
+    def claim_outbox(self, game: game_utils.Game):
+        """
+        Nothing to do, the whole outbox is in the game.
+
+        Parameters:
+            - game: The game.
+        """
+
+    def record_delivery(self, game: game_utils.Game, delivered: list, failed: list):
+        """
+        Saves the game after messages of the outbox were sent or failed.
+
+        Parameters:
+            - game: The game.
+            - delivered: The (entry, (channel, ts)) pairs of the sent messages.
+            - failed: The entries of the messages that failed.
+        """
+        self.save(game)
+
+    def archive_tasks(self, game: game_utils.Game) -> List[int]:
+        """
+        Moves the cold data of the closed tasks without messages waiting in the outbox to the archive
+        directory, and saves the game without it.
+
+        Parameters:
+            - game: The game.
+
+        Returns:
+            The numbers of the archived tasks.
+        """
+        with game.lock:
+            task_nos = game.archivable_tasks()
+            for task_no in task_nos:
+                self._write_archived(task_no, game.tasks[task_no].cold_data())
+                game.tasks[task_no].archive(self.load_archived)
+            if len(task_nos) > 0:
+                self.save(game)
+        return task_nos
+
+    def load_archived(self, task_no: int) -> Dict[str, Any]:
+        """
+        Reads the cold data of an archived task.
+
+        Parameters:
+            - task_no: The number of the task.
+        """
+        with gzip.open(self._archive_file(task_no), "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        data["sent_messages"] = [tuple(ref) for ref in data["sent_messages"]]
+        return data
+
+    def _archive_file(self, task_no: int) -> str:
+        return os.path.join(self.archive_dir, "task_" + str(task_no) + ".json.gz")
+
+    def _write_archived(self, task_no: int, data: Dict[str, Any]):
+        # Written to a temporary file first, so a crash never leaves half of it
+        os.makedirs(self.archive_dir, exist_ok=True)
+        path = self._archive_file(task_no)
+        with gzip.open(path + ".tmp", "wt", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+        self._archived.add(task_no)
+
+
+class SqliteStorage:
+    """
+    This class is used to save the game to a SQLite database in WAL mode.
+    The game is read once when loading, later every change writes only its own rows.
+    The outbox is kept in its own table. Every process leases the messages it sends, the messages of
+    a process that stopped are taken over by another one when their lease ends.
+    The rows of the outbox are kept after sending, so they are also the ledger of the deliveries of the tasks.
+    The rows of the archived tasks are their archive: only their state is read when loading,
+    the rest is read on access.
+
+    Attributes:
+        - file_name: The name of the database file.
+        - shared: Whether other processes change the database too (worker mode).
+        - owner: The ID of this process in the leases of the outbox.
+        - on_commit: Called after messages of the outbox were saved.
+    """
+
+    # How long the messages of the outbox stay leased by a process without it renewing the lease, in seconds
+    LEASE_SECONDS = 60
+
+    # The columns of the tasks read into the game, without the cold data of the archived ones
+    TASK_COLUMNS = (
+        "task_no, points, CASE WHEN state = ? THEN NULL ELSE description END, "
+        "CASE WHEN state = ? THEN NULL ELSE correct_answers END, needed_task, is_dm, channel, "
+        "date_and_time, do_letters_case_matter, solved_by, near_miss_distance, state"
+    )
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS players (
+            user_id TEXT PRIMARY KEY,
+            points INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS tasks (
+            task_no INTEGER PRIMARY KEY,
+            points INTEGER NOT NULL,
+            description TEXT NOT NULL,
+            correct_answers TEXT NOT NULL,
+            needed_task INTEGER,
+            is_dm INTEGER NOT NULL,
+            channel TEXT,
+            date_and_time REAL,
+            do_letters_case_matter INTEGER NOT NULL,
+            solved_by INTEGER NOT NULL,
+            near_miss_distance INTEGER NOT NULL DEFAULT 0,
+            state TEXT NOT NULL DEFAULT 'scheduled'
+        );
+        CREATE TABLE IF NOT EXISTS completions (
+            user_id TEXT NOT NULL,
+            task_no INTEGER NOT NULL,
+            standing INTEGER NOT NULL,
+            ts REAL,
+            PRIMARY KEY (user_id, task_no)
+        );
+        CREATE INDEX IF NOT EXISTS completions_task_no ON completions (task_no);
+        CREATE TABLE IF NOT EXISTS attempts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            task_no INTEGER NOT NULL,
+            ts REAL,
+            correct INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS attempts_user_id ON attempts (user_id);
+        CREATE INDEX IF NOT EXISTS attempts_task_no ON attempts (task_no);
+        CREATE TABLE IF NOT EXISTS sent_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            task_no INTEGER NOT NULL,
+            channel TEXT NOT NULL,
+            ts TEXT NOT NULL,
+            UNIQUE (task_no, channel, ts)
+        );
+        CREATE INDEX IF NOT EXISTS sent_messages_channel_ts ON sent_messages (channel, ts);
+        CREATE TABLE IF NOT EXISTS outbox (
+            id TEXT PRIMARY KEY,
+            channel TEXT NOT NULL,
+            text TEXT NOT NULL,
+            task_no INTEGER,
+            post_at REAL,
+            created_at REAL NOT NULL,
+            attempts INTEGER NOT NULL,
+            next_try REAL NOT NULL,
+            failed INTEGER NOT NULL,
+            owner TEXT,
+            lease_until REAL,
+            delivered_at REAL,
+            sent_channel TEXT,
+            sent_ts TEXT
+        );
+        CREATE INDEX IF NOT EXISTS outbox_pending ON outbox (delivered_at, failed, lease_until);
+        CREATE INDEX IF NOT EXISTS outbox_recipient ON outbox (channel, task_no);
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            lease_until REAL NOT NULL
+        );
+    """
+
+    def __init__(self, file_name: str, shared: bool = False):
+        """
+        The constructor.
+
+        Parameters:
+            - file_name: The name of the database file.
+            - shared: Whether other processes change the database too (worker mode).
+        """
+        self.file_name = file_name
+        self.shared = shared
+        self.owner = uuid.uuid4().hex
+        self.on_commit = None
+        self._lock = threading.RLock()
+        # The sent messages list of every task and how much of it is already in the database
+        self._saved_messages = {}
+        # The entries of the outbox saved in the current transaction
+        self._committing = []
+        # Transactions are started explicitly (BEGIN IMMEDIATE), waiting up to 30 s for other processes
+        self._connection = sqlite3.connect(
+            file_name, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        had_outbox = (
+            self._connection.execute(
+                "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'outbox'"
+            ).fetchone()[0]
+            > 0
+        )
+        self._connection.executescript(self.SCHEMA)
+        self._migrate_sent_messages()
+        # Databases created before the columns were added
+        columns = [row[1] for row in self._connection.execute("PRAGMA table_info(tasks)")]
+        for column, definition in (
+            ("near_miss_distance", "INTEGER NOT NULL DEFAULT 0"),
+            ("state", "TEXT NOT NULL DEFAULT 'scheduled'"),
+        ):
+            if column not in columns:
+                self._connection.execute("ALTER TABLE tasks ADD COLUMN " + column + " " + definition)
+        if not had_outbox:
+            self._seed_deliveries()
+
+    def _migrate_sent_messages(self):
+        # Databases created before the sent messages got their own IDs (kept by position in their task).
+        # Checked again inside the transaction, as another worker may have rebuilt the table meanwhile.
+        columns = [row[1] for row in self._connection.execute("PRAGMA table_info(sent_messages)")]
+        if "id" in columns:
+            return
+        self._connection.execute("BEGIN IMMEDIATE")
+        try:
+            columns = [
+                row[1] for row in self._connection.execute("PRAGMA table_info(sent_messages)")
+            ]
+            if "id" not in columns:
+                self._connection.execute("DROP INDEX IF EXISTS sent_messages_channel_ts")
+                self._connection.execute("ALTER TABLE sent_messages RENAME TO sent_messages_old")
+                self._connection.execute(
+                    "CREATE TABLE sent_messages (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                    "task_no INTEGER NOT NULL, channel TEXT NOT NULL, ts TEXT NOT NULL, "
+                    "UNIQUE (task_no, channel, ts))"
+                )
+                self._connection.execute(
+                    "INSERT OR IGNORE INTO sent_messages (task_no, channel, ts) "
+                    "SELECT task_no, channel, ts FROM sent_messages_old ORDER BY task_no, position"
+                )
+                self._connection.execute("DROP TABLE sent_messages_old")
+                self._connection.execute(
+                    "CREATE INDEX sent_messages_channel_ts ON sent_messages (channel, ts)"
+                )
+                logging.info("Table sent_messages of " + self.file_name + " rebuilt.")
+        except BaseException:
+            self._connection.execute("ROLLBACK")
+            raise
+        self._connection.execute("COMMIT")
+
+    def _seed_deliveries(self):
+        # Databases created before the outbox (the ledger of the deliveries) delivered every task without
+        # a needed task to every player (or its channel), and every unlocked task to the players that solved
+        # the needed one. Those deliveries are added to the outbox as sent, so they are not sent again.
+        now = time.time()
+        with self._write():
+            self._connection.execute(
+                "INSERT OR IGNORE INTO outbox (id, channel, text, task_no, post_at, created_at, attempts, "
+                "next_try, failed, owner, lease_until, delivered_at) "
+                "SELECT 'seed-' || task_no || '-' || recipient, recipient, '', task_no, NULL, ?, 0, ?, 0, "
+                "NULL, NULL, ? FROM ("
+                "SELECT tasks.task_no, players.user_id AS recipient FROM tasks, players "
+                "WHERE tasks.needed_task IS NULL AND tasks.is_dm = 1 "
+                "UNION SELECT task_no, channel FROM tasks "
+                "WHERE needed_task IS NULL AND is_dm = 0 AND channel IS NOT NULL "
+                "UNION SELECT tasks.task_no, completions.user_id FROM tasks "
+                "JOIN completions ON completions.task_no = tasks.needed_task)",
+                (now, now, now),
+            )
+
+    def close(self):
+        """
+        Closes the database.
+        """
+        with self._lock:
+            self._connection.close()
+
+    def load(self) -> game_utils.Game:
+        """
+        Loads the game. Statistics and the leaderboard history are rebuilt from the completions and attempts.
+
+        Returns:
+            The game.
+        """
+        logging.info("Game loading from database: " + self.file_name)
+        game = self._read_game()
+        self._saved_messages = {
+            task_no: (id(task.sent_messages), len(task.sent_messages))
+            for task_no, task in game.tasks.items()
+            if task.state != game_utils.TaskState.ARCHIVED
+        }
+        return game
+
+    def save(self, game: game_utils.Game):
+        """
+        Saves the whole game (to copy it to a new database), in one transaction.
+
+        Parameters:
+            - game: The game.
+        """
+        with self._write():
+            saved_wrong = {
+                (user_id, task_no): wrong
+                for user_id, task_no, wrong in self._connection.execute(
+                    "SELECT user_id, task_no, COUNT(*) FROM attempts WHERE correct = 0 GROUP BY user_id, task_no"
+                )
+            }
+            for task in game.tasks.values():
+                self._upsert_task(task)
+                self._connection.execute(
+                    "UPDATE tasks SET solved_by = ? WHERE task_no = ?",
+                    (task.solved_by, task.task_no),
+                )
+            for player in game.players.values():
+                self._upsert_player(player, player.standings.keys())
+                # Wrong answers not in the database yet (a game copied from a pickle)
+                for task_no, wrong in player.wrong_answers.items():
+                    missing = wrong - saved_wrong.get((player.user_id, task_no), 0)
+                    self._connection.executemany(
+                        "INSERT INTO attempts (user_id, task_no, ts, correct) VALUES (?, ?, ?, 0)",
+                        [(player.user_id, task_no, player.last_attempt_at.get(task_no))]
+                        * max(missing, 0),
+                    )
+            self._save_outbox(game, list(game.outbox.values()))
+        logging.info("Game saved to database: " + self.file_name)
+
+    @contextlib.contextmanager
+    def transaction(
+        self,
+        game: game_utils.Game,
+        user_ids: Iterable[str] = (),
+        task_nos: Optional[Iterable[int]] = (),
+    ):
+        """
+        Returns the context in which the game is changed: the lock of the game and a write transaction.
+        A shared storage first reads the rows of the players and the tasks, as other processes may have changed them.
+
+        Parameters:
+            - game: The game.
+            - user_ids: The IDs of the users that will change.
+            - task_nos: The numbers of the tasks that will change (None for all tasks).
+        """
+        with game.lock, self._write():
+            if self.shared:
+                self._read_tasks(game, task_nos)
+                for user_id in user_ids:
+                    self._read_player(game, user_id)
+            yield
+
+    @contextlib.contextmanager
+    def lease(self, name: str, seconds: float = 60.0):
+        """
+        Returns the context in which work that must not run twice is done by one process at a time
+        (posting the scoreboard), without holding the write lock of the database during it.
+        The lease is a row taken in a short transaction, another process waits until it is released
+        or ends after the given number of seconds.
+
+        Parameters:
+            - name: The name of the work.
+            - seconds: How long the lease is held at most.
+        """
+        while True:
+            now = time.time()
+            with self._write():
+                taken = self._connection.execute(
+                    "INSERT INTO leases VALUES (?, ?, ?) ON CONFLICT (name) DO UPDATE SET "
+                    "owner = excluded.owner, lease_until = excluded.lease_until "
+                    "WHERE leases.lease_until < ? OR leases.owner = ?",
+                    (name, self.owner, now + seconds, now, self.owner),
+                ).rowcount
+            if taken > 0:
+                break
+            time.sleep(0.5)
+        try:
+            yield
+        finally:
+            with self._write():
+                self._connection.execute(
+                    "DELETE FROM leases WHERE name = ? AND owner = ?", (name, self.owner)
+                )
+
+    def refresh(self, game: game_utils.Game):
+        """
+        Reads the points of all players, if other processes may have changed them (for the leaderboards).
+
+        Parameters:
+            - game: The game.
+        """
+        if not self.shared:
+            return
+        with game.lock, self._lock:
+            for user_id, points in self._connection.execute(
+                "SELECT user_id, points FROM players"
+            ):
+                if user_id not in game.players:
+                    game.players[user_id] = _new_player(user_id)
+                game.players[user_id].points = points
+
+    def snapshot(self, game: game_utils.Game) -> game_utils.Game:
+        """
+        Returns the latest whole game (for reports of the whole game): the game itself,
+        or a new copy read from the database if other processes may have changed it.
+
+        Parameters:
+            - game: The game.
+        """
+        if not self.shared:
+            return game
+        return self._read_game()
+
+    def counts(self, game: game_utils.Game) -> Tuple[int, int]:
+        """
+        Returns the number of the tasks that are not archived and the number of the players,
+        counted in the database if other processes may have added some.
+
+        Parameters:
+            - game: The game.
+        """
+        if not self.shared:
+            return _counts(game)
+        with self._lock:
+            tasks = self._connection.execute(
+                "SELECT COUNT(*) FROM tasks WHERE state != ?",
+                (game_utils.TaskState.ARCHIVED.value,),
+            ).fetchone()[0]
+            players = self._connection.execute("SELECT COUNT(*) FROM players").fetchone()[0]
+        return tasks, players
+
+    def attempt_times(self, user_id: str, task_no: int, since: float) -> List[float]:
+        """
+        Returns the times of the saved answers of the player to the task (of all processes),
+        for the limit of the answers.
+
+        Parameters:
+            - user_id: The ID of the user.
+            - task_no: The number of the task.
+            - since: The time (time.time()) from which the answers are returned.
+        """
+        with self._lock:
+            return [
+                ts
+                for (ts,) in self._connection.execute(
+                    "SELECT ts FROM attempts WHERE user_id = ? AND task_no = ? AND ts > ? ORDER BY ts",
+                    (user_id, task_no, since),
+                )
+            ]
+
+    def record_answer(
+        self, game: game_utils.Game, user_id: str, task_no: int, correct: bool
+    ):
+        """
+        Saves an answer of the player: the attempt and, if it was right, the completion and new points.
+
+        Parameters:
+            - game: The game.
+            - user_id: The ID of the user.
+            - task_no: The number of the task.
+            - correct: Whether the answer was right.
+        """
+        player = game.players[user_id]
+        with self._write():
+            self._connection.execute(
+                "INSERT INTO attempts (user_id, task_no, ts, correct) VALUES (?, ?, ?, ?)",
+                (
+                    user_id,
+                    task_no,
+                    player.last_attempt_at.get(task_no, time.time()),
+                    int(correct),
+                ),
+            )
+            if correct:
+                self._upsert_player(player, [task_no])
+                self._connection.execute(
+                    "UPDATE tasks SET solved_by = ? WHERE task_no = ?",
+                    (game.tasks[task_no].solved_by, task_no),
+                )
+            self._save_outbox(game)
+
+    def record_changes(
+        self,
+        game: game_utils.Game,
+        user_ids: Iterable[str] = (),
+        task_nos: Iterable[int] = (),
+    ):
+        """
+        Saves the players (with their completions) and the tasks (with their messages sent since the last save).
+
+        Parameters:
+            - game: The game.
+            - user_ids: The IDs of the users that changed.
+            - task_nos: The numbers of the tasks that changed.
+        """
+        with self._write():
+            for user_id in user_ids:
+                player = game.players[user_id]
+                self._upsert_player(player, player.standings.keys())
+            for task_no in task_nos:
+                self._upsert_task(game.tasks[task_no])
+                self._connection.execute(
+                    "UPDATE tasks SET solved_by = ? WHERE task_no = ?",
+                    (game.tasks[task_no].solved_by, task_no),
+                )
+            self._save_outbox(game)
+
+    def claim_outbox(self, game: game_utils.Game):
+        """
+        Renews the lease of the messages of this process, takes over the messages whose lease ended
+        (all pending messages if the storage is not shared) and adds them to the outbox of the game.
+
+        Parameters:
+            - game: The game.
+        """
+        now = time.time()
+        with game.lock, self._write():
+            self._connection.execute(
+                "UPDATE outbox SET owner = ?, lease_until = ? WHERE delivered_at IS NULL AND failed = 0 "
+                "AND (? OR owner = ? OR lease_until < ?)",
+                (self.owner, now + self.LEASE_SECONDS, int(not self.shared), self.owner, now),
+            )
+            for row in self._connection.execute(
+                "SELECT id, channel, text, task_no, post_at, created_at, attempts, next_try FROM outbox "
+                "WHERE owner = ? AND delivered_at IS NULL AND failed = 0",
+                (self.owner,),
+            ).fetchall():
+                if row[0] in game.outbox:
+                    continue
+                game.outbox[row[0]] = {
+                    "id": row[0],
+                    "channel": row[1],
+                    "text": row[2],
+                    "task_no": row[3],
+                    "post_at": row[4],
+                    "created_at": row[5],
+                    "attempts": row[6],
+                    "next_try": row[7],
+                    "committed": True,
+                    "recovered": True,
+                    "failed": False,
+                }
+
+    def record_delivery(self, game: game_utils.Game, delivered: list, failed: list):
+        """
+        Saves the sent messages (kept in the outbox table as the record of the delivery and added to
+        the sent messages of their tasks) and the attempts of the failed ones.
+
+        Parameters:
+            - game: The game.
+            - delivered: The (entry, (channel, ts)) pairs of the sent messages.
+            - failed: The entries of the messages that failed.
+        """
+        now = time.time()
+        with self._write():
+            self._connection.executemany(
+                "UPDATE outbox SET delivered_at = ?, sent_channel = ?, sent_ts = ? WHERE id = ?",
+                [(now, ref[0], ref[1], entry["id"]) for entry, ref in delivered],
+            )
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO sent_messages (task_no, channel, ts) VALUES (?, ?, ?)",
+                [
+                    (entry["task_no"], ref[0], ref[1])
+                    for entry, ref in delivered
+                    if entry["task_no"] is not None
+                ],
+            )
+            self._connection.executemany(
+                "UPDATE outbox SET attempts = ?, next_try = ?, failed = ? WHERE id = ?",
+                [
+                    (entry["attempts"], entry["next_try"], int(entry["failed"]), entry["id"])
+                    for entry in failed
+                ],
+            )
+            self._save_outbox(game)
+
+    def archive_tasks(self, game: game_utils.Game) -> List[int]:
+        """
+        Archives the closed tasks without messages waiting in the outbox (of any process).
+        Their rows stay in the database as their archive, only the game drops their cold data from memory.
+
+        Parameters:
+            - game: The game.
+
+        Returns:
+            The numbers of the archived tasks.
+        """
+        with self.transaction(game, (), None):
+            closed = {
+                row[0]
+                for row in self._connection.execute(
+                    "SELECT task_no FROM tasks WHERE state = ? AND task_no NOT IN "
+                    "(SELECT task_no FROM outbox WHERE task_no IS NOT NULL "
+                    "AND delivered_at IS NULL AND failed = 0)",
+                    (game_utils.TaskState.CLOSED.value,),
+                )
+            }
+            task_nos = [task_no for task_no in game.archivable_tasks() if task_no in closed]
+            self._connection.executemany(
+                "UPDATE tasks SET state = ? WHERE task_no = ?",
+                [(game_utils.TaskState.ARCHIVED.value, task_no) for task_no in task_nos],
+            )
+            for task_no in task_nos:
+                game.tasks[task_no].archive(self.load_archived)
+                self._saved_messages.pop(task_no, None)
+        return task_nos
+
+    def load_archived(self, task_no: int) -> Dict[str, Any]:
+        """
+        Reads the cold data of an archived task.
+
+        Parameters:
+            - task_no: The number of the task.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT description, correct_answers FROM tasks WHERE task_no = ?", (task_no,)
+            ).fetchone()
+            if row is None:
+                raise ValueError("Task " + str(task_no) + " is not in the database")
+            sent_messages = self._connection.execute(
+                "SELECT channel, ts FROM sent_messages WHERE task_no = ? ORDER BY id", (task_no,)
+            ).fetchall()
+        return {
+            "description": row[0],
+            "correct_answers": json.loads(row[1]),
+            "sent_messages": [tuple(ref) for ref in sent_messages],
+        }
+
+    @contextlib.contextmanager
+    def _write(self):
+        # Nested writes join the transaction of the outer one
+        with self._lock:
+            if self._connection.in_transaction:
+                yield
+                return
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                self._committing = []
+                raise
+            self._connection.execute("COMMIT")
+            committing, self._committing = self._committing, []
+        # The messages can be sent only now, when the change that queued them is saved
+        for entry in committing:
+            entry["committed"] = True
+        if len(committing) > 0 and self.on_commit is not None:
+            self.on_commit()
+
+    def _save_outbox(self, game: game_utils.Game, entries: Optional[list] = None):
+        if entries is None:
+            entries = [entry for entry in game.outbox.values() if not entry["committed"]]
+        lease_until = time.time() + self.LEASE_SECONDS
+        self._connection.executemany(
+            "INSERT OR IGNORE INTO outbox (id, channel, text, task_no, post_at, created_at, attempts, "
+            "next_try, failed, owner, lease_until) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    entry["id"],
+                    entry["channel"],
+                    entry["text"],
+                    entry["task_no"],
+                    entry["post_at"],
+                    entry["created_at"],
+                    entry["attempts"],
+                    entry["next_try"],
+                    int(entry["failed"]),
+                    self.owner,
+                    lease_until,
+                )
+                for entry in entries
+            ],
+        )
+        committing = {entry["id"] for entry in self._committing}
+        self._committing += [
+            entry for entry in entries if not entry["committed"] and entry["id"] not in committing
+        ]
+
+    def _read_game(self) -> game_utils.Game:
+        game = game_utils.Game()
+        with self._lock:
+            cursor = self._connection.cursor()
+            self._read_tasks(game, None)
+            self._read_deliveries(game, "")
+            for task_no, channel, ts in cursor.execute(
+                "SELECT task_no, channel, ts FROM sent_messages WHERE task_no NOT IN "
+                "(SELECT task_no FROM tasks WHERE state = ?) ORDER BY id",
+                (game_utils.TaskState.ARCHIVED.value,),
+            ):
+                if task_no in game.tasks:
+                    game.tasks[task_no].sent_messages.append((channel, ts))
+
+            for user_id, points in cursor.execute("SELECT user_id, points FROM players"):
+                game.players[user_id] = _new_player(user_id)
+                game.players[user_id].points = points
+
+            history = history_utils.LeaderboardHistory()
+            # The points of the players so far, history.current() copies the whole leaderboard
+            running = {}
+            for user_id, task_no, standing, ts in cursor.execute(
+                "SELECT user_id, task_no, standing, ts FROM completions ORDER BY ts"
+            ):
+                player = game.players.get(user_id)
+                if player is None:
+                    continue
+                player.standings[task_no] = standing
+                if ts is not None:
+                    player.solved_at[task_no] = ts
+                    task = game.tasks.get(task_no)
+                    if task is not None:
+                        running[user_id] = running.get(user_id, 0) + int(task.points)
+                        history.record({user_id: running[user_id]}, ts)
+            for user_id, task_no, wrong, last_attempt in cursor.execute(
+                "SELECT user_id, task_no, SUM(1 - correct), MAX(ts) FROM attempts GROUP BY user_id, task_no"
+            ):
+                player = game.players.get(user_id)
+                if player is None:
+                    continue
+                if wrong > 0:
+                    player.wrong_answers[task_no] = wrong
+                if last_attempt is not None:
+                    player.last_attempt_at[task_no] = last_attempt
+
+        game.statistics = stats_utils.Statistics.rebuild(game.players, game.tasks)
+        game.history = history
+        game.set_archive(self.load_archived)
+        return game
+
+    def _read_tasks(self, game: game_utils.Game, task_nos: Optional[Iterable[int]]):
+        if task_nos is None:
+            rows = self._connection.execute(
+                "SELECT " + self.TASK_COLUMNS + " FROM tasks ORDER BY task_no",
+                (game_utils.TaskState.ARCHIVED.value,) * 2,
+            ).fetchall()
+        else:
+            # With the tasks unlocked by them
+            rows = []
+            for task_no in task_nos:
+                rows += self._connection.execute(
+                    "SELECT " + self.TASK_COLUMNS + " FROM tasks WHERE task_no = ? OR needed_task = ?",
+                    (game_utils.TaskState.ARCHIVED.value,) * 2 + (task_no, task_no),
+                ).fetchall()
+        for row in rows:
+            task = game.tasks.get(row[0])
+            if task is None:
+                task = game_utils.Task.__new__(game_utils.Task)
+                task.__setstate__({"sent_messages": []})
+                game.tasks[row[0]] = task
+            task.task_no = row[0]
+            task.points = row[1]
+            task.needed_task = row[4]
+            task.is_dm = bool(row[5])
+            task.channel = row[6]
+            task.date_and_time = datetime.fromtimestamp(row[7]) if row[7] is not None else None
+            task.do_letters_case_matter = bool(row[8])
+            task.solved_by = row[9]
+            task.near_miss_distance = row[10]
+            if row[11] == game_utils.TaskState.ARCHIVED.value:
+                if task.state != game_utils.TaskState.ARCHIVED:
+                    task.archive(self.load_archived)
+            else:
+                task.description = row[2]
+                task.correct_answers = json.loads(row[3])
+                task.state = game_utils.TaskState(row[11])
+            if task.needed_task is not None:
+                game.needed_task[task.needed_task] = task.task_no
+        if task_nos is None:
+            # The deliveries to the channels (the ones to the players are read with the players)
+            self._read_deliveries(game, "AND channel NOT IN (SELECT user_id FROM players)")
+
+    def _read_deliveries(self, game: game_utils.Game, condition: str, parameters: tuple = ()):
+        for task_no, channel, sent_channel, sent_ts in self._connection.execute(
+            "SELECT task_no, channel, sent_channel, sent_ts FROM outbox "
+            "WHERE task_no IS NOT NULL AND failed = 0 " + condition,
+            parameters,
+        ).fetchall():
+            game.deliveries.mark(
+                task_no, channel, (sent_channel, sent_ts) if sent_ts is not None else None
+            )
+
+    def _read_player(self, game: game_utils.Game, user_id: str):
+        self._read_deliveries(game, "AND channel = ?", (user_id,))
+        row = self._connection.execute(
+            "SELECT points FROM players WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        if row is None:
+            return
+        player = _new_player(user_id)
+        player.points = row[0]
+        for task_no, standing, ts in self._connection.execute(
+            "SELECT task_no, standing, ts FROM completions WHERE user_id = ?", (user_id,)
+        ):
+            player.standings[task_no] = standing
+            if ts is not None:
+                player.solved_at[task_no] = ts
+        for task_no, wrong, last_attempt in self._connection.execute(
+            "SELECT task_no, SUM(1 - correct), MAX(ts) FROM attempts WHERE user_id = ? GROUP BY task_no",
+            (user_id,),
+        ):
+            if wrong > 0:
+                player.wrong_answers[task_no] = wrong
+            if last_attempt is not None:
+                player.last_attempt_at[task_no] = last_attempt
+        game.players[user_id] = player
+
+    def _upsert_player(self, player: game_utils.Player, task_nos: Iterable[int]):
+        self._connection.execute(
+            "INSERT INTO players VALUES (?, ?) ON CONFLICT (user_id) DO UPDATE SET points = excluded.points",
+            (player.user_id, player.points),
+        )
+        self._connection.executemany(
+            "INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?)",
+            [
+                (player.user_id, task_no, player.standings[task_no], player.solved_at.get(task_no))
+                for task_no in task_nos
+            ],
+        )
+
+    def _upsert_task(self, task: game_utils.Task):
+        archived = task.state == game_utils.TaskState.ARCHIVED
+        if archived:
+            # The row is the archive of the task, unless the game is copied to a new database
+            if self._connection.execute(
+                "UPDATE tasks SET state = ? WHERE task_no = ?", (task.state.value, task.task_no)
+            ).rowcount > 0:
+                return
+        # solved_by is only written with the answers, so a stale copy of the task can not lower it
+        self._connection.execute(
+            "INSERT INTO tasks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (task_no) DO UPDATE SET "
+            "points = excluded.points, description = excluded.description, "
+            "correct_answers = excluded.correct_answers, needed_task = excluded.needed_task, "
+            "is_dm = excluded.is_dm, channel = excluded.channel, date_and_time = excluded.date_and_time, "
+            "do_letters_case_matter = excluded.do_letters_case_matter, "
+            "near_miss_distance = excluded.near_miss_distance, state = excluded.state",
+            (
+                task.task_no,
+                int(task.points),
+                task.description,
+                json.dumps(task.correct_answers or [], ensure_ascii=False),
+                task.needed_task,
+                int(task.is_dm),
+                task.channel,
+                task.date_and_time.timestamp() if task.date_and_time is not None else None,
+                int(task.do_letters_case_matter),
+                task.solved_by,
+                task.near_miss_distance,
+                task.state.value,
+            ),
+        )
+        if archived:
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO sent_messages (task_no, channel, ts) VALUES (?, ?, ?)",
+                [(task.task_no, channel, ts) for channel, ts in task.sent_messages],
+            )
+            return
+        # Sent messages are only appended, unless the task was scheduled again (a new list)
+        saved_list, saved = self._saved_messages.get(task.task_no, (None, 0))
+        if saved_list is not None and saved_list != id(task.sent_messages):
+            self._connection.execute(
+                "DELETE FROM sent_messages WHERE task_no = ?", (task.task_no,)
+            )
+            saved = 0
+        self._connection.executemany(
+            "INSERT OR IGNORE INTO sent_messages (task_no, channel, ts) VALUES (?, ?, ?)",
+            [(task.task_no, channel, ts) for channel, ts in task.sent_messages[saved:]],
+        )
+        self._saved_messages[task.task_no] = (id(task.sent_messages), len(task.sent_messages))
+
+
+def _new_player(user_id: str) -> game_utils.Player:
+    player = game_utils.Player.__new__(game_utils.Player)
+    player.__setstate__(
+        {
+            "user_id": user_id,
+            "points": 0,
+            "standings": {},
+            "wrong_answers": {},
+            "solved_at": {},
+            "last_attempt_at": {},
+        }
+    )
+    return player
+
+
+def _counts(game: game_utils.Game) -> Tuple[int, int]:
+    with game.lock:
+        tasks = sum(
+            1 for task in game.tasks.values() if task.state != game_utils.TaskState.ARCHIVED
+        )
+        return tasks, len(game.players)
+
+
+def create_storage(kind: Optional[str], file_name: str, shared: bool = False):
+    """
+    Creates the storage of the given kind.
+
+    Parameters:
+        - kind: The kind of the storage (one of STORAGE_KINDS, pickle by default).
+        - file_name: The file of the storage.
+        - shared: Whether other processes use the storage too (only the sqlite storage can be shared).
+
+    Returns:
+        The storage.
+    """
+    if kind is None or kind == "pickle":
+        if shared:
+            raise ValueError("The pickle storage can not be shared by many processes, use sqlite")
+        return PickleStorage(file_name)
+    elif kind == "sqlite":
+        return SqliteStorage(file_name, shared)
+    raise ValueError("Unknown storage '" + kind + "', use one of " + str(STORAGE_KINDS))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Copy the game from one storage to another.")
+    parser.add_argument("source")
+    parser.add_argument("target")
+    parser.add_argument("--source-storage", choices=STORAGE_KINDS, default="pickle")
+    parser.add_argument("--target-storage", choices=STORAGE_KINDS, default="sqlite")
+    args = parser.parse_args()
+
+    game = create_storage(args.source_storage, args.source).load()
+    create_storage(args.target_storage, args.target).save(game)
+    print(
+        "Copied " + str(len(game.tasks)) + " tasks and " + str(len(game.players)) + " players."
+    )
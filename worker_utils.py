@@ -0,0 +1,165 @@
+"""
+    This module contains the routing of the socket mode envelopes to the worker processes.
+    Only the main process holds the socket connection. It forwards every envelope to the worker of its user
+    (hash(user ID) % workers), so the events of one user are handled by one process in the order they came.
+    The worker dispatches the envelope to its bolt app and sends the response back, and the main process
+    acknowledges the envelope with it (the options of the selects and the errors of the modals are in it).
+
+    Functions:
+        - envelope_user: Returns the ID of the user of an envelope.
+
+    Classes:
+        - EnvelopeRouter: Holds the socket connection and forwards the envelopes to the workers.
+        - EnvelopeWorker: Dispatches the forwarded envelopes to the bolt app of a worker process.
+"""
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from slack_bolt import App
+from slack_bolt.adapter.socket_mode.internals import send_response
+from slack_bolt.request import BoltRequest
+from slack_bolt.response import BoltResponse
+from slack_sdk.socket_mode import SocketModeClient
+from slack_sdk.socket_mode.request import SocketModeRequest
+
+
+def envelope_user(payload: Dict[str, Any]) -> Optional[str]:
+    """
+    Returns the ID of the user of an envelope: of the event (events), of the action (interactivity)
+    or of the command (slash commands).
+
+    Parameters:
+        - payload: The payload of the envelope.
+
+    Returns:
+        The ID of the user or None (for example for channel events).
+    """
+    event = payload.get("event")
+    user = event.get("user") if isinstance(event, dict) else payload.get("user")
+    if isinstance(user, dict):
+        user = user.get("id")
+    if user is None:
+        user = payload.get("user_id")
+    return user
+
+
+class EnvelopeRouter:
+    """
+    This class is used to receive the envelopes in the main process and forward them to the workers.
+    Envelopes without a user go to the first worker.
+
+    Attributes:
+        - client: The socket mode client.
+        - inboxes: The queues of the envelopes of the workers.
+        - responses: The queue of the responses of all workers.
+        - forwarded: The number of envelopes forwarded to every worker.
+    """
+
+    def __init__(self, app_token: str, inboxes: List[Any], responses: Any):
+        """
+        The constructor.
+
+        Parameters:
+            - app_token: The app-level token (xapp).
+            - inboxes: The queues of the envelopes of the workers (multiprocessing.Queue).
+            - responses: The queue of the responses of all workers (multiprocessing.Queue).
+        """
+        # One thread takes the envelopes, so they are forwarded in the order they came
+        self.client = SocketModeClient(app_token=app_token, concurrency=1)
+        self.client.socket_mode_request_listeners.append(self._forward)
+        self.inboxes = inboxes
+        self.responses = responses
+        self.forwarded = [0] * len(inboxes)
+        # Maps the ID of the envelope to the request and when it came, until the worker responds
+        self._requests = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Starts the thread that sends the responses of the workers and connects.
+        """
+        threading.Thread(target=self._respond, name="router_responses", daemon=True).start()
+        self.client.connect()
+
+    def worker_of(self, payload: Dict[str, Any]) -> int:
+        """
+        Returns the number of the worker of the envelope.
+
+        Parameters:
+            - payload: The payload of the envelope.
+        """
+        user_id = envelope_user(payload)
+        if user_id is None:
+            return 0
+        return hash(user_id) % len(self.inboxes)
+
+    def _forward(self, client: SocketModeClient, request: SocketModeRequest):
+        worker = self.worker_of(request.payload)
+        with self._lock:
+            self._requests[request.envelope_id] = (request, time.time())
+            self.forwarded[worker] += 1
+        self.inboxes[worker].put((request.envelope_id, request.payload))
+
+    def _respond(self):
+        while True:
+            envelope_id, status, body, headers = self.responses.get()
+            with self._lock:
+                request, start = self._requests.pop(envelope_id, (None, None))
+            if request is None:
+                continue
+            try:
+                send_response(
+                    self.client,
+                    request,
+                    BoltResponse(status=status, body=body, headers=headers),
+                    start,
+                )
+            except Exception as e:
+                logging.exception("[ROUTER] Response not sent: " + str(e))
+
+
+class EnvelopeWorker:
+    """
+    This class is used to dispatch the envelopes forwarded to a worker process to its bolt app.
+    One thread dispatches them one by one, so the listeners queue the work of a user in the order
+    the envelopes came (they acknowledge at once, the work runs in the ingress queue).
+
+    Attributes:
+        - app: The bolt app of the worker.
+        - inbox: The queue of the envelopes of the worker.
+        - responses: The queue of the responses of all workers.
+    """
+
+    def __init__(self, app: App, inbox: Any, responses: Any):
+        """
+        The constructor.
+
+        Parameters:
+            - app: The bolt app of the worker.
+            - inbox: The queue of the envelopes of the worker (multiprocessing.Queue).
+            - responses: The queue of the responses of all workers (multiprocessing.Queue).
+        """
+        self.app = app
+        self.inbox = inbox
+        self.responses = responses
+
+    def start(self):
+        """
+        Starts the thread that dispatches the envelopes.
+        """
+        threading.Thread(target=self._run, name="envelope_worker", daemon=True).start()
+
+    def _run(self):
+        while True:
+            envelope_id, payload = self.inbox.get()
+            try:
+                response = self.app.dispatch(BoltRequest(body=payload, mode="socket_mode"))
+                self.responses.put(
+                    (envelope_id, response.status, response.body, dict(response.headers))
+                )
+            except Exception as e:
+                logging.exception("[ROUTER] Envelope not dispatched: " + str(e))
+                # The router forgets the envelope, Slack retries the events without an acknowledgement
+                self.responses.put((envelope_id, 500, "", {}))